@@ -0,0 +1,353 @@
+"""
+Closed-loop load-testing harness for the REST API.
+
+Starts (optionally) a throwaway mongod, a stub OpenWeatherMap server and the
+Django app, then drives a configurable mix of concurrent users against
+/api/inputs/, /api/results/ and /api/historical-data/. Reports p50/p95/p99
+latency, throughput, error rate and the rate of requests rejected by admission
+control (429) per endpoint, saves the run as JSON and can compare two saved
+runs. All simulated users share one client address, so use --no-rate-limit to
+measure raw capacity without the per-client token buckets. --storage sqlite
+runs the app on the embedded SQLite backend instead of MongoDB.
+
+Examples:
+    python load_test.py --users 20 --duration 60 --label baseline
+    python load_test.py --users 50 --rate 200 --mix inputs=1,results=5,history=2
+    python load_test.py --storage sqlite --label sqlite
+    python load_test.py --compare loadtest_runs/baseline.json loadtest_runs/candidate.json
+"""
+import argparse
+import json
+import math
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+import requests
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+LOCATIONS = ['Chennai', 'Bangalore', 'Mumbai', 'Delhi', 'Hyderabad', 'Coimbatore']
+
+ENDPOINTS = {
+    'inputs': ('POST', '/api/inputs/'),
+    'results': ('GET', '/api/results/'),
+    'history': ('GET', '/api/historical-data/'),
+}
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+class StubWeatherHandler(BaseHTTPRequestHandler):
+    """
+    Minimal stand-in for the OpenWeatherMap geocoding and forecast APIs.
+    """
+    latency = 0.0
+
+    def do_GET(self):
+        if self.latency:
+            time.sleep(self.latency)
+        path = urlparse(self.path).path
+        if path.startswith('/geo/1.0/direct'):
+            body = [{'lat': 13.08, 'lon': 80.27}]
+        elif path.startswith('/data/2.5/forecast'):
+            now = int(time.time())
+            body = {'list': [
+                {'dt': now + i * 10800, 'rain': {'3h': round(random.uniform(0, 2), 2)}}
+                for i in range(40)
+            ]}
+        else:
+            self.send_error(404)
+            return
+        payload = json.dumps(body).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_stub_weather(latency_ms):
+    StubWeatherHandler.latency = latency_ms / 1000.0
+    server = ThreadingHTTPServer(('127.0.0.1', free_port()), StubWeatherHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def start_mongod(port):
+    if not shutil.which('mongod'):
+        sys.exit('mongod not found on PATH; pass --mongo-uri to use an existing server')
+    dbpath = tempfile.mkdtemp(prefix='loadtest-mongo-')
+    process = subprocess.Popen(
+        ['mongod', '--dbpath', dbpath, '--port', str(port), '--bind_ip', '127.0.0.1'],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    return process, dbpath
+
+def start_app(port, env, server_command):
+    if server_command:
+        command = server_command.format(port=port).split()
+    else:
+        command = [sys.executable, 'manage.py', 'runserver', f'127.0.0.1:{port}', '--noreload']
+    return subprocess.Popen(
+        command, cwd=BACKEND_DIR, env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+
+def wait_for(url, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            requests.get(url, timeout=2)
+            return
+        except requests.RequestException:
+            time.sleep(0.5)
+    sys.exit(f'Timed out waiting for {url}')
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        if name not in ENDPOINTS:
+            sys.exit(f'Unknown endpoint in mix: {name}')
+        mix[name] = float(weight or 1)
+    return mix
+
+def input_payload():
+    return {
+        'roofArea': random.randint(60, 250),
+        'outflow': random.randint(80, 400),
+        'location': random.choice(LOCATIONS),
+        'tankCapacity': random.choice([1000, 2000, 5000, 10000]),
+    }
+
+class Pacer:
+    """
+    Shared pacing for a global target request rate (None = as fast as possible).
+    """
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0.0
+        self.next_time = time.perf_counter()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self.lock:
+            scheduled = max(self.next_time, time.perf_counter())
+            self.next_time = scheduled + self.interval
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+
+def run_user(base_url, mix, pacer, think_time, stop_at, warmup_until, samples, lock):
+    session = requests.Session()
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    local = []
+    while time.perf_counter() < stop_at:
+        pacer.wait()
+        name = random.choices(names, weights)[0]
+        method, path = ENDPOINTS[name]
+        started = time.perf_counter()
+        try:
+            if method == 'POST':
+                response = session.post(base_url + path, json=input_payload(), timeout=30)
+            else:
+                response = session.get(base_url + path, timeout=30)
+            ok = response.status_code < 400 or (name == 'results' and response.status_code == 404)
+            rejected = response.status_code == 429
+        except requests.RequestException:
+            ok = False
+            rejected = False
+        finished = time.perf_counter()
+        if started >= warmup_until:
+            local.append((name, finished - started, ok, rejected))
+        if think_time:
+            time.sleep(random.expovariate(1.0 / think_time))
+    with lock:
+        samples.extend(local)
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    # Nearest-rank percentile
+    index = max(0, math.ceil(fraction * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+def summarize(samples, duration):
+    report = {}
+    for name in sorted({sample[0] for sample in samples}):
+        latencies = sorted(sample[1] for sample in samples if sample[0] == name)
+        errors = sum(1 for sample in samples if sample[0] == name and not sample[2])
+        rejected = sum(1 for sample in samples if sample[0] == name and sample[3])
+        report[name] = {
+            'requests': len(latencies),
+            'throughput': len(latencies) / duration,
+            'error_rate': errors / len(latencies),
+            'rejected_rate': rejected / len(latencies),
+            'p50_ms': percentile(latencies, 0.50) * 1000,
+            'p95_ms': percentile(latencies, 0.95) * 1000,
+            'p99_ms': percentile(latencies, 0.99) * 1000,
+            'mean_ms': sum(latencies) / len(latencies) * 1000,
+        }
+    return report
+
+def print_report(report):
+    print(f"{'endpoint':<10} {'reqs':>8} {'req/s':>8} {'err%':>6} {'429%':>6} {'p50ms':>8} {'p95ms':>8} {'p99ms':>8}")
+    for name, stats in report.items():
+        print(
+            f"{name:<10} {stats['requests']:>8} {stats['throughput']:>8.1f} "
+            f"{stats['error_rate'] * 100:>6.2f} {stats.get('rejected_rate', 0) * 100:>6.2f} "
+            f"{stats['p50_ms']:>8.1f} {stats['p95_ms']:>8.1f} {stats['p99_ms']:>8.1f}"
+        )
+
+def compare(base_path, candidate_path):
+    with open(base_path) as fh:
+        base = json.load(fh)
+    with open(candidate_path) as fh:
+        candidate = json.load(fh)
+    print(f"Comparing {base['label']} -> {candidate['label']}")
+    print(f"{'endpoint':<10} {'metric':<11} {'base':>10} {'candidate':>10} {'change':>8}")
+    for name in sorted(set(base['report']) | set(candidate['report'])):
+        for metric in ('throughput', 'p50_ms', 'p95_ms', 'p99_ms', 'error_rate', 'rejected_rate'):
+            old = base['report'].get(name, {}).get(metric)
+            new = candidate['report'].get(name, {}).get(metric)
+            if old is None or new is None:
+                continue
+            change = f"{(new - old) / old * 100:+.1f}%" if old else 'n/a'
+            print(f"{name:<10} {metric:<11} {old:>10.2f} {new:>10.2f} {change:>8}")
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=BACKEND_DIR,
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description='Load-test the rainwater harvester API')
+    parser.add_argument('--users', type=int, default=10, help='Concurrent closed-loop users')
+    parser.add_argument('--duration', type=float, default=30, help='Measured seconds')
+    parser.add_argument('--warmup', type=float, default=5, help='Unmeasured warm-up seconds')
+    parser.add_argument('--rate', type=float, help='Global target requests/second (default: unpaced)')
+    parser.add_argument('--think-time', type=float, default=0.0, help='Mean think time per user (s)')
+    parser.add_argument('--mix', default='inputs=1,results=3,history=2',
+                        help='Endpoint weights, e.g. inputs=1,results=3,history=2')
+    parser.add_argument('--mongo-uri', help='Use an existing MongoDB instead of starting mongod')
+    parser.add_argument('--storage', choices=['mongodb', 'sqlite'], default='mongodb',
+                        help='Storage backend of the started app')
+    parser.add_argument('--base-url', help='Target an already running app instead of starting one')
+    parser.add_argument('--server-command', help='Command to start the app, with {port} placeholder')
+    parser.add_argument('--stub-latency-ms', type=float, default=50, help='Stub weather API latency')
+    parser.add_argument('--no-rate-limit', action='store_true',
+                        help='Disable the per-client token buckets of the started app')
+    parser.add_argument('--label', default=datetime.now().strftime('run-%Y%m%d-%H%M%S'))
+    parser.add_argument('--output-dir', default=os.path.join(BACKEND_DIR, 'loadtest_runs'))
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--compare', nargs=2, metavar=('BASE', 'CANDIDATE'),
+                        help='Compare two saved runs and exit')
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    random.seed(args.seed)
+    mix = parse_mix(args.mix)
+    processes = []
+    data_dir = None
+    stub = None
+    try:
+        base_url = args.base_url
+        if not base_url:
+            mongo_uri = args.mongo_uri
+            if args.storage == 'sqlite':
+                data_dir = tempfile.mkdtemp(prefix='loadtest-sqlite-')
+            elif not mongo_uri:
+                mongo_port = free_port()
+                mongod, data_dir = start_mongod(mongo_port)
+                processes.append(mongod)
+                mongo_uri = f'mongodb://127.0.0.1:{mongo_port}/'
+
+            stub = start_stub_weather(args.stub_latency_ms)
+            app_port = free_port()
+            env = dict(os.environ)
+            if mongo_uri:
+                env['MONGODB_URI'] = mongo_uri
+            env.update({
+                'MONGODB_NAME': f'loadtest_{args.label}'.replace('-', '_'),
+                'OPENWEATHERMAP_BASE_URL': f'http://127.0.0.1:{stub.server_address[1]}',
+                'OPENWEATHERMAP_API_KEY': 'stub',
+                'DEBUG': 'False',
+            })
+            if args.storage == 'sqlite':
+                env.update({
+                    'STORAGE_BACKEND': 'sqlite',
+                    'SQLITE_STORAGE_PATH': os.path.join(data_dir, 'storage.sqlite3'),
+                })
+            if args.no_rate_limit:
+                env.update({'ADMISSION_INPUTS_RATE': '0', 'ADMISSION_WEATHER_RATE': '0'})
+            processes.append(start_app(app_port, env, args.server_command))
+            base_url = f'http://127.0.0.1:{app_port}'
+            wait_for(base_url + '/')
+
+        print(f"Driving {args.users} users for {args.duration}s (+{args.warmup}s warm-up) against {base_url}")
+        samples = []
+        lock = threading.Lock()
+        pacer = Pacer(args.rate)
+        warmup_until = time.perf_counter() + args.warmup
+        stop_at = warmup_until + args.duration
+        threads = [
+            threading.Thread(
+                target=run_user,
+                args=(base_url, mix, pacer, args.think_time, stop_at, warmup_until, samples, lock)
+            )
+            for _ in range(args.users)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        report = summarize(samples, args.duration)
+        print_report(report)
+
+        os.makedirs(args.output_dir, exist_ok=True)
+        path = os.path.join(args.output_dir, f'{args.label}.json')
+        with open(path, 'w') as fh:
+            json.dump({
+                'label': args.label,
+                'timestamp': datetime.now().isoformat(),
+                'revision': git_revision(),
+                'config': {key: value for key, value in vars(args).items() if key != 'compare'},
+                'report': report,
+            }, fh, indent=2)
+        print(f"Saved run to {path}")
+    finally:
+        for process in reversed(processes):
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        if stub:
+            stub.shutdown()
+        if data_dir:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
@@ -10,6 +10,7 @@ django.setup()
 
 from django.conf import settings
 from pymongo import MongoClient
+from rainwater_harvester.api.history_search import parse_search, build_query
 
 class MongoJSONEncoder(json.JSONEncoder):
     def default(self, obj):
@@ -23,6 +24,11 @@ def print_results(title, results):
     print(f"\n=== {title} ===")
     print(json.dumps(list(results), indent=2, cls=MongoJSONEncoder))
 
+def search(db, params, limit=3):
+    # Same filters as GET /api/historical-data/search/?<params>
+    query, sort = build_query(parse_search(dict(params, limit=str(limit))))
+    return db.historical_data.find(query).sort(sort).limit(limit)
+
 def main():
     # Connect to MongoDB
     client = MongoClient(settings.MONGODB_URI)
@@ -30,32 +36,22 @@ def main():
     
     # 1. Find all leaking tanks
     print_results("Leaking Tanks", 
-        db.historical_data.find({"isLeaking": True}).limit(3)
+        search(db, {"isLeaking": "true"})
     )
     
     # 2. Find tanks with high water usage (drinking > 45%)
     print_results("High Drinking Water Usage", 
-        db.historical_data.find({"waterUsage.drinking": {"$gt": 45}}).limit(3)
+        search(db, {"drinkingShare__gt": "45", "sort": "-drinkingShare"})
     )
     
     # 3. Find tanks in Chennai with capacity > 3000
     print_results("Large Tanks in Chennai",
-        db.historical_data.find({
-            "location": "Chennai",
-            "tankCapacity": {"$gt": 3000}
-        }).limit(3)
+        search(db, {"location": "Chennai", "tankCapacity__gt": "3000", "sort": "tankCapacity"})
     )
     
-    # 4. Find tanks with low water level (< 30% of capacity)
+    # 4. Find tanks with low water level (< 30% of capacity), using the stored fill ratio
     print_results("Low Water Level Tanks",
-        db.historical_data.find({
-            "$expr": {
-                "$lt": [
-                    {"$divide": ["$currentLevel", "$tankCapacity"]},
-                    0.3
-                ]
-            }
-        }).limit(3)
+        search(db, {"fillRatio__lt": "0.3", "sort": "fillRatio"})
     )
     
     # 5. Find average rainfall by location
@@ -0,0 +1,196 @@
+"""
+Admission control for expensive endpoints.
+
+Each policy in settings.ADMISSION_CONTROL covers one path and set of methods
+and combines:
+
+- a token bucket per client (`rate` requests/second, bursts up to `burst`),
+  so one noisy client cannot use up everyone's capacity
+- a concurrency limit (`concurrency` requests in progress) with a bounded
+  FIFO wait queue (`queue` requests waiting at most `queue_timeout` seconds;
+  a freed slot is handed to the request that has waited longest)
+
+Requests over either limit are rejected straight away with 429 and a
+Retry-After header instead of piling up behind slow upstream calls. Limits
+apply per server process.
+"""
+import math
+import threading
+import time
+from collections import OrderedDict, deque
+
+class TokenBucket:
+    """
+    Classic token bucket; not thread-safe on its own (ClientBuckets locks).
+    """
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate, capacity, now):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def take(self, now):
+        """
+        Take one token. Returns 0 on success, otherwise the seconds until one
+        is available.
+        """
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+class ClientBuckets:
+    """
+    Token buckets per client, keeping the most recently seen `max_clients`.
+    """
+    def __init__(self, rate, burst, max_clients):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, client):
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(client)
+            if bucket is None:
+                bucket = self._buckets[client] = TokenBucket(self.rate, self.burst, now)
+                if len(self._buckets) > self.max_clients:
+                    # Forget the least recently seen client (its bucket would be full again anyway)
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(client)
+            return bucket.take(now)
+
+class ConcurrencyLimiter:
+    """
+    Lets `limit` callers in at once; up to `queue` more wait for a slot, in
+    arrival order.
+    """
+    def __init__(self, limit, queue, queue_timeout):
+        self.limit = limit
+        self.queue = queue
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        # Moving average of how long admitted requests hold a slot
+        self.service_time = 0.1
+        # One event per waiting caller, oldest first
+        self._waiters = deque()
+        self._lock = threading.Lock()
+
+    @property
+    def waiting(self):
+        return len(self._waiters)
+
+    def acquire(self):
+        """
+        Take a slot. Returns True if admitted, False if the queue is full or
+        no slot freed up within queue_timeout.
+        """
+        with self._lock:
+            if self.active < self.limit and not self._waiters:
+                self.active += 1
+                return True
+            if len(self._waiters) >= self.queue:
+                return False
+            waiter = threading.Event()
+            self._waiters.append(waiter)
+        if waiter.wait(self.queue_timeout):
+            return True
+        with self._lock:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+                return False
+        # A slot was handed over just as the wait timed out
+        return True
+
+    def release(self, held_for):
+        with self._lock:
+            self.service_time = 0.9 * self.service_time + 0.1 * held_for
+            if self._waiters:
+                # Hand the slot straight to the oldest waiter (active stays the same)
+                self._waiters.popleft().set()
+            else:
+                self.active -= 1
+
+    def retry_after(self):
+        """
+        Estimate the seconds until the current backlog has drained.
+        """
+        with self._lock:
+            backlog = self.active + len(self._waiters)
+        return self.service_time * backlog / max(self.limit, 1)
+
+class AdmissionPolicy:
+    """
+    The limits for one endpoint, plus counters of what they decided.
+    """
+    def __init__(self, name, path, methods, rate, burst, concurrency, queue, queue_timeout, max_clients):
+        self.name = name
+        self.path = path
+        self.methods = {method.upper() for method in methods}
+        self.buckets = ClientBuckets(rate, burst, max_clients) if rate else None
+        self.limiter = ConcurrencyLimiter(concurrency, queue, queue_timeout) if concurrency else None
+        self.counts = {'admitted': 0, 'rate_limited': 0, 'overloaded': 0}
+        self._counts_lock = threading.Lock()
+
+    def _count(self, outcome):
+        with self._counts_lock:
+            self.counts[outcome] += 1
+
+    def matches(self, request):
+        return request.method in self.methods and request.path == self.path
+
+    def admit(self, client):
+        """
+        Decide on a request. Returns (admitted, retry_after_seconds).
+        A caller that was admitted must call done() when finished.
+        """
+        if self.buckets is not None:
+            wait = self.buckets.take(client)
+            if wait:
+                self._count('rate_limited')
+                return False, wait
+        if self.limiter is not None and not self.limiter.acquire():
+            self._count('overloaded')
+            return False, self.limiter.retry_after()
+        self._count('admitted')
+        return True, 0
+
+    def done(self, held_for):
+        if self.limiter is not None:
+            self.limiter.release(held_for)
+
+    def stats(self):
+        with self._counts_lock:
+            stats = dict(self.counts)
+        if self.limiter is not None:
+            stats.update(active=self.limiter.active, waiting=self.limiter.waiting)
+        return stats
+
+def build_policies(config, max_clients):
+    """
+    Build AdmissionPolicy objects from the ADMISSION_CONTROL setting.
+    """
+    return [
+        AdmissionPolicy(
+            name,
+            options['path'],
+            options.get('methods', ['POST']),
+            options.get('rate', 0),
+            options.get('burst', 1),
+            options.get('concurrency', 0),
+            options.get('queue', 0),
+            options.get('queue_timeout', 0),
+            max_clients
+        )
+        for name, options in config.items()
+    ]
+
+def retry_after_header(seconds):
+    return str(max(1, math.ceil(seconds)))
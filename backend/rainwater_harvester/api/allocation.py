@@ -0,0 +1,143 @@
+"""
+Forecast-horizon water allocation planning.
+
+Plans how much tank water to use each day of the forecast, and for what, so
+that the value of the water used is as high as possible. Each use has a value
+per liter and a daily demand (a share of the site's daily consumption);
+drinking is worth more than cleaning, which is worth more than gardening.
+Water still in the tank at the end of the horizon keeps CARRYOVER_VALUE per
+liter, and rain that doesn't fit in the tank overflows and is lost.
+CARRYOVER_VALUE is below the value of every use, so water is only held back
+when it would otherwise overflow later (or to cover a higher-value use on a
+later day), never instead of meeting today's demand.
+
+The plan comes from dynamic programming over tank levels discretised into
+ALLOCATION_LEVELS steps: each day, rain is added (capped at the capacity),
+then some amount is used, split across uses in priority order. The
+backward pass produces a policy table (level -> amount to use, per day) that
+depends only on the capacity, the daily inflow and the demands, so it is cached
+and reused for every site and starting level with the same parameters.
+"""
+from functools import lru_cache
+import numpy as np
+from django.conf import settings
+
+# (use, value per liter, share of daily consumption), in priority order
+WATER_USES = (
+    ('drinking', 3.0, 0.2),
+    ('cleaning', 2.0, 0.3),
+    ('gardening', 1.0, 0.5),
+)
+
+# Value per liter of water left in the tank after the horizon; kept below the
+# lowest use value, otherwise the plan would never use water for that use
+CARRYOVER_VALUE = 0.5
+
+def use_demands(daily_consumption):
+    """
+    Split a daily consumption (liters) into per-use demands.
+    """
+    return tuple(round(max(0.0, daily_consumption) * share, 1) for _, _, share in WATER_USES)
+
+def _split(amount, demands):
+    """
+    Split amounts of water across uses in priority order. `amount` may be an
+    array; returns one array per use.
+    """
+    remaining = np.asarray(amount, dtype=float)
+    parts = []
+    for demand in demands:
+        part = np.minimum(remaining, demand)
+        parts.append(part)
+        remaining = remaining - part
+    return parts
+
+@lru_cache(maxsize=1024)
+def policy_table(capacity, inflow_steps, demands, levels):
+    """
+    Backward DP pass. Returns (policy, value): policy[t, l] is the number of
+    level steps to use on day t after that day's rain when the day starts at
+    level l; value[l] is the best total value from level l on day 0.
+
+    `inflow_steps` is each day's inflow in level steps; the arguments are
+    hashable so tables are cached.
+    """
+    step = capacity / (levels - 1)
+    grid = np.arange(levels)
+    # Value of using r steps of water, split across uses by priority
+    parts = _split(grid * step, demands)
+    reward = sum(value * part for (_, value, _), part in zip(WATER_USES, parts))
+
+    days = len(inflow_steps)
+    policy = np.zeros((days, levels), dtype=np.int32)
+    future = grid * step * CARRYOVER_VALUE
+    for t in range(days - 1, -1, -1):
+        available = np.minimum(grid + inflow_steps[t], levels - 1)
+        remaining = available[:, None] - grid[None, :]
+        feasible = remaining >= 0
+        total = np.where(feasible, reward[None, :] + future[np.clip(remaining, 0, None)], -np.inf)
+        policy[t] = np.argmax(total, axis=1)
+        future = total[grid, policy[t]]
+    return policy, future
+
+def _table_inputs(tank_capacity, daily_inflows, daily_consumption, levels):
+    capacity = float(max(1, round(tank_capacity)))
+    step = capacity / (levels - 1)
+    inflow_steps = tuple(int(round(max(0.0, inflow) / step)) for inflow in daily_inflows)
+    return capacity, inflow_steps, use_demands(daily_consumption)
+
+def plan_allocation(tank_capacity, current_level, daily_inflows, daily_consumption, dates=None, levels=None):
+    """
+    Plan daily water use over the forecast horizon for one site.
+
+    `daily_inflows` are the expected liters collected each day. Returns the
+    per-day plan and totals.
+    """
+    levels = levels or settings.ALLOCATION_LEVELS
+    capacity, inflow_steps, demands = _table_inputs(tank_capacity, daily_inflows, daily_consumption, levels)
+    policy, value = policy_table(capacity, inflow_steps, demands, levels)
+    step = capacity / (levels - 1)
+
+    level = int(round(min(max(0.0, current_level), capacity) / step))
+    start_value = float(value[level])
+    plan = []
+    totals = {name: 0.0 for name, _, _ in WATER_USES}
+    totals['overflow'] = 0.0
+    for t, inflow in enumerate(daily_inflows):
+        start_level = level
+        filled = start_level + inflow_steps[t]
+        available = min(filled, levels - 1)
+        used = int(policy[t, start_level])
+        level = available - used
+        parts = _split(used * step, demands)
+        day = {
+            'date': dates[t] if dates else None,
+            'inflow': round(float(inflow), 1),
+            'startLevel': round(start_level * step, 1),
+            'overflow': round((filled - available) * step, 1),
+            'endLevel': round(level * step, 1),
+        }
+        for (name, _, _), part in zip(WATER_USES, parts):
+            day[name] = round(float(part), 1)
+            totals[name] += float(part)
+        totals['overflow'] += day['overflow']
+        plan.append(day)
+
+    return {
+        'days': plan,
+        'totals': {name: round(amount, 1) for name, amount in totals.items()},
+        'value': round(start_value, 2),
+    }
+
+def plan_allocations(sites, levels=None):
+    """
+    Plan many sites. Each site is a dict of plan_allocation's arguments; sites
+    with the same capacity, inflows and demands share one policy table.
+    """
+    return [
+        plan_allocation(
+            site['tankCapacity'], site['currentLevel'], site['dailyInflows'],
+            site['dailyConsumption'], site.get('dates'), levels
+        )
+        for site in sites
+    ]
@@ -1,16 +1,28 @@
 """
 Calculation service for rainwater harvesting optimization.
 """
+import json
 import numpy as np
 import pandas as pd
 from datetime import datetime, timedelta
-from sklearn.linear_model import LinearRegression
-from .weather_service import get_weather_forecast
+from .weather_service import get_forecast
+from .singleflight import flight
+from .allocation import plan_allocation, plan_allocations
+from .prediction import predict_usage
 import logging
 
 # Set up logging
 logger = logging.getLogger(__name__)
 
+# Standard tank sizes (liters) that recommendations are rounded up to
+STANDARD_TANK_SIZES = np.array([500, 1000, 2000, 3000, 5000, 7500, 10000])
+
+# Identical concurrent calculations in this process share one run
+calculation_flight = flight('calculation')
+
+# Input fields that don't affect the calculation
+_UNCALCULATED_FIELDS = ('_id', 'timestamp')
+
 def calculate_inflow(rainfall, roof_area):
     """
     Calculate inflow based on rainfall, roof area, and efficiency factor.
@@ -192,7 +204,7 @@ def recommend_tank_size(average_rainfall, roof_area, daily_consumption):
         recommended_size = max(monthly_inflow, monthly_consumption) * 2
         
         # Round up to nearest standard size
-        standard_sizes = [500, 1000, 2000, 3000, 5000, 7500, 10000]
+        standard_sizes = STANDARD_TANK_SIZES.tolist()
         
         for size in standard_sizes:
             if size >= recommended_size:
@@ -217,9 +229,12 @@ def recommend_tank_size(average_rainfall, roof_area, daily_consumption):
             'monthlyConsumption': 0
         }
 
-def generate_maintenance_schedule(current_date=None):
+def generate_maintenance_schedule(current_date=None, include_cleaning=True):
     """
     Generate maintenance schedule for tank cleaning and system inspection.
+    
+    Cleaning reminders are left out when `include_cleaning` is False
+    (the user turned off the alertForCleaning setting).
     """
     try:
         if current_date is None:
@@ -228,7 +243,7 @@ def generate_maintenance_schedule(current_date=None):
         schedule = []
         
         # Generate cleaning reminders for the next year (every 3 months)
-        for i in range(4):
+        for i in range(4 if include_cleaning else 0):
             reminder_date = current_date + timedelta(days=(i + 1) * 90)
             
             schedule.append({
@@ -268,9 +283,145 @@ def generate_maintenance_schedule(current_date=None):
             }
         ]
 
-def process_inputs(input_data):
+# Order of the axes in a scenario sweep grid
+SCENARIO_AXES = ('roofArea', 'tankCapacity', 'waterCostPerLiter', 'setupCost', 'maintenanceCost')
+
+def sweep_scenarios(average_rainfall, outflow, axes):
+    """
+    Evaluate a grid of what-if scenarios in one vectorized pass.
+    
+    `axes` maps each name in SCENARIO_AXES to a sequence of values. The grid is
+    their cartesian product; every metric is returned as an array with one
+    dimension per axis, in SCENARIO_AXES order. Formulas match process_inputs.
+    """
+    grids = np.meshgrid(
+        *[np.maximum(np.asarray(axes[name], dtype=float), 0) for name in SCENARIO_AXES],
+        indexing='ij',
+        sparse=True
+    )
+    roof_area, tank_capacity, water_cost, setup_cost, maintenance_cost = grids
+    average_rainfall = max(0, average_rainfall)
+    outflow = max(0, outflow)
+    shape = tuple(len(axes[name]) for name in SCENARIO_AXES)
+    
+    # Inflow (Rainfall × Roof Area × 0.9)
+    daily_inflow = average_rainfall * roof_area * 0.9
+    yearly_inflow = daily_inflow * 365
+    
+    # ROI
+    savings = yearly_inflow * water_cost
+    costs = setup_cost + maintenance_cost
+    roi = savings - costs
+    with np.errstate(divide='ignore', invalid='ignore'):
+        payback_period = np.where(savings > 0, costs / (savings / 365), 0)
+    
+    # Tank size recommendation, rounded up to a standard size
+    monthly_inflow = average_rainfall * 30 * roof_area * 0.9
+    recommended = np.maximum(monthly_inflow, outflow * 30) * 2
+    index = np.searchsorted(STANDARD_TANK_SIZES, recommended)
+    recommended_size = np.where(
+        index < len(STANDARD_TANK_SIZES),
+        STANDARD_TANK_SIZES[np.minimum(index, len(STANDARD_TANK_SIZES) - 1)],
+        np.ceil(recommended / 5000) * 5000
+    )
+    
+    return {
+        'dailyInflow': np.broadcast_to(daily_inflow, shape),
+        'yearlyInflow': np.broadcast_to(yearly_inflow, shape),
+        'savings': np.broadcast_to(savings, shape),
+        'roi': np.broadcast_to(roi, shape),
+        'paybackPeriod': np.broadcast_to(payback_period, shape),
+        'recommendedSize': np.broadcast_to(recommended_size, shape),
+        'capacityGap': np.broadcast_to(recommended_size - tank_capacity, shape),
+    }
+
+def simulate_tank_levels(average_rainfall, roof_area, tank_capacity, daily_consumption, days, runs, rng,
+                         wet_probability=0.35, gamma_shape=0.8):
+    """
+    Monte Carlo simulation of the daily tank water balance.
+    
+    Each run draws a random rainfall series whose mean is `average_rainfall`
+    (wet days with gamma-distributed amounts) and starts half full. Runs are
+    simulated together, one vectorized step per day. Returns per-run arrays of
+    reliability (fraction of demand met), days the tank ran dry, overflow
+    (liters) and the final level.
+    """
+    average_rainfall = max(0, average_rainfall)
+    roof_area = max(0, roof_area)
+    tank_capacity = max(0, tank_capacity)
+    daily_consumption = max(0, daily_consumption)
+    scale = average_rainfall / (wet_probability * gamma_shape)
+    
+    level = np.full(runs, tank_capacity * 0.5)
+    supplied = np.zeros(runs)
+    overflow = np.zeros(runs)
+    empty_days = np.zeros(runs, dtype=int)
+    for _ in range(days):
+        wet = rng.random(runs) < wet_probability
+        rainfall = np.where(wet, rng.gamma(gamma_shape, scale, runs), 0) if scale > 0 else 0
+        level = level + rainfall * roof_area * 0.9
+        overflow += np.maximum(level - tank_capacity, 0)
+        level = np.minimum(level, tank_capacity)
+        used = np.minimum(level, daily_consumption)
+        supplied += used
+        empty_days += used < daily_consumption
+        level -= used
+    
+    demand = daily_consumption * days
+    return {
+        'reliability': supplied / demand if demand > 0 else np.ones(runs),
+        'emptyDays': empty_days,
+        'overflow': overflow,
+        'finalLevel': level,
+    }
+
+def plan_site_allocations(sites):
+    """
+    Plan daily water use over the forecast for a batch of sites.
+    
+    Each site needs location, roofArea, tankCapacity and outflow (daily
+    consumption), and optionally currentLevel (default: half full).
+    Forecasts are fetched once per location.
+    """
+    forecasts = {site['location']: None for site in sites}
+    for location in forecasts:
+        forecasts[location] = get_forecast(location)
+    
+    plans = plan_allocations([
+        {
+            'tankCapacity': site['tankCapacity'],
+            'currentLevel': site.get('currentLevel', site['tankCapacity'] * 0.5),
+            'dailyInflows': calculate_inflow(forecasts[site['location']].days['rainfall'], site['roofArea']).tolist(),
+            'dailyConsumption': site['outflow'],
+            'dates': forecasts[site['location']].dates(),
+        }
+        for site in sites
+    ])
+    for site, plan in zip(sites, plans):
+        plan['location'] = site['location']
+    return plans
+
+def process_inputs(input_data, user_settings=None):
     """
     Process user inputs and generate results.
+    
+    `user_settings` is the settings document; only alertForCleaning is used here.
+    Concurrent calls with the same inputs share one calculation.
+    """
+    alert_for_cleaning = (user_settings or {}).get('alertForCleaning', True)
+    key = json.dumps(
+        [{k: v for k, v in input_data.items() if k not in _UNCALCULATED_FIELDS}, alert_for_cleaning],
+        sort_keys=True,
+        default=str
+    )
+    results = calculation_flight.do(key, lambda: _process_inputs(input_data, user_settings))
+    # A shared result carries the inputs of the call that computed it
+    results['inputs'] = input_data
+    return results
+
+def _process_inputs(input_data, user_settings=None):
+    """
+    Run the calculations for process_inputs.
     """
     try:
         logger.info("Starting process_inputs with data")
@@ -288,9 +439,9 @@ def process_inputs(input_data):
         
         # Get weather forecast
         logger.info(f"Getting weather forecast for location: {location}")
-        weather_data = get_weather_forecast(location)
-        logger.info(f"Weather data received with average rainfall: {weather_data.get('averageRainfall', 0)}")
-        average_rainfall = weather_data.get('averageRainfall', 0)
+        forecast = get_forecast(location)
+        average_rainfall = forecast.average_rainfall
+        logger.info(f"Weather data received with average rainfall: {average_rainfall}")
         
         # Calculate daily inflow
         logger.info(f"Calculating inflow with rainfall: {average_rainfall}, roof area: {roof_area}")
@@ -325,8 +476,25 @@ def process_inputs(input_data):
         tank_recommendation = recommend_tank_size(average_rainfall, roof_area, outflow)
         logger.info(f"Tank recommendation result: {tank_recommendation}")
         
+        # Plan daily water use over the forecast horizon
+        allocation_plan = plan_allocation(
+            tank_capacity,
+            current_level,
+            calculate_inflow(forecast.days['rainfall'], roof_area).tolist(),
+            outflow,
+            forecast.dates()
+        )
+        
+        # Compare with what the location's history predicts
+        try:
+            usage_prediction = predict_usage(location, average_rainfall, tank_capacity, outflow)
+        except Exception as e:
+            logger.warning(f"Usage prediction unavailable for {location}: {str(e)}")
+            usage_prediction = None
+        
         # Generate maintenance schedule
-        maintenance_schedule = generate_maintenance_schedule()
+        alert_for_cleaning = (user_settings or {}).get('alertForCleaning', True)
+        maintenance_schedule = generate_maintenance_schedule(include_cleaning=alert_for_cleaning)
         
         # Prepare results
         logger.info("Preparing final results")
@@ -342,8 +510,11 @@ def process_inputs(input_data):
             'roi': roi,
             'waterUsage': water_usage,
             'tankRecommendation': tank_recommendation,
+            'allocationPlan': allocation_plan,
+            'usagePrediction': usage_prediction,
             'maintenanceSchedule': maintenance_schedule,
-            'weatherData': weather_data
+            # Converted to the response shape only here, at the edge
+            'weatherData': forecast.to_dict()
         }
         
         logger.info("Process inputs completed successfully")
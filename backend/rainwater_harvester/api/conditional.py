@@ -0,0 +1,71 @@
+"""
+Conditional GET support (ETag / If-None-Match) for polled endpoints.
+
+ETags are derived from a per-collection change counter plus the collection's
+document count, both of which are cheap lookups in either storage backend. An unchanged
+collection therefore answers with 304 Not Modified without running the real
+query.
+"""
+import hashlib
+import logging
+from rest_framework import status
+from rest_framework.response import Response
+from .repository import collection_state
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Suffixes added to the ETag by the compression middleware, one per encoding
+ENCODING_SUFFIXES = ('-br', '-gzip')
+
+def collection_etag(collection_name, variant=''):
+    """
+    Build a strong ETag for the current state of a collection.
+
+    `variant` distinguishes different representations served from the same
+    collection (e.g. different query parameters).
+    """
+    # The count catches writes made outside the app that did not bump the version
+    version, count = collection_state(collection_name)
+    digest = hashlib.sha1(
+        f"{collection_name}:{version}:{count}:{variant}".encode('utf-8')
+    ).hexdigest()
+    return f'"{digest}"'
+
+def _normalize_etag(etag):
+    """
+    Strip the weak prefix and any content-encoding suffix from an ETag.
+    """
+    etag = etag.strip()
+    if etag.startswith('W/'):
+        etag = etag[2:]
+    for suffix in ENCODING_SUFFIXES:
+        if etag.endswith(f'{suffix}"'):
+            return etag[:-len(suffix) - 1] + '"'
+    return etag
+
+def etag_matches(request, etag):
+    """
+    Check whether the request's If-None-Match header matches the given ETag.
+    """
+    header = request.META.get('HTTP_IF_NONE_MATCH')
+    if not header:
+        return False
+    if header.strip() == '*':
+        return True
+    return any(_normalize_etag(candidate) == etag for candidate in header.split(','))
+
+def not_modified(etag):
+    """
+    Build an empty 304 response carrying the ETag.
+    """
+    response = Response(status=status.HTTP_304_NOT_MODIFIED)
+    return with_etag(response, etag)
+
+def with_etag(response, etag):
+    """
+    Attach the ETag and ask clients to revalidate on every poll.
+    """
+    response['ETag'] = etag
+    response['Cache-Control'] = 'private, no-cache'
+    return response
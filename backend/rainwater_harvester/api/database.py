@@ -1,11 +1,15 @@
 """
 Database utility functions using Django models.
+
+Reads and writes of application data go through `repository.py`; this module
+holds the shared connection, collection versions, indexes and status checks.
 """
 import logging
-from datetime import datetime
 from django.conf import settings
-from pymongo import MongoClient
+from pymongo import MongoClient, ASCENDING, DESCENDING
+from pymongo.errors import OperationFailure
 from django.apps import apps
+from .history_search import SEARCH_INDEXES
 
 # Get model classes
 UserInput = apps.get_model('api', 'UserInput')
@@ -20,175 +24,73 @@ db = client[settings.MONGODB_NAME]
 # Set up logging
 logger = logging.getLogger(__name__)
 
-def save_user_input(input_data):
-    """
-    Save user inputs to MongoDB.
-    """
-    try:
-        # Add timestamp if not present
-        if 'timestamp' not in input_data:
-            input_data['timestamp'] = datetime.now().isoformat()
-
-        # Save to MongoDB
-        result = db.user_inputs.insert_one(input_data)
-        logger.info(f"Input data saved to MongoDB with ID: {result.inserted_id}")
-        
-        # Return the saved document
-        return db.user_inputs.find_one({'_id': result.inserted_id})
-    except Exception as e:
-        logger.error(f"Error saving input data to MongoDB: {str(e)}")
-        return None
-
-def get_latest_inputs():
-    """
-    Get the latest user inputs from MongoDB.
-    """
-    try:
-        # Get the most recent input by timestamp
-        return db.user_inputs.find_one(
-            sort=[('timestamp', -1)]
-        )
-    except Exception as e:
-        logger.error(f"Error getting latest inputs from MongoDB: {str(e)}")
-        return None
-
-def save_calculation_results(results_data):
-    """
-    Save calculation results to MongoDB.
-    """
-    try:
-        # Get the latest input
-        latest_input = get_latest_inputs()
-        
-        if latest_input:
-            # Prepare the calculation result document
-            result_doc = {
-                'timestamp': datetime.now().isoformat(),
-                'input_data': latest_input,
-                'data': results_data
-            }
-            
-            # Save to MongoDB
-            result = db.calculation_results.insert_one(result_doc)
-            logger.info(f"Calculation results saved to MongoDB with ID: {result.inserted_id}")
-            
-            # Return the saved document
-            return db.calculation_results.find_one({'_id': result.inserted_id})
-        return None
-    except Exception as e:
-        logger.error(f"Error saving calculation results to MongoDB: {str(e)}")
-        return None
-
-def get_latest_results():
-    """
-    Get the latest calculation results from MongoDB.
-    """
-    try:
-        # Get the most recent result by timestamp
-        return db.calculation_results.find_one(
-            sort=[('timestamp', -1)]
-        )
-    except Exception as e:
-        logger.error(f"Error getting latest results from MongoDB: {str(e)}")
-        return None
-
-def get_results_by_input_id(input_id):
-    """
-    Get calculation results for a specific input ID.
-    """
-    try:
-        return db.calculation_results.find({'input_data._id': input_id})
-    except Exception as e:
-        logger.error(f"Error getting results by input ID: {str(e)}")
-        return None
+# Indexes on quantile_sketches (also built on the staging collection of a rebuild)
+SKETCH_INDEXES = (
+    [('location', ASCENDING), ('month', ASCENDING)],
+    [('month', ASCENDING)],
+)
 
-def save_historical_data(historical_data):
-    """
-    Save historical data to MongoDB.
-    """
-    try:
-        # Add timestamp if not present
-        if 'timestamp' not in historical_data:
-            historical_data['timestamp'] = datetime.now().isoformat()
-            
-        # Save to MongoDB
-        result = db.historical_data.insert_one(historical_data)
-        logger.info(f"Historical data saved to MongoDB with ID: {result.inserted_id}")
-        
-        # Return the saved document
-        return db.historical_data.find_one({'_id': result.inserted_id})
-    except Exception as e:
-        logger.error(f"Error saving historical data to MongoDB: {str(e)}")
-        return None
+# Indexes replaced by newer ones, dropped by ensure_indexes: (collection, index name)
+LEGACY_INDEXES = (
+    # Superseded by the SEARCH_INDEXES that end in _id
+    ('historical_data', 'timestamp_-1'),
+    ('historical_data', 'location_1_timestamp_1'),
+)
 
-def get_historical_data(limit=100):
+def bump_collection_version(collection_name):
     """
-    Get historical data from MongoDB, limited to the most recent entries.
-    """
-    try:
-        # Get the most recent entries by timestamp
-        cursor = db.historical_data.find().sort('timestamp', -1).limit(limit)
-        return list(cursor)
-    except Exception as e:
-        logger.error(f"Error getting historical data from MongoDB: {str(e)}")
-        return []
+    Increment the change counter for a collection.
 
-def save_user_settings(settings_data):
-    """
-    Save user settings to MongoDB.
+    Views use the counter to build ETags, so every write path that changes
+    what a GET endpoint returns should bump it.
     """
     try:
-        # Add timestamp
-        settings_data['last_updated'] = datetime.now().isoformat()
-        
-        # Update or insert settings document
-        result = db.user_settings.update_one(
-            {'_id': 'default'},  # We only need one settings document
-            {'$set': settings_data},
+        db.collection_versions.update_one(
+            {'_id': collection_name},
+            {'$inc': {'version': 1}},
             upsert=True
         )
-        
-        logger.info(f"Settings saved to MongoDB")
-        
-        # Return the updated settings
-        return db.user_settings.find_one({'_id': 'default'})
-    except Exception as e:
-        logger.error(f"Error saving settings to MongoDB: {str(e)}")
-        return None
-
-def get_user_settings():
-    """
-    Get user settings from MongoDB.
-    """
-    try:
-        settings = db.user_settings.find_one({'_id': 'default'})
-        return settings if settings else None
-    except Exception as e:
-        logger.error(f"Error getting user settings from MongoDB: {str(e)}")
-        return None
-
-def delete_saved_result(result_id):
-    """
-    Delete a saved result by its ID from MongoDB.
-    """
-    try:
-        # Try to delete from calculation results
-        result = db.calculation_results.delete_one({'_id': result_id})
-        if result.deleted_count > 0:
-            logger.info(f"Result {result_id} deleted from calculation_results")
-            return True
-            
-        # If not found in calculation results, try historical data
-        result = db.historical_data.delete_one({'_id': result_id})
-        if result.deleted_count > 0:
-            logger.info(f"Result {result_id} deleted from historical_data")
-            return True
-            
-        logger.warning(f"No result found with ID: {result_id}")
-        return False
     except Exception as e:
-        logger.error(f"Error deleting result from MongoDB: {str(e)}")
-        return False
+        logger.error(f"Error bumping version for {collection_name}: {str(e)}")
+
+def get_collection_version(collection_name):
+    """
+    Get the change counter for a collection (0 if it was never written).
+    """
+    doc = db.collection_versions.find_one({'_id': collection_name})
+    return doc.get('version', 0) if doc else 0
+
+def ensure_indexes():
+    """
+    Create the indexes the API relies on and drop the ones they replaced.
+    Safe to run repeatedly.
+    """
+    db.calculation_results.create_index([('iid', ASCENDING)])
+    db.calculation_results.create_index([('v', ASCENDING), ('ts', DESCENDING)])
+    db.calculation_results.create_index([('timestamp', DESCENDING)])
+    db.forecasts.create_index([('cell', ASCENDING), ('start', DESCENDING)])
+    db.user_inputs.create_index([('timestamp', DESCENDING)])
+    for keys in SEARCH_INDEXES:
+        db.historical_data.create_index(keys)
+    db.site_summaries.create_index([('location', ASCENDING)])
+    for keys in SKETCH_INDEXES:
+        db.quantile_sketches.create_index(keys)
+    db.jobs.create_index([('status', ASCENDING), ('created', ASCENDING)])
+    db.maintenance_tasks.create_index([('type', ASCENDING), ('due', ASCENDING), ('_id', ASCENDING)])
+    db.maintenance_tasks.create_index([('due', ASCENDING)])
+    db.maintenance_tasks.create_index([('site', ASCENDING)])
+    db.singleflight_leases.create_index([('expires', ASCENDING)], expireAfterSeconds=0)
+    db.idempotency_keys.create_index(
+        [('created', ASCENDING)], expireAfterSeconds=int(settings.IDEMPOTENCY_TTL_SECONDS)
+    )
+    for collection_name, index_name in LEGACY_INDEXES:
+        try:
+            db[collection_name].drop_index(index_name)
+            logger.info(f"Dropped legacy index {index_name} on {collection_name}")
+        except OperationFailure:
+            # Already dropped (or never created)
+            pass
+    logger.info("MongoDB indexes ensured")
 
 def get_mongodb_status():
     """
@@ -0,0 +1,252 @@
+"""
+Streaming bulk export of historical data and calculation results.
+
+Rows are read through a server-side cursor with a tuned batch size, with the
+time-range and location filters pushed down to MongoDB and a projection that
+only fetches exported fields. CSV is emitted in chunks and Parquet in row
+groups, so memory use is bounded by one chunk/row group regardless of the
+export size.
+"""
+import csv
+import io
+import logging
+from django.conf import settings
+from .database import db
+from .read_routing import read_preference
+from .retention import timestamp_range_query
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow is only needed for Parquet exports
+    pa = None
+    pq = None
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Exported columns per collection: (column name, type, candidate document paths).
+# The first path present in a document wins, which lets one spec cover both
+# compact and legacy calculation results.
+EXPORT_COLUMNS = {
+    'historical_data': [
+        ('_id', 'string', ['_id']),
+        ('timestamp', 'string', ['timestamp']),
+        ('location', 'string', ['location']),
+        ('inflow', 'float', ['inflow']),
+        ('outflow', 'float', ['outflow']),
+        ('rainfall', 'float', ['rainfall']),
+        ('tankCapacity', 'float', ['tankCapacity']),
+        ('currentLevel', 'float', ['currentLevel']),
+        ('drinking', 'float', ['waterUsage.drinking']),
+        ('cleaning', 'float', ['waterUsage.cleaning']),
+        ('gardening', 'float', ['waterUsage.gardening']),
+        ('isLeaking', 'bool', ['isLeaking', 'leakDetection.isLeaking']),
+        ('roi', 'float', ['roi.roi']),
+        ('savings', 'float', ['roi.savings']),
+    ],
+    'calculation_results': [
+        ('_id', 'string', ['_id']),
+        ('timestamp', 'string', ['ts', 'timestamp']),
+        ('input_id', 'string', ['iid', 'input_data._id']),
+        ('location', 'string', ['loc', 'input_data.location']),
+        ('averageRainfall', 'float', ['ar', 'data.weatherData.averageRainfall']),
+        ('dailyInflow', 'float', ['d.in.d', 'data.inflow.dailyInflow']),
+        ('yearlyInflow', 'float', ['d.in.y', 'data.inflow.yearlyInflow']),
+        ('isLeaking', 'bool', ['d.lk.l', 'data.leakDetection.isLeaking']),
+        ('roi', 'float', ['d.r.r', 'data.roi.roi']),
+        ('savings', 'float', ['d.r.s', 'data.roi.savings']),
+        ('paybackPeriod', 'float', ['d.r.pb', 'data.roi.paybackPeriod']),
+        ('recommendedSize', 'float', ['d.tr.rs', 'data.tankRecommendation.recommendedSize']),
+    ],
+}
+
+# Location field(s) per collection used for the pushed-down location filter
+LOCATION_FIELDS = {
+    'historical_data': ['location'],
+    'calculation_results': ['loc', 'input_data.location'],
+}
+
+EXPORT_FORMATS = ('csv', 'parquet')
+
+def _lookup(document, path):
+    value = document
+    for part in path.split('.'):
+        if not isinstance(value, dict) or part not in value:
+            return None
+        value = value[part]
+    return value
+
+def _convert(value, column_type):
+    if value is None:
+        return None
+    try:
+        if column_type == 'float':
+            return float(value)
+        if column_type == 'bool':
+            return bool(value)
+        return str(value)
+    except (TypeError, ValueError):
+        return None
+
+def build_query(collection_name, start=None, end=None, location=None):
+    """
+    Build the MongoDB filter for an export.
+    """
+    clauses = []
+    range_query = timestamp_range_query(collection_name, start, end)
+    if range_query:
+        clauses.append(range_query)
+    if location:
+        fields = LOCATION_FIELDS[collection_name]
+        clauses.append(
+            {fields[0]: location} if len(fields) == 1
+            else {'$or': [{field: location} for field in fields]}
+        )
+    if not clauses:
+        return {}
+    return clauses[0] if len(clauses) == 1 else {'$and': clauses}
+
+def iter_rows(collection_name, start=None, end=None, location=None, batch_size=None):
+    """
+    Yield export rows (tuples in EXPORT_COLUMNS order) from a server-side cursor.
+    """
+    columns = EXPORT_COLUMNS[collection_name]
+    projection = {path: 1 for _, _, paths in columns for path in paths}
+    # Streamed after the view returns, so the route is applied here rather than per request
+    collection = db[collection_name].with_options(read_preference=read_preference('export'))
+    cursor = collection.find(
+        build_query(collection_name, start, end, location),
+        projection,
+        batch_size=batch_size or settings.EXPORT_BATCH_SIZE
+    )
+    try:
+        for document in cursor:
+            row = []
+            for _, column_type, paths in columns:
+                value = None
+                for path in paths:
+                    value = _lookup(document, path)
+                    if value is not None:
+                        break
+                row.append(_convert(value, column_type))
+            yield tuple(row)
+    finally:
+        cursor.close()
+
+def iter_csv(collection_name, rows, chunk_rows=None):
+    """
+    Encode rows as CSV, yielding one bytes chunk per `chunk_rows` rows.
+    """
+    chunk_rows = chunk_rows or settings.EXPORT_CHUNK_ROWS
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([name for name, _, _ in EXPORT_COLUMNS[collection_name]])
+
+    pending = 0
+    for row in rows:
+        writer.writerow(row)
+        pending += 1
+        if pending >= chunk_rows:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+            pending = 0
+    yield buffer.getvalue().encode('utf-8')
+
+class _DrainableSink:
+    """
+    Write-only file object that lets the caller take out what has been written.
+
+    pyarrow asks the sink for its position when writing the footer, so tell()
+    reports the total number of bytes written, not the buffered amount.
+    """
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+        self.closed = False
+
+    def write(self, data):
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+def _arrow_schema(collection_name):
+    types = {'string': pa.string(), 'float': pa.float64(), 'bool': pa.bool_()}
+    return pa.schema([
+        (name, types[column_type]) for name, column_type, _ in EXPORT_COLUMNS[collection_name]
+    ])
+
+def iter_parquet(collection_name, rows, row_group_rows=None):
+    """
+    Encode rows as Parquet, yielding bytes after each row group.
+    """
+    if pa is None:
+        raise RuntimeError('pyarrow is required for Parquet exports')
+
+    row_group_rows = row_group_rows or settings.EXPORT_PARQUET_ROW_GROUP_ROWS
+    schema = _arrow_schema(collection_name)
+    sink = _DrainableSink()
+    writer = pq.ParquetWriter(pa.PythonFile(sink, mode='w'), schema, compression='zstd')
+
+    def flush(group):
+        columns = list(zip(*group))
+        table = pa.Table.from_arrays(
+            [pa.array(list(column), type=field.type) for column, field in zip(columns, schema)],
+            schema=schema
+        )
+        writer.write_table(table)
+
+    group = []
+    for row in rows:
+        group.append(row)
+        if len(group) >= row_group_rows:
+            flush(group)
+            group = []
+            yield sink.drain()
+    if group:
+        flush(group)
+    writer.close()
+    yield sink.drain()
+
+def missing_dependency(export_format):
+    """
+    Explain why a format can't be exported here, or None if it can.
+    """
+    if export_format == 'parquet' and pa is None:
+        return 'pyarrow is required for Parquet exports'
+    return None
+
+def iter_export(collection_name, export_format, start=None, end=None, location=None):
+    """
+    Stream an export as bytes chunks in the requested format.
+
+    Raises before anything is streamed if the format's dependency is missing.
+    """
+    if collection_name not in EXPORT_COLUMNS:
+        raise ValueError(f"Unsupported collection: {collection_name}")
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"Unsupported format: {export_format}")
+    missing = missing_dependency(export_format)
+    if missing:
+        raise RuntimeError(missing)
+
+    rows = iter_rows(collection_name, start, end, location)
+    if export_format == 'parquet':
+        return iter_parquet(collection_name, rows)
+    return iter_csv(collection_name, rows)
@@ -0,0 +1,251 @@
+"""
+Filtered, sorted and keyset-paged search over historical_data.
+
+Filters are query parameters: equality on `location`, `siteId` and
+`isLeaking` (e.g. `isLeaking=true`), and ranges on the numeric fields and
+`timestamp` as `<field>__<op>` with op one of gt, gte, lt, lte (e.g.
+`tankCapacity__gt=3000`, `fillRatio__lt=0.3`). `sort` is a sortable field,
+prefixed with `-` for descending (default `-timestamp`). Pages are `limit`
+entries long; the `next` cursor of a page, passed back as `after`, continues
+right after its last entry (sort value, then `_id`), so deep pages cost the
+same as the first one.
+
+Derived fields are stored with each entry (`derive_fields`) so they can be
+indexed: `fillRatio` (current level / tank capacity) replaces an `$expr`
+division that no index could serve, and `isLeaking` is lifted out of
+`leakDetection`. The compound indexes in SEARCH_INDEXES follow the
+equality, sort, range order for the supported filter shapes (SEARCH_SHAPES),
+which `test_history_search.py` checks with explain.
+"""
+import base64
+import json
+from pymongo import ASCENDING, DESCENDING
+from bson.objectid import ObjectId
+
+# Query parameter -> (document field, type)
+SEARCH_FIELDS = {
+    'location': ('location', str),
+    'siteId': ('siteId', str),
+    'isLeaking': ('isLeaking', bool),
+    'timestamp': ('timestamp', str),
+    'tankCapacity': ('tankCapacity', float),
+    'fillRatio': ('fillRatio', float),
+    'drinkingShare': ('waterUsage.drinking', float),
+    'inflow': ('inflow', float),
+    'outflow': ('outflow', float),
+    'rainfall': ('rainfall', float),
+}
+
+EQUALITY_FIELDS = ('location', 'siteId', 'isLeaking')
+RANGE_OPERATORS = {'gt': '$gt', 'gte': '$gte', 'lt': '$lt', 'lte': '$lte'}
+SORT_FIELDS = ('timestamp', 'tankCapacity', 'fillRatio', 'drinkingShare')
+DEFAULT_SORT = '-timestamp'
+
+# Compound indexes on historical_data (equality, sort, range), `_id` last for keyset paging
+SEARCH_INDEXES = (
+    [('timestamp', DESCENDING), ('_id', DESCENDING)],
+    [('location', ASCENDING), ('timestamp', DESCENDING), ('_id', DESCENDING)],
+    [('isLeaking', ASCENDING), ('timestamp', DESCENDING), ('_id', DESCENDING)],
+    [('location', ASCENDING), ('tankCapacity', ASCENDING), ('_id', ASCENDING)],
+    [('fillRatio', ASCENDING), ('_id', ASCENDING)],
+    [('waterUsage.drinking', ASCENDING), ('_id', ASCENDING)],
+)
+
+# Filter shapes the indexes are designed for, as query parameters
+SEARCH_SHAPES = {
+    'recent entries': {},
+    'one location over time': {'location': 'Chennai'},
+    'leaking tanks': {'isLeaking': 'true'},
+    'drinking share above 45%': {'drinkingShare__gt': '45', 'sort': '-drinkingShare'},
+    'Chennai tanks over 3000 L': {'location': 'Chennai', 'tankCapacity__gt': '3000', 'sort': 'tankCapacity'},
+    'level below 30% of capacity': {'fillRatio__lt': '0.3', 'sort': 'fillRatio'},
+    'one location in a time range': {
+        'location': 'Chennai', 'timestamp__gte': '2024-01-01', 'timestamp__lt': '2024-07-01'
+    },
+}
+
+# Parameters that aren't filters
+_CONTROL_PARAMS = ('sort', 'limit', 'after')
+
+def derive_fields(entry):
+    """
+    Add the derived, indexable fields to a history entry before it is stored.
+    """
+    capacity = entry.get('tankCapacity')
+    level = entry.get('currentLevel')
+    if capacity and level is not None:
+        entry['fillRatio'] = round(float(level) / float(capacity), 4)
+    leak = entry.get('leakDetection')
+    if 'isLeaking' not in entry and isinstance(leak, dict) and 'isLeaking' in leak:
+        entry['isLeaking'] = bool(leak['isLeaking'])
+    return entry
+
+def _typed(value, kind):
+    if kind is bool:
+        if value.lower() in ('true', '1'):
+            return True
+        if value.lower() in ('false', '0'):
+            return False
+        raise ValueError(f"expected true or false, got {value!r}")
+    return kind(value)
+
+def parse_search(params, default_limit=50, max_limit=500):
+    """
+    Turn query parameters into a search: equality and range filters, the
+    sort (name, direction), the page size and the cursor to continue after.
+    Raises ValueError for unknown or malformed parameters.
+    """
+    equals, ranges = {}, {}
+    for key, value in params.items():
+        if key in _CONTROL_PARAMS:
+            continue
+        name, _, op = key.partition('__')
+        if name not in SEARCH_FIELDS:
+            raise ValueError(f"unknown filter {key!r}; filters are: {', '.join(SEARCH_FIELDS)}")
+        kind = SEARCH_FIELDS[name][1]
+        try:
+            typed = _typed(value, kind)
+        except ValueError:
+            raise ValueError(f"{key} must be a {kind.__name__}")
+        if not op:
+            if name not in EQUALITY_FIELDS:
+                raise ValueError(f"{name} takes range filters ({name}__gt, __gte, __lt, __lte)")
+            equals[name] = typed
+        elif op in RANGE_OPERATORS and kind is not bool:
+            ranges.setdefault(name, {})[op] = typed
+        else:
+            raise ValueError(f"unknown operator in {key!r}; use one of: {', '.join(RANGE_OPERATORS)}")
+
+    sort = params.get('sort') or DEFAULT_SORT
+    sort_name = sort.lstrip('-')
+    if sort_name not in SORT_FIELDS:
+        raise ValueError(f"sort must be one of: {', '.join(SORT_FIELDS)} (prefix - for descending)")
+    direction = DESCENDING if sort.startswith('-') else ASCENDING
+
+    try:
+        limit = min(max(int(params.get('limit') or default_limit), 1), max_limit)
+    except ValueError:
+        raise ValueError('limit must be an integer')
+
+    return {
+        'equals': equals,
+        'ranges': ranges,
+        'sort': (sort_name, direction),
+        'limit': limit,
+        'after': decode_cursor(params.get('after'), sort_name),
+    }
+
+def encode_cursor(document, sort_name):
+    """
+    Build the opaque cursor pointing just past a document.
+    """
+    value = _get(document, SEARCH_FIELDS[sort_name][0])
+    payload = json.dumps([value, str(document['_id'])])
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor, sort_name):
+    """
+    Decode a cursor into (sort value, _id), or None when there is none.
+    """
+    if not cursor:
+        return None
+    try:
+        value, document_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+    except (ValueError, TypeError):
+        raise ValueError('after is not a valid cursor')
+    if value is not None:
+        value = SEARCH_FIELDS[sort_name][1](value)
+    return value, ObjectId(document_id) if ObjectId.is_valid(document_id) else document_id
+
+def build_query(search):
+    """
+    Build the MongoDB filter and sort for a search.
+    """
+    query = {}
+    for name, value in search['equals'].items():
+        query[SEARCH_FIELDS[name][0]] = value
+    for name, bounds in search['ranges'].items():
+        query[SEARCH_FIELDS[name][0]] = {RANGE_OPERATORS[op]: value for op, value in bounds.items()}
+
+    sort_name, direction = search['sort']
+    sort_field = SEARCH_FIELDS[sort_name][0]
+    if SEARCH_FIELDS[sort_name][1] is float and sort_field not in query:
+        # Entries without the field can't be paged by it; this also bounds the index scan
+        query[sort_field] = {'$gte': float('-inf')}
+
+    if search['after'] is not None:
+        value, last_id = search['after']
+        op = '$gt' if direction == ASCENDING else '$lt'
+        keyset = {'$or': [{sort_field: {op: value}}, {sort_field: value, '_id': {op: last_id}}]}
+        query = {'$and': [query, keyset]} if query else keyset
+    return query, [(sort_field, direction), ('_id', direction)]
+
+def _get(document, path):
+    for part in path.split('.'):
+        document = document.get(part) if isinstance(document, dict) else None
+    return document
+
+def _in_range(value, bounds):
+    if value is None or isinstance(value, bool):
+        return False
+    try:
+        return all({
+            'gt': lambda: value > bound, 'gte': lambda: value >= bound,
+            'lt': lambda: value < bound, 'lte': lambda: value <= bound,
+        }[op]() for op, bound in bounds.items())
+    except TypeError:
+        return False
+
+def search_entries(entries, search):
+    """
+    Apply a search to history entries in Python (for the embedded backend),
+    matching what build_query does in MongoDB.
+    """
+    sort_name, direction = search['sort']
+    sort_field = SEARCH_FIELDS[sort_name][0]
+    matched = []
+    for entry in entries:
+        entry = derive_fields(entry)
+        if any(_get(entry, SEARCH_FIELDS[name][0]) != value for name, value in search['equals'].items()):
+            continue
+        if not all(_in_range(_get(entry, SEARCH_FIELDS[name][0]), bounds) for name, bounds in search['ranges'].items()):
+            continue
+        if _get(entry, sort_field) is None:
+            continue
+        matched.append(entry)
+
+    key = lambda entry: (_get(entry, sort_field), str(entry['_id']))
+    matched.sort(key=key, reverse=direction == DESCENDING)
+    if search['after'] is not None:
+        value, last_id = search['after']
+        after = (value, str(last_id))
+        matched = [entry for entry in matched if (key(entry) > after if direction == ASCENDING else key(entry) < after)]
+    return matched[:search['limit']]
+
+def format_page(entries, search):
+    """
+    Turn a page of entries into the API shape, with the cursor of the next page.
+    """
+    sort_name, direction = search['sort']
+    full = len(entries) == search['limit']
+    next_cursor = encode_cursor(entries[-1], sort_name) if entries and full else None
+    for entry in entries:
+        entry['_id'] = str(entry['_id'])
+    return {
+        'results': entries,
+        'count': len(entries),
+        'sort': f"{'-' if direction == DESCENDING else ''}{sort_name}",
+        'next': next_cursor,
+    }
+
+def plan_stages(plan):
+    """
+    List the stage names of an explain() query plan, depth first.
+    """
+    stages = [plan.get('stage')]
+    for child in ('inputStage', 'queryPlan'):
+        if child in plan:
+            stages.extend(plan_stages(plan[child]))
+    for child in plan.get('inputStages', []):
+        stages.extend(plan_stages(child))
+    return stages
@@ -0,0 +1,202 @@
+"""
+Time-bucketed, downsampled history series for charts.
+
+History entries in a time range (optionally for one location) are grouped
+into day, week (starting Monday) or month buckets, each reporting the entry
+count, average rainfall, inflow, outflow and tank utilization, total inflow
+and outflow, and leak count. On MongoDB the grouping is one aggregation
+whose `$match` on (location, timestamp) is served by the indexes on
+`historical_data`; `aggregate_entries` does the same in Python for the
+embedded backend.
+
+When there are more buckets than the requested number of points, the series
+is reduced with Largest-Triangle-Three-Buckets (LTTB) on one metric, which
+keeps the visual shape (peaks and dips) of the curve, so the payload stays a
+few KB however long the history is.
+"""
+from datetime import datetime, timedelta
+import numpy as np
+
+BUCKET_SIZES = ('day', 'week', 'month')
+
+# Metrics of each point, in output order
+SERIES_METRICS = ('rainfall', 'inflow', 'outflow', 'utilization', 'inflowTotal', 'outflowTotal', 'leaks')
+
+# Metrics LTTB can preserve the shape of
+DOWNSAMPLE_METRICS = ('rainfall', 'inflow', 'outflow', 'utilization')
+
+def bucket_start(timestamp, bucket):
+    """
+    Get the 'YYYY-MM-DD' start of the bucket an ISO timestamp falls in.
+    """
+    day = timestamp[:10]
+    if bucket == 'month':
+        return day[:7] + '-01'
+    if bucket == 'week':
+        date = datetime.strptime(day, '%Y-%m-%d')
+        return (date - timedelta(days=date.weekday())).strftime('%Y-%m-%d')
+    return day
+
+def _bucket_key_expression(bucket):
+    day = {'$substrBytes': ['$timestamp', 0, 10]}
+    if bucket == 'month':
+        return {'$concat': [{'$substrBytes': ['$timestamp', 0, 7]}, '-01']}
+    if bucket == 'week':
+        date = {'$dateFromString': {'dateString': day}}
+        monday = {'$subtract': [date, {'$multiply': [{'$subtract': [{'$isoDayOfWeek': date}, 1]}, 86400000]}]}
+        return {'$dateToString': {'format': '%Y-%m-%d', 'date': monday}}
+    return day
+
+def range_query(start=None, end=None, location=None):
+    """
+    Build the `$match` for a time range [start, end) and location.
+    """
+    query = {}
+    if location:
+        query['location'] = location
+    bounds = {}
+    if start:
+        bounds['$gte'] = start
+    if end:
+        bounds['$lt'] = end
+    # Entries without a string timestamp can't be bucketed
+    query['timestamp'] = bounds or {'$type': 'string'}
+    return query
+
+def series_pipeline(bucket, start=None, end=None, location=None):
+    """
+    Build the aggregation pipeline that buckets history entries.
+    """
+    rainfall = {'$ifNull': ['$rainfall', '$weatherData.averageRainfall']}
+    utilization = {'$cond': [
+        {'$and': [{'$gt': ['$tankCapacity', 0]}, {'$ne': [{'$type': '$currentLevel'}, 'missing']}]},
+        {'$multiply': [{'$divide': ['$currentLevel', '$tankCapacity']}, 100]},
+        None
+    ]}
+    leaking = {'$cond': [{'$ifNull': ['$isLeaking', '$leakDetection.isLeaking']}, 1, 0]}
+    return [
+        {'$match': range_query(start, end, location)},
+        {'$group': {
+            '_id': _bucket_key_expression(bucket),
+            'count': {'$sum': 1},
+            'rainfall': {'$avg': rainfall},
+            'inflow': {'$avg': '$inflow'},
+            'outflow': {'$avg': '$outflow'},
+            'utilization': {'$avg': utilization},
+            'inflowTotal': {'$sum': '$inflow'},
+            'outflowTotal': {'$sum': '$outflow'},
+            'leaks': {'$sum': leaking},
+        }},
+        {'$sort': {'_id': 1}},
+    ]
+
+def aggregate_entries(entries, bucket):
+    """
+    Bucket history entries in Python, giving the same rows as series_pipeline.
+    """
+    groups = {}
+    for entry in entries:
+        timestamp = entry.get('timestamp')
+        if not isinstance(timestamp, str):
+            continue
+        group = groups.setdefault(bucket_start(timestamp, bucket), {
+            'count': 0, 'rainfall': [], 'inflow': [], 'outflow': [], 'utilization': [], 'leaks': 0,
+        })
+        group['count'] += 1
+        rainfall = entry.get('rainfall', (entry.get('weatherData') or {}).get('averageRainfall'))
+        if rainfall is not None:
+            group['rainfall'].append(rainfall)
+        for field in ('inflow', 'outflow'):
+            if entry.get(field) is not None:
+                group[field].append(entry[field])
+        if entry.get('tankCapacity') and entry.get('currentLevel') is not None:
+            group['utilization'].append(entry['currentLevel'] / entry['tankCapacity'] * 100)
+        leaking = entry.get('isLeaking', (entry.get('leakDetection') or {}).get('isLeaking'))
+        group['leaks'] += 1 if leaking else 0
+
+    def average(values):
+        return sum(values) / len(values) if values else None
+
+    return [
+        {
+            '_id': key,
+            'count': group['count'],
+            'rainfall': average(group['rainfall']),
+            'inflow': average(group['inflow']),
+            'outflow': average(group['outflow']),
+            'utilization': average(group['utilization']),
+            'inflowTotal': sum(group['inflow']),
+            'outflowTotal': sum(group['outflow']),
+            'leaks': group['leaks'],
+        }
+        for key, group in sorted(groups.items())
+    ]
+
+def lttb(x, y, threshold):
+    """
+    Largest-Triangle-Three-Buckets: pick `threshold` indices of the points
+    (x, y) that best keep the curve's shape. Always keeps the first and last
+    point. Returns the sorted indices.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n) if threshold >= n else np.array([0, n - 1][:max(threshold, 0)], dtype=int)
+
+    # Bucket boundaries for the points between the first and last
+    edges = np.linspace(1, n - 1, threshold - 1).astype(int)
+    selected = np.empty(threshold, dtype=int)
+    selected[0] = 0
+    selected[-1] = n - 1
+    previous = 0
+    for i in range(threshold - 2):
+        lo, hi = edges[i], max(edges[i + 1], edges[i] + 1)
+        # Average of the next bucket (the last point for the final bucket)
+        next_lo, next_hi = hi, (edges[i + 2] if i + 2 < len(edges) else n)
+        next_x = x[next_lo:max(next_hi, next_lo + 1)].mean()
+        next_y = y[next_lo:max(next_hi, next_lo + 1)].mean()
+        # Point of this bucket forming the largest triangle with the previous pick and the next average
+        areas = np.abs(
+            (x[previous] - next_x) * (y[lo:hi] - y[previous])
+            - (x[previous] - x[lo:hi]) * (next_y - y[previous])
+        )
+        previous = lo + int(np.argmax(areas))
+        selected[i + 1] = previous
+    return selected
+
+def _day_number(day):
+    return (datetime.strptime(day, '%Y-%m-%d') - datetime(1970, 1, 1)).days
+
+def format_series(rows, bucket, points=None, metric='outflow'):
+    """
+    Turn bucket rows into the API shape, downsampled to at most `points`
+    points by LTTB on `metric`. The summary averages cover every bucket, not
+    just the points kept.
+    """
+    total = len(rows)
+    summary = {'count': sum(row['count'] for row in rows)}
+    for name in DOWNSAMPLE_METRICS:
+        # Weight each bucket's average by its entry count
+        weighted = [(row[name], row['count']) for row in rows if row.get(name) is not None]
+        weight = sum(count for _, count in weighted)
+        summary[name] = round(sum(value * count for value, count in weighted) / weight, 2) if weight else None
+    if points and total > points:
+        x = [_day_number(row['_id']) for row in rows]
+        # Buckets without the metric count as 0 for picking points
+        y = [row.get(metric) or 0 for row in rows]
+        rows = [rows[i] for i in lttb(x, y, points)]
+
+    def rounded(value):
+        return round(value, 2) if isinstance(value, float) else value
+
+    return {
+        'bucket': bucket,
+        'buckets': total,
+        'downsampled': len(rows) < total,
+        'summary': summary,
+        'points': [
+            {'t': row['_id'], 'count': row['count'], **{name: rounded(row.get(name)) for name in SERIES_METRICS}}
+            for row in rows
+        ],
+    }
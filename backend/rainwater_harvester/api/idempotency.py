@@ -0,0 +1,230 @@
+"""
+Idempotency keys for write endpoints.
+
+Clients that retry a POST (e.g. after a timeout) send the same
+`Idempotency-Key` header with every attempt. The first request to arrive
+claims the key by inserting a `pending` record in `idempotency_keys` (the
+unique `_id` makes the claim atomic across processes), does the work, and
+stores its response on the record as `complete`. Later requests with the key:
+
+- get the stored response back, marked `Idempotent-Replayed: true`, without
+  doing the work again
+- wait for it while the first request is still running, up to
+  IDEMPOTENCY_WAIT_SECONDS (then 409, so the client retries later)
+- get 422 if their body differs from the first request's
+
+Server errors (5xx) and exceptions are not stored: the record is removed so a
+retry can try again. Each claim has its own owner token and a lease
+(IDEMPOTENCY_LEASE_SECONDS) that is renewed while the request runs; a claim
+whose request died is taken over once its lease runs out. Records expire IDEMPOTENCY_TTL_SECONDS
+after they were created, through a TTL index on `created`. If MongoDB is
+unavailable, requests are just processed without the guarantee.
+"""
+import functools
+import hashlib
+import json
+import logging
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from django.conf import settings
+from pymongo.errors import DuplicateKeyError, PyMongoError
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+from .read_routing import CAUSAL_TOKEN_HEADER
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_KEY_HEADER = 'Idempotency-Key'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+
+# Response headers stored and replayed with the body
+STORED_HEADERS = (CAUSAL_TOKEN_HEADER,)
+
+# Seconds between checks while waiting for the first request
+POLL_INTERVAL = 0.1
+
+_stats = {'executions': 0, 'replayed': 0, 'waited': 0, 'conflicts': 0, 'mismatches': 0, 'takeovers': 0}
+_stats_lock = threading.Lock()
+
+def _collection():
+    from .database import db
+    return db.idempotency_keys
+
+def _count(outcome):
+    with _stats_lock:
+        _stats[outcome] += 1
+
+def stats():
+    with _stats_lock:
+        return dict(_stats)
+
+def fingerprint(data):
+    """
+    Hash a request body, so a key reused for a different request is caught.
+    """
+    payload = json.dumps(data, sort_keys=True, cls=JSONEncoder)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def _lease_until():
+    return datetime.utcnow() + timedelta(seconds=settings.IDEMPOTENCY_LEASE_SECONDS)
+
+def _claim(record_id, request_hash, owner):
+    """
+    Try to claim a key. Returns (claimed, existing record); the record is
+    None if it disappeared in between (expired or dropped), so try again.
+    """
+    now = datetime.utcnow()
+    try:
+        _collection().insert_one({
+            '_id': record_id,
+            'state': 'pending',
+            'fingerprint': request_hash,
+            'owner': owner,
+            'created': now,
+            'lease': _lease_until(),
+        })
+        return True, None
+    except DuplicateKeyError:
+        return False, _collection().find_one({'_id': record_id})
+
+def _take_over(record_id, owner):
+    """
+    Claim a pending key whose lease ran out. Returns True if claimed.
+    """
+    result = _collection().update_one(
+        {'_id': record_id, 'state': 'pending', 'lease': {'$lt': datetime.utcnow()}},
+        {'$set': {'owner': owner, 'lease': _lease_until()}}
+    )
+    return result.modified_count == 1
+
+def _keep_alive(record_id, owner, stop):
+    """
+    Renew a claim's lease until `stop` is set, so slow requests keep their key.
+    """
+    while not stop.wait(settings.IDEMPOTENCY_LEASE_SECONDS / 3):
+        try:
+            _collection().update_one(
+                {'_id': record_id, 'owner': owner, 'state': 'pending'},
+                {'$set': {'lease': _lease_until()}}
+            )
+        except PyMongoError as e:
+            logger.warning(f"Could not renew the lease of idempotency key {record_id}: {str(e)}")
+
+def _complete(record_id, owner, response):
+    """
+    Store a response on the claimed record, or drop the claim for server errors.
+    """
+    try:
+        if response.status_code >= 500:
+            _collection().delete_one({'_id': record_id, 'owner': owner})
+            return
+        _collection().update_one(
+            {'_id': record_id, 'owner': owner},
+            {'$set': {
+                'state': 'complete',
+                'status': response.status_code,
+                'body': json.dumps(response.data, cls=JSONEncoder),
+                'headers': {name: response[name] for name in STORED_HEADERS if response.has_header(name)},
+            }}
+        )
+    except PyMongoError as e:
+        logger.warning(f"Could not store the response for idempotency key {record_id}: {str(e)}")
+
+def _release(record_id, owner):
+    try:
+        _collection().delete_one({'_id': record_id, 'owner': owner})
+    except PyMongoError:
+        pass
+
+def _replay(record):
+    response = Response(json.loads(record['body']), status=record['status'])
+    for name, value in (record.get('headers') or {}).items():
+        response[name] = value
+    response[REPLAYED_HEADER] = 'true'
+    return response
+
+def _run(record_id, owner, method):
+    _count('executions')
+    stop = threading.Event()
+    threading.Thread(target=_keep_alive, args=(record_id, owner, stop), daemon=True).start()
+    try:
+        response = method()
+    except Exception:
+        _release(record_id, owner)
+        raise
+    finally:
+        stop.set()
+    _complete(record_id, owner, response)
+    return response
+
+def idempotent(scope):
+    """
+    Decorator for view methods: honour the request's Idempotency-Key within
+    `scope` (keys of different endpoints never collide).
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(view, request, *args, **kwargs):
+            key = request.headers.get(IDEMPOTENCY_KEY_HEADER)
+            call = functools.partial(method, view, request, *args, **kwargs)
+            if not key or not settings.IDEMPOTENCY_ENABLED:
+                return call()
+            if len(key) > 255:
+                return Response(
+                    {'message': f'{IDEMPOTENCY_KEY_HEADER} must be at most 255 characters'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+
+            record_id = f"{scope}:{key}"
+            # One token per claim, so concurrent requests in this process never share one
+            owner = uuid.uuid4().hex
+            request_hash = fingerprint(request.data)
+            deadline = time.monotonic() + settings.IDEMPOTENCY_WAIT_SECONDS
+            waited = False
+            while True:
+                try:
+                    claimed, record = _claim(record_id, request_hash, owner)
+                    # The first request died without finishing: take its claim over
+                    taken_over = (
+                        record is not None and record['state'] == 'pending'
+                        and record['fingerprint'] == request_hash
+                        and record['lease'] < datetime.utcnow() and _take_over(record_id, owner)
+                    )
+                except PyMongoError as e:
+                    logger.warning(f"Idempotency store unavailable for {record_id}: {str(e)}")
+                    return call()
+
+                if claimed or taken_over:
+                    if taken_over:
+                        _count('takeovers')
+                    return _run(record_id, owner, call)
+                if record is None:
+                    continue
+                if record['fingerprint'] != request_hash:
+                    _count('mismatches')
+                    return Response(
+                        {'message': f'This {IDEMPOTENCY_KEY_HEADER} was already used with a different request'},
+                        status=status.HTTP_422_UNPROCESSABLE_ENTITY
+                    )
+                if record['state'] == 'complete':
+                    _count('replayed')
+                    return _replay(record)
+
+                if time.monotonic() >= deadline:
+                    _count('conflicts')
+                    response = Response(
+                        {'message': f'A request with this {IDEMPOTENCY_KEY_HEADER} is still being processed; retry later'},
+                        status=status.HTTP_409_CONFLICT
+                    )
+                    response['Retry-After'] = str(max(1, int(settings.IDEMPOTENCY_WAIT_SECONDS)))
+                    return response
+                if not waited:
+                    waited = True
+                    _count('waited')
+                time.sleep(POLL_INTERVAL)
+        return wrapper
+    return decorator
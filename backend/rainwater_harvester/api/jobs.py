@@ -0,0 +1,346 @@
+"""
+Asynchronous jobs for CPU-heavy calculations.
+
+Jobs are documents in the `jobs` collection; MongoDB is the only queue, so no
+broker is needed. `run_jobs` processes claim queued jobs with an atomic
+find-and-modify that sets a lease, and run them on a process pool. The
+dispatcher renews the lease of every job it is running, so a job whose worker
+died is claimed again once its lease expires (up to JOBS_MAX_ATTEMPTS times).
+
+Handlers report progress through their JobContext, which is also where a
+cancellation requested through the API is noticed. Results are stored in
+GridFS (`job_results`) because they can exceed the document size limit.
+
+This module does not import the Django models, so pool workers can import it
+before `django.setup()`; each process opens its own MongoDB client.
+"""
+import json
+import logging
+import os
+import signal
+import socket
+import time
+import uuid
+from datetime import datetime, timedelta
+import django
+import gridfs
+import numpy as np
+from bson.objectid import ObjectId
+from django.conf import settings
+from pymongo import MongoClient, ASCENDING, ReturnDocument
+from .calculation_service import sweep_scenarios, simulate_tank_levels, SCENARIO_AXES
+from .weather_service import get_forecast
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Seconds between progress writes from a running handler
+PROGRESS_INTERVAL = 1.0
+
+_client = None
+_client_pid = None
+
+def _database():
+    """
+    Get this process's database handle (clients are not fork-safe).
+    """
+    global _client, _client_pid
+    if _client is None or _client_pid != os.getpid():
+        _client = MongoClient(settings.MONGODB_URI)
+        _client_pid = os.getpid()
+    return _client[settings.MONGODB_NAME]
+
+def _results_store():
+    return gridfs.GridFS(_database(), collection='job_results')
+
+class JobCancelled(Exception):
+    """
+    Raised inside a handler when the job was cancelled through the API.
+    """
+
+class JobContext:
+    """
+    Passed to handlers to report progress and notice cancellation.
+    """
+    def __init__(self, job_id, worker_id):
+        self.job_id = job_id
+        self.worker_id = worker_id
+        self._last_write = 0.0
+
+    def progress(self, fraction, force=False):
+        """
+        Record progress (0..1). Raises JobCancelled if the job was cancelled.
+        """
+        now = time.monotonic()
+        if not force and now - self._last_write < PROGRESS_INTERVAL:
+            return
+        self._last_write = now
+        job = _database().jobs.find_one_and_update(
+            {'_id': self.job_id, 'worker': self.worker_id},
+            {'$set': {'progress': round(min(max(fraction, 0.0), 1.0), 4)}},
+            projection={'cancel_requested': 1, 'status': 1},
+            return_document=ReturnDocument.AFTER
+        )
+        # Also stop if the lease was lost and another worker took the job over
+        if job is None or job.get('cancel_requested') or job.get('status') != 'running':
+            raise JobCancelled()
+
+def run_scenario_sweep(params, context):
+    """
+    Evaluate a large what-if grid, one slice of roof areas at a time.
+    """
+    axes = {name: params[name] for name in SCENARIO_AXES}
+    average_rainfall = get_forecast(params['location']).average_rainfall
+
+    roof_areas = axes['roofArea']
+    slices = [list(part) for part in np.array_split(roof_areas, min(len(roof_areas), 20))]
+    parts = []
+    for i, roof_slice in enumerate(slices):
+        parts.append(sweep_scenarios(average_rainfall, params['outflow'], dict(axes, roofArea=roof_slice)))
+        context.progress((i + 1) / len(slices))
+
+    return {
+        'location': params['location'],
+        'averageRainfall': average_rainfall,
+        'order': list(SCENARIO_AXES),
+        'axes': axes,
+        'shape': [len(axes[name]) for name in SCENARIO_AXES],
+        'metrics': {
+            name: np.round(np.concatenate([part[name] for part in parts]), 2).ravel().tolist()
+            for name in parts[0]
+        },
+    }
+
+def run_monte_carlo(params, context):
+    """
+    Simulate daily tank levels over many random rainfall years.
+    """
+    average_rainfall = get_forecast(params['location']).average_rainfall
+    rng = np.random.default_rng(params.get('seed'))
+
+    runs = params['runs']
+    batch = max(1, min(runs, 1000))
+    outcomes = []
+    for start in range(0, runs, batch):
+        outcomes.append(simulate_tank_levels(
+            average_rainfall, params['roofArea'], params['tankCapacity'],
+            params['outflow'], params['days'], min(batch, runs - start), rng
+        ))
+        context.progress(min(start + batch, runs) / runs)
+
+    reliability = np.concatenate([outcome['reliability'] for outcome in outcomes])
+    empty_days = np.concatenate([outcome['emptyDays'] for outcome in outcomes])
+    overflow = np.concatenate([outcome['overflow'] for outcome in outcomes])
+    final_level = np.concatenate([outcome['finalLevel'] for outcome in outcomes])
+    percentiles = [5, 25, 50, 75, 95]
+    return {
+        'location': params['location'],
+        'averageRainfall': average_rainfall,
+        'runs': runs,
+        'days': params['days'],
+        'reliability': {
+            'mean': float(reliability.mean()),
+            'percentiles': dict(zip(map(str, percentiles), np.percentile(reliability, percentiles).tolist())),
+        },
+        'emptyDays': {
+            'mean': float(empty_days.mean()),
+            'percentiles': dict(zip(map(str, percentiles), np.percentile(empty_days, percentiles).tolist())),
+        },
+        'overflowLiters': {
+            'mean': float(overflow.mean()),
+            'percentiles': dict(zip(map(str, percentiles), np.percentile(overflow, percentiles).tolist())),
+        },
+        'finalLevel': {
+            'mean': float(final_level.mean()),
+            'percentiles': dict(zip(map(str, percentiles), np.percentile(final_level, percentiles).tolist())),
+        },
+    }
+
+# Job type -> handler(params, context) returning a JSON-serializable result
+JOB_TYPES = {
+    'scenario_sweep': run_scenario_sweep,
+    'monte_carlo': run_monte_carlo,
+}
+
+def submit_job(job_type, params):
+    """
+    Queue a job and return its document.
+    """
+    if job_type not in JOB_TYPES:
+        raise ValueError(f"Unknown job type: {job_type}")
+    job = {
+        '_id': ObjectId(),
+        'type': job_type,
+        'params': params,
+        'status': 'queued',
+        'progress': 0.0,
+        'attempts': 0,
+        'cancel_requested': False,
+        'created': datetime.utcnow(),
+    }
+    _database().jobs.insert_one(job)
+    return job
+
+def get_job(job_id, include_result=True):
+    """
+    Get a job in API shape (with its result once completed), or None.
+    """
+    if not ObjectId.is_valid(str(job_id)):
+        return None
+    job = _database().jobs.find_one({'_id': ObjectId(str(job_id))})
+    if job is None:
+        return None
+    data = {
+        'id': str(job['_id']),
+        'type': job['type'],
+        'status': job['status'],
+        'progress': job.get('progress', 0.0),
+        'attempts': job.get('attempts', 0),
+        'cancelRequested': job.get('cancel_requested', False),
+        'error': job.get('error'),
+        'createdAt': job['created'].isoformat(),
+        'startedAt': job['started'].isoformat() if job.get('started') else None,
+        'finishedAt': job['finished'].isoformat() if job.get('finished') else None,
+    }
+    if include_result and job.get('result_file'):
+        data['result'] = json.loads(_results_store().get(job['result_file']).read())
+    return data
+
+def cancel_job(job_id):
+    """
+    Cancel a job. Queued jobs stop immediately; running jobs stop at their
+    next progress report. Returns the job in API shape, or None.
+    """
+    if not ObjectId.is_valid(str(job_id)):
+        return None
+    jobs = _database().jobs
+    job_id = ObjectId(str(job_id))
+    jobs.update_one(
+        {'_id': job_id, 'status': 'queued'},
+        {'$set': {'status': 'cancelled', 'cancel_requested': True, 'finished': datetime.utcnow()}}
+    )
+    jobs.update_one(
+        {'_id': job_id, 'status': 'running'},
+        {'$set': {'cancel_requested': True}}
+    )
+    return get_job(job_id, include_result=False)
+
+def claim_job(worker_id):
+    """
+    Atomically claim the oldest runnable job: queued, or running with an
+    expired lease (its worker died). Returns the job document or None.
+    """
+    now = datetime.utcnow()
+    jobs = _database().jobs
+    while True:
+        job = jobs.find_one_and_update(
+            {'$or': [
+                {'status': 'queued'},
+                {'status': 'running', 'lease_until': {'$lt': now}},
+            ]},
+            {
+                '$set': {
+                    'status': 'running',
+                    'worker': worker_id,
+                    'lease_until': now + timedelta(seconds=settings.JOBS_LEASE_SECONDS),
+                    'started': now,
+                },
+                '$inc': {'attempts': 1},
+            },
+            sort=[('created', ASCENDING)],
+            return_document=ReturnDocument.AFTER
+        )
+        if job is None or job['attempts'] <= settings.JOBS_MAX_ATTEMPTS:
+            return job
+        _finish(job['_id'], worker_id, 'failed', error='Worker lost too many times')
+
+def renew_leases(job_ids, worker_id):
+    """
+    Extend the leases of the jobs this worker is running.
+    """
+    if job_ids:
+        _database().jobs.update_many(
+            {'_id': {'$in': list(job_ids)}, 'worker': worker_id, 'status': 'running'},
+            {'$set': {'lease_until': datetime.utcnow() + timedelta(seconds=settings.JOBS_LEASE_SECONDS)}}
+        )
+
+def _finish(job_id, worker_id, status, error=None, result_file=None):
+    update = {'status': status, 'finished': datetime.utcnow()}
+    if status == 'completed':
+        update['progress'] = 1.0
+    if error:
+        update['error'] = error
+    if result_file is not None:
+        update['result_file'] = result_file
+    # Only the worker holding the lease may finish the job
+    result = _database().jobs.update_one(
+        {'_id': job_id, 'worker': worker_id, 'status': 'running'},
+        {'$set': update, '$unset': {'lease_until': ''}}
+    )
+    return result.modified_count == 1
+
+def execute_job(job_id, worker_id):
+    """
+    Run one claimed job to completion. Runs in a pool worker process.
+    """
+    job = _database().jobs.find_one({'_id': job_id})
+    if job is None or job.get('worker') != worker_id:
+        return job_id
+    context = JobContext(job_id, worker_id)
+    try:
+        result = JOB_TYPES[job['type']](job['params'], context)
+        # Last cancellation check before storing the result
+        context.progress(1.0, force=True)
+        result_file = _results_store().put(json.dumps(result).encode('utf-8'))
+        if not _finish(job_id, worker_id, 'completed', result_file=result_file):
+            _results_store().delete(result_file)
+    except JobCancelled:
+        _finish(job_id, worker_id, 'cancelled')
+        logger.info(f"Job {job_id} cancelled")
+    except Exception as e:
+        logger.error(f"Job {job_id} failed: {str(e)}", exc_info=True)
+        _finish(job_id, worker_id, 'failed', error=str(e))
+    return job_id
+
+def init_worker():
+    # Needed when the platform spawns rather than forks worker processes
+    django.setup()
+    # Ctrl+C stops the dispatcher, which lets running jobs finish
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+def worker_name():
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+def run_dispatcher(pool, concurrency, poll_interval, should_stop=lambda: False):
+    """
+    Claim jobs and run them on `pool` with at most `concurrency` in flight,
+    renewing leases while they run. Once `should_stop()` is true, no more
+    jobs are claimed and the running ones are waited for.
+    """
+    worker_id = worker_name()
+    logger.info(f"Job dispatcher {worker_id} started with concurrency {concurrency}")
+    running = {}
+
+    def prune_and_renew():
+        for job_id, pending in list(running.items()):
+            if pending.ready():
+                del running[job_id]
+        renew_leases(running.keys(), worker_id)
+
+    while not should_stop():
+        prune_and_renew()
+
+        claimed = False
+        while len(running) < concurrency:
+            job = claim_job(worker_id)
+            if job is None:
+                break
+            claimed = True
+            logger.info(f"Running job {job['_id']} ({job['type']}), attempt {job['attempts']}")
+            running[job['_id']] = pool.apply_async(execute_job, (job['_id'], worker_id))
+        if not claimed:
+            time.sleep(poll_interval)
+
+    while running:
+        prune_and_renew()
+        time.sleep(poll_interval)
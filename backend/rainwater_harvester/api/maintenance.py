@@ -0,0 +1,149 @@
+"""
+Persistent per-site maintenance calendar.
+
+Each site has one task document per maintenance type in `maintenance_tasks`,
+holding the next due date. Due dates are anchored on the site's install date
+and advance from the date a task was last marked done, so they reflect real
+service history rather than the time of the request. Fleet queries ("which
+sites need cleaning this week") are range scans on the indexed `due` field.
+
+Tasks recur every `interval_days`. `upcoming` expands recurrences for many
+sites with a heap: it streams tasks from a cursor sorted by due date and only
+keeps the tasks whose next occurrence is still in the window, so it never
+loads the whole fleet.
+
+The functions here are pure; database access lives in `repository.py`.
+"""
+import heapq
+from datetime import datetime, timedelta
+
+# Task type -> (interval in days, description)
+MAINTENANCE_TASKS = {
+    'cleaning': (90, 'Regular tank cleaning'),
+    'inspection': (60, 'Leak inspection and system check'),
+}
+
+DATE_FORMAT = '%Y-%m-%d'
+
+def task_id(site, task_type):
+    return f"{site}:{task_type}"
+
+def active_task_types(user_settings=None):
+    """
+    Get the task types to remind about; cleaning follows alertForCleaning.
+    """
+    alert_for_cleaning = (user_settings or {}).get('alertForCleaning', True)
+    return [name for name in MAINTENANCE_TASKS if alert_for_cleaning or name != 'cleaning']
+
+def to_datetime(value):
+    """
+    Parse a 'YYYY-MM-DD' string (or date/datetime) into a midnight datetime.
+    """
+    if value is None:
+        return None
+    if isinstance(value, str):
+        return datetime.strptime(value[:10], DATE_FORMAT)
+    return datetime(value.year, value.month, value.day)
+
+def build_tasks(site, location, install_date, last_service_date=None):
+    """
+    Build the task documents for a site. Each first falls due one interval
+    after the last service (or the install date if never serviced).
+    """
+    anchor = to_datetime(install_date)
+    last_done = to_datetime(last_service_date)
+    tasks = []
+    for task_type, (interval, description) in MAINTENANCE_TASKS.items():
+        tasks.append({
+            '_id': task_id(site, task_type),
+            'site': site,
+            'location': location,
+            'type': task_type,
+            'description': description,
+            'interval_days': interval,
+            'installed': anchor,
+            'last_done': last_done,
+            'due': (last_done or anchor) + timedelta(days=interval),
+        })
+    return tasks
+
+def merge_tasks(existing, site, location, install_date=None, last_service_date=None):
+    """
+    Work out a site's tasks when it is registered, given its stored tasks
+    (`existing`, by ID). Existing tasks are kept unless a new install or last
+    service date re-anchors them. Returns (all tasks, tasks to write).
+    """
+    tasks = []
+    changed = []
+    for task in build_tasks(site, location, install_date or datetime.now(), last_service_date):
+        current = existing.get(task['_id'])
+        if current is not None:
+            if not (install_date or last_service_date):
+                tasks.append(current)
+                continue
+            # Keep what was recorded before unless a new date was given
+            if not install_date:
+                task['installed'] = current['installed']
+            if not last_service_date:
+                task['last_done'] = current.get('last_done')
+            task['due'] = (task['last_done'] or task['installed']) + timedelta(days=task['interval_days'])
+        tasks.append(task)
+        changed.append(task)
+    return tasks, changed
+
+def format_task(task, due=None):
+    """
+    Translate a task document (or one occurrence of it) into the API shape.
+    """
+    due = due or task['due']
+    return {
+        'id': task['_id'],
+        'site': task['site'],
+        'location': task.get('location'),
+        'type': task['type'],
+        'date': due.strftime(DATE_FORMAT),
+        'description': task['description'],
+        'lastDone': task['last_done'].strftime(DATE_FORMAT) if task.get('last_done') else None,
+        'overdue': due < to_datetime(datetime.now()),
+    }
+
+def upcoming(tasks, until, limit=None):
+    """
+    Yield (due, task) occurrences in date order up to `until`, including
+    recurrences, from `tasks` (any iterable sorted by `due` ascending).
+
+    Overdue tasks are yielded once; their recurrences are counted from today.
+    Only tasks that have been reached in the stream are held in the heap.
+    """
+    today = to_datetime(datetime.now())
+    stream = iter(tasks)
+    heap = []
+    sequence = 0
+    pending = next(stream, None)
+    emitted = 0
+    while limit is None or emitted < limit:
+        # Pull tasks from the sorted stream while they are due before the heap's earliest
+        while pending is not None and pending['due'] <= until and (not heap or pending['due'] <= heap[0][0]):
+            heapq.heappush(heap, (pending['due'], sequence, pending))
+            sequence += 1
+            pending = next(stream, None)
+        if not heap:
+            return
+        due, _, task = heapq.heappop(heap)
+        yield due, task
+        emitted += 1
+        next_due = max(due, today) + timedelta(days=task['interval_days'])
+        if next_due <= until:
+            heapq.heappush(heap, (next_due, sequence, task))
+            sequence += 1
+
+def site_schedule(tasks, horizon_days=365):
+    """
+    Expand a site's tasks into the maintenanceSchedule result shape.
+    """
+    until = to_datetime(datetime.now()) + timedelta(days=horizon_days)
+    tasks = sorted(tasks, key=lambda task: task['due'])
+    return [
+        {'type': task['type'], 'date': due.strftime(DATE_FORMAT), 'description': task['description']}
+        for due, task in upcoming(tasks, until)
+    ]
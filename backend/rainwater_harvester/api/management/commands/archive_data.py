@@ -0,0 +1,33 @@
+"""
+Management command that applies the retention policy to MongoDB collections.
+"""
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from rainwater_harvester.api.retention import archive_collection
+
+class Command(BaseCommand):
+    help = 'Archive documents older than the hot window to compressed files and delete them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--collection', action='append',
+                            help='Collection to archive (repeatable, default: all with a policy)')
+        parser.add_argument('--days', type=int,
+                            help='Override the configured hot window in days')
+        parser.add_argument('--batch-size', type=int,
+                            help='Documents archived and deleted per batch')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only count the documents that would be archived')
+
+    def handle(self, *args, **options):
+        collections = options['collection'] or list(settings.RETENTION_DAYS)
+        for name in collections:
+            if name not in settings.RETENTION_DAYS:
+                raise CommandError(f"No retention policy configured for {name}")
+            count = archive_collection(
+                name,
+                days=options['days'],
+                batch_size=options['batch_size'],
+                dry_run=options['dry_run']
+            )
+            verb = 'would be archived' if options['dry_run'] else 'archived'
+            self.stdout.write(f"{name}: {count} documents {verb}")
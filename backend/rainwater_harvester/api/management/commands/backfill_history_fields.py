@@ -0,0 +1,49 @@
+"""
+Store the derived search fields (fillRatio, isLeaking) on history entries
+saved before they were computed at write time.
+
+Safe to run repeatedly: only entries missing a derivable field are updated.
+"""
+from django.core.management.base import BaseCommand
+from pymongo import ASCENDING, UpdateOne
+from rainwater_harvester.api.database import db, bump_collection_version
+from rainwater_harvester.api.history_search import derive_fields
+
+class Command(BaseCommand):
+    help = 'Backfill fillRatio and isLeaking on historical_data entries'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Entries read (and updated) per batch')
+
+    def handle(self, *args, **options):
+        query = {'$or': [
+            {'fillRatio': {'$exists': False}, 'currentLevel': {'$exists': True}},
+            {'isLeaking': {'$exists': False}, 'leakDetection.isLeaking': {'$exists': True}},
+        ]}
+        projection = {'tankCapacity': 1, 'currentLevel': 1, 'isLeaking': 1, 'leakDetection.isLeaking': 1}
+        last_id = None
+        updated = 0
+        while True:
+            batch_query = {'$and': [query, {'_id': {'$gt': last_id}}]} if last_id is not None else query
+            batch = list(
+                db.historical_data.find(batch_query, projection).sort('_id', ASCENDING).limit(options['batch_size'])
+            )
+            if not batch:
+                break
+            last_id = batch[-1]['_id']
+
+            operations = []
+            for entry in batch:
+                derived = {
+                    field: value for field, value in derive_fields(dict(entry)).items()
+                    if field in ('fillRatio', 'isLeaking') and field not in entry
+                }
+                if derived:
+                    operations.append(UpdateOne({'_id': entry['_id']}, {'$set': derived}))
+            if operations:
+                updated += db.historical_data.bulk_write(operations, ordered=False).modified_count
+
+        if updated:
+            bump_collection_version('historical_data')
+        self.stdout.write(self.style.SUCCESS(f"Backfilled derived fields on {updated} history entries"))
@@ -0,0 +1,41 @@
+"""
+Rebuild the percentile sketches from historical_data.
+
+Saving results keeps the sketches up to date, but bulk loads (e.g.
+generate_data) bypass that, and deleted history entries stay counted until
+the sketches are rebuilt.
+"""
+from django.core.management.base import BaseCommand
+from pymongo import ASCENDING
+from rainwater_harvester.api import repository
+from rainwater_harvester.api.database import db
+from rainwater_harvester.api.quantiles import build_documents
+
+class Command(BaseCommand):
+    help = 'Rebuild quantile_sketches from all historical_data entries'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000,
+                            help='History entries read per batch')
+
+    def _entries(self, batch_size):
+        last_id = None
+        while True:
+            query = {'_id': {'$gt': last_id}} if last_id is not None else {}
+            batch = list(
+                db.historical_data.find(
+                    query, {'location': 1, 'timestamp': 1, 'inflow': 1, 'outflow': 1, 'roi.roi': 1}
+                ).sort('_id', ASCENDING).limit(batch_size)
+            )
+            if not batch:
+                return
+            last_id = batch[-1]['_id']
+            yield from batch
+
+    def handle(self, *args, **options):
+        documents = build_documents(self._entries(options['batch_size']))
+        repository.sketches.rebuild(documents)
+        entries = sum(document['count'] for document in documents)
+        self.stdout.write(self.style.SUCCESS(
+            f"Built {len(documents)} sketches from {entries} history entries"
+        ))
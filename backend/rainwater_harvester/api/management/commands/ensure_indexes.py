@@ -0,0 +1,12 @@
+"""
+Management command that creates the MongoDB indexes used by the API.
+"""
+from django.core.management.base import BaseCommand
+from rainwater_harvester.api.database import ensure_indexes
+
+class Command(BaseCommand):
+    help = 'Create the MongoDB indexes used by the API'
+
+    def handle(self, *args, **options):
+        ensure_indexes()
+        self.stdout.write(self.style.SUCCESS('Indexes ensured'))
@@ -0,0 +1,50 @@
+"""
+Management command that streams a collection to a CSV or Parquet file.
+"""
+import sys
+import time
+from django.core.management.base import BaseCommand, CommandError
+from rainwater_harvester.api.export import iter_export, missing_dependency, EXPORT_COLUMNS, EXPORT_FORMATS
+
+class Command(BaseCommand):
+    help = 'Export historical_data or calculation_results as CSV or Parquet'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--collection', default='historical_data', choices=list(EXPORT_COLUMNS))
+        parser.add_argument('--format', dest='export_format', default='csv', choices=EXPORT_FORMATS)
+        parser.add_argument('--start', help='Inclusive ISO timestamp lower bound')
+        parser.add_argument('--end', help='Exclusive ISO timestamp upper bound')
+        parser.add_argument('--location', help='Only export this location')
+        parser.add_argument('--output', '-o', help='Output file (default: stdout)')
+
+    def handle(self, *args, **options):
+        if options['export_format'] == 'parquet' and not options['output']:
+            raise CommandError('Parquet exports need --output')
+        missing = missing_dependency(options['export_format'])
+        if missing:
+            raise CommandError(missing)
+
+        chunks = iter_export(
+            options['collection'],
+            options['export_format'],
+            start=options['start'],
+            end=options['end'],
+            location=options['location']
+        )
+
+        started = time.time()
+        written = 0
+        output = open(options['output'], 'wb') if options['output'] else sys.stdout.buffer
+        try:
+            for chunk in chunks:
+                output.write(chunk)
+                written += len(chunk)
+        finally:
+            if options['output']:
+                output.close()
+
+        if options['output']:
+            elapsed = time.time() - started
+            self.stdout.write(self.style.SUCCESS(
+                f"Wrote {written / 1e6:.1f} MB to {options['output']} in {elapsed:.1f}s"
+            ))
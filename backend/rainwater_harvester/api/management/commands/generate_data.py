@@ -0,0 +1,66 @@
+"""
+Management command that bulk-loads seeded synthetic data for scale testing.
+"""
+import multiprocessing
+import os
+import django
+from django.core.management.base import BaseCommand
+from rainwater_harvester.api.database import db, bump_collection_version
+from rainwater_harvester.api.synthetic_data import plan_chunks, run_generator, write_settings
+
+COLLECTIONS = (
+    'user_inputs', 'calculation_results', 'historical_data', 'forecasts', 'user_settings',
+    'maintenance_tasks', 'prediction_models', 'quantile_sketches'
+)
+
+def _init_worker():
+    # Needed when the platform spawns rather than forks worker processes
+    django.setup()
+
+class Command(BaseCommand):
+    help = 'Generate a seeded synthetic dataset for all collections'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sites', type=int, default=1000, help='Number of sites')
+        parser.add_argument('--days', type=int, default=365, help='Days of history per site')
+        parser.add_argument('--seed', type=int, default=42, help='Random seed')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help='Parallel worker processes')
+        parser.add_argument('--batch-size', type=int, default=5000,
+                            help='Documents per insert_many call')
+        parser.add_argument('--chunk-sites', type=int, default=200,
+                            help='Sites generated per worker task')
+        parser.add_argument('--drop', action='store_true',
+                            help='Drop the collections before loading')
+
+    def handle(self, *args, **options):
+        if options['drop']:
+            for name in COLLECTIONS:
+                db.drop_collection(name)
+            self.stdout.write('Dropped existing collections')
+
+        tasks = plan_chunks(
+            options['sites'], options['days'], options['seed'],
+            options['batch_size'], options['chunk_sites']
+        )
+        self.stdout.write(
+            f"Generating {options['sites']} sites x {options['days']} days "
+            f"in {len(tasks)} chunks on {options['workers']} workers"
+        )
+
+        if options['workers'] > 1:
+            with multiprocessing.Pool(options['workers'], initializer=_init_worker) as pool:
+                totals, elapsed = run_generator(pool.imap_unordered, tasks)
+        else:
+            totals, elapsed = run_generator(map, tasks)
+
+        totals['user_settings'] = write_settings(db)
+        for name in ('user_inputs', 'calculation_results', 'historical_data', 'maintenance_tasks'):
+            bump_collection_version(name)
+
+        total = sum(totals.values())
+        for name, count in sorted(totals.items()):
+            self.stdout.write(f"  {name}: {count}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Inserted {total} documents in {elapsed:.1f}s ({total / max(elapsed, 1e-6):.0f} docs/s)"
+        ))
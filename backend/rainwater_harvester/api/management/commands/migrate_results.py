@@ -0,0 +1,135 @@
+"""
+Online migration of calculation results to the compact (version 2) schema.
+
+Legacy documents are rewritten in batches while the API keeps serving. Each
+rewrite is conditional on the document still being legacy, so the command can
+be interrupted and re-run, or run alongside writers, safely.
+"""
+import time
+from bson.objectid import ObjectId
+from django.core.management.base import BaseCommand
+from pymongo import ASCENDING, ReplaceOne, UpdateOne
+from pymongo.errors import BulkWriteError
+from rainwater_harvester.api.database import db, bump_collection_version
+from rainwater_harvester.api.result_schema import SCHEMA_VERSION, encode_forecast, encode_result
+
+class Command(BaseCommand):
+    help = 'Rewrite legacy calculation_results documents into the compact schema'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Documents rewritten per bulk write')
+        parser.add_argument('--pause', type=float, default=0.0,
+                            help='Seconds to sleep between batches to limit load')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Report what would be migrated without writing')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        legacy_filter = {'v': {'$ne': SCHEMA_VERSION}}
+        total = db.calculation_results.count_documents(legacy_filter)
+        self.stdout.write(f"{total} legacy documents to migrate")
+        if options['dry_run'] or total == 0:
+            return
+
+        migrated = 0
+        last_id = None
+        started = time.time()
+        while True:
+            query = dict(legacy_filter)
+            if last_id is not None:
+                query['_id'] = {'$gt': last_id}
+            batch = list(
+                db.calculation_results.find(query).sort('_id', ASCENDING).limit(batch_size)
+            )
+            if not batch:
+                break
+            last_id = batch[-1]['_id']
+
+            migrated += self.migrate_batch(batch)
+            elapsed = max(time.time() - started, 1e-6)
+            self.stdout.write(
+                f"Migrated {migrated}/{total} documents ({migrated / elapsed:.0f} docs/s)"
+            )
+            if options['pause']:
+                time.sleep(options['pause'])
+
+        bump_collection_version('calculation_results')
+        self.stdout.write(self.style.SUCCESS(f"Migration complete: {migrated} documents"))
+
+    def resolve_inputs(self, batch):
+        """
+        Map each legacy document's _id to the ObjectId of its user_inputs document.
+
+        Inputs that no longer exist in user_inputs are restored from the
+        embedded copy so the reference stays valid. A restored input takes the
+        legacy result's _id and is upserted, so concurrent or repeated runs
+        restore it once instead of leaving duplicates behind.
+        """
+        candidates = {}
+        for doc in batch:
+            embedded_id = (doc.get('input_data') or {}).get('_id')
+            if isinstance(embedded_id, ObjectId):
+                candidates[doc['_id']] = embedded_id
+            elif isinstance(embedded_id, str) and ObjectId.is_valid(embedded_id):
+                candidates[doc['_id']] = ObjectId(embedded_id)
+
+        existing = set()
+        if candidates:
+            existing = {
+                item['_id'] for item in db.user_inputs.find(
+                    {'_id': {'$in': list(candidates.values())}}, {'_id': 1}
+                )
+            }
+
+        input_ids = {}
+        missing = []
+        for doc in batch:
+            candidate = candidates.get(doc['_id'])
+            if candidate in existing:
+                input_ids[doc['_id']] = candidate
+            elif doc.get('input_data'):
+                restored = {k: v for k, v in doc['input_data'].items() if k != '_id'}
+                missing.append((doc['_id'], restored))
+
+        if missing:
+            try:
+                db.user_inputs.bulk_write([
+                    UpdateOne({'_id': doc_id}, {'$setOnInsert': restored}, upsert=True)
+                    for doc_id, restored in missing
+                ], ordered=False)
+            except BulkWriteError as e:
+                # A concurrent run restored the same input first
+                if any(error.get('code') != 11000 for error in e.details.get('writeErrors', [])):
+                    raise
+            for doc_id, _ in missing:
+                input_ids[doc_id] = doc_id
+        return input_ids
+
+    def migrate_batch(self, batch):
+        input_ids = self.resolve_inputs(batch)
+
+        forecast_ops = []
+        result_ops = []
+        for doc in batch:
+            results = dict(doc.get('data') or {})
+            results.setdefault('timestamp', doc.get('timestamp'))
+            location = (doc.get('input_data') or {}).get('location') or \
+                (results.get('inputs') or {}).get('location', '')
+
+            forecast_id, forecast_doc = encode_forecast(location, results.get('weatherData'))
+            if forecast_doc:
+                forecast_ops.append(UpdateOne(
+                    {'_id': forecast_id}, {'$setOnInsert': forecast_doc}, upsert=True
+                ))
+
+            compact = encode_result(input_ids.get(doc['_id']), location, results, forecast_id)
+            # Only replace documents that are still legacy (a concurrent run may have won)
+            result_ops.append(ReplaceOne(
+                {'_id': doc['_id'], 'v': {'$ne': SCHEMA_VERSION}}, compact
+            ))
+
+        if forecast_ops:
+            db.forecasts.bulk_write(forecast_ops, ordered=False)
+        result = db.calculation_results.bulk_write(result_ops, ordered=False)
+        return result.modified_count
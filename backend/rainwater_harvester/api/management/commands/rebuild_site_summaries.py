@@ -0,0 +1,52 @@
+"""
+Rebuild the per-site portfolio summaries from stored calculation results.
+
+Needed once for results stored before summaries existed (or written by
+generate_data), and after a recompute changed stored results.
+"""
+from django.core.management.base import BaseCommand
+from pymongo import ASCENDING
+from rainwater_harvester.api import repository
+from rainwater_harvester.api.database import db
+from rainwater_harvester.api.portfolio import build_site_summary
+
+class Command(BaseCommand):
+    help = 'Rebuild site_summaries from the latest stored result of each site'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Results read (and summaries written) per batch')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        latest = {}
+        last_id = None
+        scanned = 0
+        while True:
+            query = {'_id': {'$gt': last_id}} if last_id is not None else {}
+            batch = list(
+                db.calculation_results.find(query).sort('_id', ASCENDING).limit(batch_size)
+            )
+            if not batch:
+                break
+            last_id = batch[-1]['_id']
+            scanned += len(batch)
+
+            for document, results in zip(batch, repository.results.hydrate(batch)):
+                input_data = dict(results.get('inputs') or document.get('input_data') or {})
+                input_data.setdefault('location', document.get('loc', ''))
+                input_data['_id'] = document.get('iid') or input_data.get('_id')
+                results.setdefault('timestamp', document.get('ts') or document.get('timestamp'))
+                summary = build_site_summary(input_data, results)
+                summary['iid'] = repository.to_object_id(summary['iid'])
+                # Keep only the most recent result per site
+                current = latest.get(summary['_id'])
+                if current is None or (summary['ts'] or '') >= (current['ts'] or ''):
+                    latest[summary['_id']] = summary
+
+        summaries = list(latest.values())
+        for start in range(0, len(summaries), batch_size):
+            repository.site_summaries.save_many(summaries[start:start + batch_size])
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt {len(summaries)} site summaries from {scanned} results"
+        ))
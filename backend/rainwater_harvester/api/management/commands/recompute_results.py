@@ -0,0 +1,48 @@
+"""
+Management command that recomputes stored results after an input change.
+"""
+from django.core.management.base import BaseCommand, CommandError
+from rainwater_harvester.api.recompute import (
+    create_recompute_job,
+    run_recompute,
+    get_job,
+    resume_unfinished,
+    RECOMPUTABLE_INPUTS
+)
+
+class Command(BaseCommand):
+    help = 'Recompute the result fields affected by changed inputs, e.g. --set waterCostPerLiter=0.003'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--set', action='append', default=[], metavar='INPUT=VALUE',
+                            help=f"Changed input ({', '.join(sorted(RECOMPUTABLE_INPUTS))})")
+        parser.add_argument('--location', help='Only recompute results for this location')
+        parser.add_argument('--resume', action='store_true',
+                            help='Run unfinished jobs (queued, or left running by a stopped process) to completion')
+
+    def handle(self, *args, **options):
+        if options['resume']:
+            self.stdout.write(f"Resumed {resume_unfinished()} unfinished jobs")
+            return
+
+        changes = {}
+        for item in options['set']:
+            name, _, value = item.partition('=')
+            try:
+                changes[name] = float(value)
+            except ValueError:
+                raise CommandError(f"Invalid value for {name}: {value}")
+        if not changes:
+            raise CommandError('Pass at least one --set INPUT=VALUE')
+
+        try:
+            job = create_recompute_job(changes, options['location'])
+        except ValueError as e:
+            raise CommandError(str(e))
+        self.stdout.write(f"Recomputing {', '.join(job['fields'])} for {job['total']} results")
+        run_recompute(job['_id'])
+
+        progress = get_job(job['_id'])
+        if progress['status'] != 'completed':
+            raise CommandError(f"Recompute failed: {progress['error']}")
+        self.stdout.write(self.style.SUCCESS(f"Updated {progress['updated']} results"))
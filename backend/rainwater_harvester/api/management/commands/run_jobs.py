@@ -0,0 +1,31 @@
+"""
+Management command that runs queued background jobs on a process pool.
+"""
+import multiprocessing
+import signal
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from rainwater_harvester.api.jobs import init_worker, run_dispatcher
+
+class Command(BaseCommand):
+    help = 'Run queued calculation jobs (start as many of these as needed; they share the queue)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=settings.JOBS_CONCURRENCY,
+                            help='Jobs run in parallel by this process')
+        parser.add_argument('--poll-interval', type=float, default=settings.JOBS_POLL_INTERVAL,
+                            help='Seconds to wait when the queue is empty')
+
+    def handle(self, *args, **options):
+        stopping = []
+        # Stop claiming on SIGTERM/SIGINT and let running jobs finish
+        signal.signal(signal.SIGTERM, lambda *_: stopping.append(True))
+        signal.signal(signal.SIGINT, lambda *_: stopping.append(True))
+
+        concurrency = max(1, options['concurrency'])
+        self.stdout.write(f"Running jobs with concurrency {concurrency}")
+        with multiprocessing.Pool(concurrency, initializer=init_worker) as pool:
+            run_dispatcher(pool, concurrency, options['poll_interval'], lambda: bool(stopping))
+            pool.close()
+            pool.join()
+        self.stdout.write(self.style.SUCCESS('Job runner stopped'))
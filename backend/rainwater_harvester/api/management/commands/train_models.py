@@ -0,0 +1,34 @@
+"""
+Management command that trains the per-location prediction models.
+
+Training is incremental, so running it again only reads history entries
+stored since the last run. Needed after bulk loads (e.g. generate_data),
+which don't trigger background retraining.
+"""
+from django.core.management.base import BaseCommand
+from rainwater_harvester.api.database import db
+from rainwater_harvester.api.prediction import train
+
+class Command(BaseCommand):
+    help = 'Train the inflow/outflow prediction models from historical_data'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--location', action='append', default=[],
+                            help='Only train this location (repeatable)')
+        parser.add_argument('--rebuild', action='store_true',
+                            help='Discard the stored statistics and train from all history')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='History entries folded in per batch')
+
+    def handle(self, *args, **options):
+        locations = options['location'] or sorted(db.historical_data.distinct('location'))
+        if options['rebuild']:
+            db.prediction_models.delete_many({'_id': {'$in': locations}})
+
+        for location in locations:
+            added = train(location, options['batch_size'])
+            if added is None:
+                self.stdout.write(self.style.WARNING(f"{location}: updated concurrently, skipped"))
+            else:
+                self.stdout.write(f"{location}: {added} new entries")
+        self.stdout.write(self.style.SUCCESS(f"Trained {len(locations)} location models"))
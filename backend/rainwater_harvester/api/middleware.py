@@ -0,0 +1,158 @@
+"""
+Middleware for the rainwater harvester API.
+"""
+import gzip
+import logging
+import time
+from django.conf import settings
+from django.http import JsonResponse
+from django.utils.cache import patch_vary_headers
+from django.utils.deprecation import MiddlewareMixin
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, gzip is always available
+    brotli = None
+
+from .admission import build_policies, retry_after_header
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+COMPRESSIBLE_TYPES = ('application/json', 'text/')
+
+def _accepted_encodings(header):
+    """
+    Parse an Accept-Encoding header into a {coding: q} mapping.
+    """
+    encodings = {}
+    for part in header.split(','):
+        coding, _, params = part.strip().partition(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        encodings[coding] = quality
+    return encodings
+
+def choose_encoding(header):
+    """
+    Pick the best supported content coding for an Accept-Encoding header.
+
+    Brotli is preferred when the client accepts it and the library is installed.
+    """
+    encodings = _accepted_encodings(header or '')
+    wildcard = encodings.get('*', 0)
+    candidates = ['br', 'gzip'] if brotli is not None else ['gzip']
+    best, best_quality = None, 0
+    for coding in candidates:
+        quality = encodings.get(coding, wildcard)
+        if quality > best_quality:
+            best, best_quality = coding, quality
+    return best
+
+class CompressionMiddleware(MiddlewareMixin):
+    """
+    Compress large JSON/text responses with brotli or gzip.
+
+    Strong ETags get an encoding suffix so each representation keeps a
+    distinct validator; `conditional.etag_matches` strips it again.
+    """
+    def process_response(self, request, response):
+        if response.streaming or response.has_header('Content-Encoding'):
+            return response
+
+        content_type = response.get('Content-Type', '')
+        if not content_type.startswith(COMPRESSIBLE_TYPES):
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+
+        min_size = getattr(settings, 'RESPONSE_COMPRESSION_MIN_SIZE', 1024)
+        if len(response.content) < min_size:
+            return response
+
+        encoding = choose_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if encoding is None:
+            return response
+
+        try:
+            if encoding == 'br':
+                compressed = brotli.compress(
+                    response.content,
+                    quality=getattr(settings, 'RESPONSE_COMPRESSION_BROTLI_QUALITY', 5)
+                )
+            else:
+                compressed = gzip.compress(response.content, compresslevel=6, mtime=0)
+        except Exception as e:
+            logger.error(f"Error compressing response: {str(e)}")
+            return response
+
+        # Don't bother if compression made it bigger
+        if len(compressed) >= len(response.content):
+            return response
+
+        response.content = compressed
+        response['Content-Length'] = str(len(compressed))
+        response['Content-Encoding'] = encoding
+
+        etag = response.get('ETag')
+        if etag and not etag.startswith('W/') and etag.endswith('"'):
+            response['ETag'] = f'{etag[:-1]}-{encoding}"'
+
+        return response
+
+def client_key(request):
+    """
+    Identify the client a request comes from (for per-client rate limits).
+    """
+    if settings.ADMISSION_TRUST_FORWARDED_FOR:
+        forwarded = request.META.get('HTTP_X_FORWARDED_FOR', '')
+        if forwarded:
+            return forwarded.split(',')[0].strip()
+    return request.META.get('REMOTE_ADDR', '')
+
+class AdmissionControlMiddleware:
+    """
+    Rate-limit and bound the concurrency of the endpoints configured in
+    ADMISSION_CONTROL, answering 429 with Retry-After when over the limits.
+    """
+    policies = []
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        # Kept on the class so other code (e.g. metrics) can read the counters
+        AdmissionControlMiddleware.policies = build_policies(
+            settings.ADMISSION_CONTROL, settings.ADMISSION_MAX_CLIENTS
+        )
+
+    def __call__(self, request):
+        policy = next((policy for policy in self.policies if policy.matches(request)), None)
+        if policy is None:
+            return self.get_response(request)
+
+        admitted, retry_after = policy.admit(client_key(request))
+        if not admitted:
+            logger.warning(f"Rejected {request.method} {request.path} from {client_key(request)} ({policy.name})")
+            response = JsonResponse(
+                {
+                    'error': 'Too many requests.',
+                    'details': f'The {policy.name} endpoint is over its request limits.',
+                    'message': 'Please retry after the number of seconds in the Retry-After header.'
+                },
+                status=429
+            )
+            response['Retry-After'] = retry_after_header(retry_after)
+            return response
+
+        started = time.monotonic()
+        try:
+            return self.get_response(request)
+        finally:
+            policy.done(time.monotonic() - started)
@@ -0,0 +1,173 @@
+"""
+Portfolio (fleet-level) summaries across all sites.
+
+Every calculation upserts one small summary document per site into
+`site_summaries` (the latest result wins), so portfolio questions never touch
+the full result documents. The portfolio report is a single `$facet`
+aggregation over the summaries: totals, the ROI distribution, leak counts and
+the top sites by a metric are computed in one pass inside MongoDB (or by
+`portfolio_facets` on the embedded storage backend).
+
+A site is identified by the `siteId` given with the inputs. Inputs without
+one are each their own site (keyed by the input's ID): two anonymous users in
+the same city must not overwrite each other's summary or maintenance calendar.
+"""
+from .result_schema import location_cell
+
+# Metrics sites can be ranked by, with the sort direction that ranks "best" first
+PORTFOLIO_METRICS = {
+    'yearlyInflow': -1,
+    'dailyInflow': -1,
+    'savings': -1,
+    'roi': -1,
+    'paybackPeriod': 1,
+    'recommendedSize': -1,
+}
+
+# Fields returned for each top-ranked site
+_TOP_SITE_FIELDS = ('site', 'location', 'yearlyInflow', 'savings', 'roi', 'paybackPeriod', 'isLeaking', 'ts')
+
+def site_key(input_data):
+    """
+    Get the site ID for an input: its `siteId`, else one derived from the
+    input's ID (the normalised location only if the input has no ID).
+    """
+    if input_data.get('siteId'):
+        return input_data['siteId']
+    if input_data.get('_id') is not None:
+        return f"input:{input_data['_id']}"
+    return location_cell(input_data.get('location'))
+
+def build_site_summary(input_data, results):
+    """
+    Flatten API-shaped results into the per-site summary document.
+    """
+    inflow = results.get('inflow') or {}
+    roi = results.get('roi') or {}
+    leak = results.get('leakDetection') or {}
+    tank = results.get('tankRecommendation') or {}
+    site = site_key(input_data)
+    return {
+        '_id': site,
+        'site': site,
+        'location': input_data.get('location'),
+        'iid': input_data.get('_id'),
+        'ts': results.get('timestamp'),
+        'roofArea': input_data.get('roofArea', 0),
+        'tankCapacity': input_data.get('tankCapacity', 0),
+        'dailyInflow': inflow.get('dailyInflow', 0),
+        'yearlyInflow': inflow.get('yearlyInflow', 0),
+        'savings': roi.get('savings', 0),
+        'costs': roi.get('costs', 0),
+        'roi': roi.get('roi', 0),
+        'paybackPeriod': roi.get('paybackPeriod', 0),
+        'isLeaking': bool(leak.get('isLeaking', False)),
+        'leakSeverity': leak.get('severity'),
+        'recommendedSize': tank.get('recommendedSize', 0),
+    }
+
+def portfolio_pipeline(metric='yearlyInflow', top_k=10, roi_buckets=10, location=None):
+    """
+    Build the aggregation pipeline for a portfolio report.
+    """
+    pipeline = []
+    if location:
+        pipeline.append({'$match': {'location': location}})
+    pipeline.append({'$facet': {
+        'totals': [
+            {'$group': {
+                '_id': None,
+                'sites': {'$sum': 1},
+                'totalDailyInflow': {'$sum': '$dailyInflow'},
+                'totalYearlyInflow': {'$sum': '$yearlyInflow'},
+                'totalSavings': {'$sum': '$savings'},
+                'totalCosts': {'$sum': '$costs'},
+                'averageRoi': {'$avg': '$roi'},
+                'minRoi': {'$min': '$roi'},
+                'maxRoi': {'$max': '$roi'},
+                'leakingSites': {'$sum': {'$cond': ['$isLeaking', 1, 0]}},
+            }},
+        ],
+        'roiDistribution': [
+            {'$bucketAuto': {'groupBy': '$roi', 'buckets': roi_buckets}},
+        ],
+        'leaksBySeverity': [
+            {'$match': {'isLeaking': True}},
+            {'$group': {'_id': '$leakSeverity', 'count': {'$sum': 1}}},
+        ],
+        'top': [
+            {'$sort': {metric: PORTFOLIO_METRICS[metric], '_id': 1}},
+            {'$limit': top_k},
+            {'$project': {'_id': 0, **{field: 1 for field in _TOP_SITE_FIELDS}}},
+        ],
+    }})
+    return pipeline
+
+def portfolio_facets(summaries, metric='yearlyInflow', top_k=10, roi_buckets=10):
+    """
+    Compute the same facets as portfolio_pipeline in Python, for storage
+    backends without an aggregation framework. `summaries` are already
+    filtered by location.
+    """
+    summaries = list(summaries)
+    facets = {'totals': [], 'roiDistribution': [], 'leaksBySeverity': [], 'top': []}
+    if not summaries:
+        return facets
+
+    rois = sorted(summary['roi'] for summary in summaries)
+    facets['totals'].append({
+        'sites': len(summaries),
+        'totalDailyInflow': sum(summary['dailyInflow'] for summary in summaries),
+        'totalYearlyInflow': sum(summary['yearlyInflow'] for summary in summaries),
+        'totalSavings': sum(summary['savings'] for summary in summaries),
+        'totalCosts': sum(summary['costs'] for summary in summaries),
+        'averageRoi': sum(rois) / len(rois),
+        'minRoi': rois[0],
+        'maxRoi': rois[-1],
+        'leakingSites': sum(1 for summary in summaries if summary['isLeaking']),
+    })
+
+    # Like $bucketAuto: equal-count buckets that never split equal values;
+    # each bucket's max is the next bucket's min
+    size = max(1, -(-len(rois) // roi_buckets))
+    start = 0
+    while start < len(rois):
+        end = min(start + size, len(rois))
+        while end < len(rois) and rois[end] == rois[end - 1]:
+            end += 1
+        facets['roiDistribution'].append({
+            '_id': {'min': rois[start], 'max': rois[end] if end < len(rois) else rois[-1]},
+            'count': end - start,
+        })
+        start = end
+
+    severities = {}
+    for summary in summaries:
+        if summary['isLeaking']:
+            severities[summary['leakSeverity']] = severities.get(summary['leakSeverity'], 0) + 1
+    facets['leaksBySeverity'] = [{'_id': severity, 'count': count} for severity, count in severities.items()]
+
+    direction = PORTFOLIO_METRICS[metric]
+    ranked = sorted(summaries, key=lambda summary: summary['_id'])
+    ranked.sort(key=lambda summary: summary[metric], reverse=direction < 0)
+    facets['top'] = [{field: summary.get(field) for field in _TOP_SITE_FIELDS} for summary in ranked[:top_k]]
+    return facets
+
+def format_portfolio(facets, metric):
+    """
+    Turn the `$facet` output into the API response shape.
+    """
+    totals = facets['totals'][0] if facets['totals'] else {'sites': 0, 'leakingSites': 0}
+    totals.pop('_id', None)
+    return {
+        'totals': totals,
+        'roiDistribution': [
+            {'min': bucket['_id']['min'], 'max': bucket['_id']['max'], 'count': bucket['count']}
+            for bucket in facets['roiDistribution']
+        ],
+        'leaks': {
+            'total': totals.get('leakingSites', 0),
+            'bySeverity': {item['_id']: item['count'] for item in facets['leaksBySeverity']},
+        },
+        'top': {'metric': metric, 'sites': facets['top']},
+    }
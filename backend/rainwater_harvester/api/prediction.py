@@ -0,0 +1,325 @@
+"""
+Per-location inflow and outflow prediction models.
+
+Each location has one linear model that predicts the daily inflow and outflow
+of a tank from the day's rainfall and the tank capacity, fitted by (ridge)
+least squares on the location's `historical_data` entries. Models are trained
+incrementally: the document in `prediction_models` keeps the sufficient
+statistics (XᵀX, XᵀY, YᵀY and the sample count) of everything seen so far,
+so new entries are folded in without reading old ones again. New entries are
+found by `_id` from the last trained one, reaching back
+PREDICTION_TRAIN_OVERLAP_SECONDS so entries that commit late (with an
+older `_id`) are not skipped; the ids folded within that window are kept
+with the model so none is counted twice. The fitted
+coefficients and residual spreads are stored next to them as packed float64
+arrays.
+
+Fitted models are cached in memory for PREDICTION_CACHE_SECONDS, so a
+prediction is one small matrix product. Saving history entries counts new
+data per location; once PREDICTION_RETRAIN_MIN_NEW entries have arrived the
+model is retrained in a background thread. Concurrent retrains (in any
+process) are resolved by a revision check on the model document.
+
+A large gap between the actual and the predicted outflow (in residual
+standard deviations) hints at a leak.
+"""
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+import numpy as np
+from bson.binary import Binary
+from bson.objectid import ObjectId
+from django.conf import settings
+from pymongo import ASCENDING, ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Model features and targets
+FEATURES = ('intercept', 'rainfall', 'tankCapacityKl')
+TARGETS = ('inflow', 'outflow')
+
+# Ridge penalty that keeps XᵀX invertible for sites with little variation
+RIDGE = 1e-3
+
+# Outflow this many residual standard deviations above the prediction is unusual
+UNUSUAL_OUTFLOW_Z = 2.0
+
+_P = len(FEATURES)
+_T = len(TARGETS)
+
+def _collection():
+    # Imported lazily: calculation_service is also loaded in job workers before django.setup()
+    from .database import db
+    return db.prediction_models
+
+def features(rainfall, tank_capacity):
+    """
+    Build the design matrix for arrays (or scalars) of rainfall and capacity.
+    """
+    rainfall = np.atleast_1d(np.asarray(rainfall, dtype=np.float64))
+    tank_capacity = np.broadcast_to(np.asarray(tank_capacity, dtype=np.float64), rainfall.shape)
+    return np.column_stack([np.ones_like(rainfall), np.maximum(rainfall, 0), tank_capacity / 1000])
+
+def entry_rainfall(entry):
+    """
+    Get a history entry's daily rainfall (mm), or None if it has none.
+    """
+    rainfall = entry.get('rainfall')
+    if rainfall is None:
+        rainfall = (entry.get('weatherData') or {}).get('averageRainfall')
+    return rainfall
+
+def entry_arrays(entries):
+    """
+    Convert history entries to (X, Y) arrays, skipping entries without rainfall.
+    """
+    rows = [
+        (rainfall, entry.get('tankCapacity', 0), entry.get('inflow', 0), entry.get('outflow', 0))
+        for entry in entries
+        for rainfall in [entry_rainfall(entry)]
+        if rainfall is not None
+    ]
+    if not rows:
+        return np.empty((0, _P)), np.empty((0, _T))
+    data = np.asarray(rows, dtype=np.float64)
+    return features(data[:, 0], data[:, 1]), data[:, 2:]
+
+class SufficientStats:
+    """
+    XᵀX, XᵀY, the diagonal of YᵀY and the sample count of a least-squares fit.
+    """
+    __slots__ = ('xtx', 'xty', 'yty', 'n')
+
+    def __init__(self, xtx=None, xty=None, yty=None, n=0):
+        self.xtx = np.zeros((_P, _P)) if xtx is None else xtx
+        self.xty = np.zeros((_P, _T)) if xty is None else xty
+        self.yty = np.zeros(_T) if yty is None else yty
+        self.n = n
+
+    def add(self, x, y):
+        self.xtx += x.T @ x
+        self.xty += x.T @ y
+        self.yty += np.einsum('ij,ij->j', y, y)
+        self.n += len(x)
+
+    def fit(self):
+        """
+        Solve for the coefficients (features x targets) and the residual
+        standard deviation of each target.
+        """
+        coef = np.linalg.solve(self.xtx + RIDGE * np.eye(_P), self.xty)
+        # Residual sum of squares from the statistics alone
+        sse = self.yty - 2 * np.einsum('ij,ij->j', coef, self.xty) + np.einsum('ij,ik,kj->j', coef, self.xtx, coef)
+        sigma = np.sqrt(np.maximum(sse, 0) / max(self.n - _P, 1))
+        return coef, sigma
+
+    def to_binary(self):
+        return Binary(np.concatenate([self.xtx.ravel(), self.xty.ravel(), self.yty]).astype('<f8').tobytes())
+
+    @classmethod
+    def from_binary(cls, data, n):
+        values = np.frombuffer(bytes(data), dtype='<f8')
+        xtx = values[:_P * _P].reshape(_P, _P).copy()
+        xty = values[_P * _P:_P * _P + _P * _T].reshape(_P, _T).copy()
+        yty = values[_P * _P + _P * _T:].copy()
+        return cls(xtx, xty, yty, n)
+
+class Model:
+    """
+    A fitted model for one location.
+    """
+    __slots__ = ('location', 'coef', 'sigma', 'samples', 'trained')
+
+    def __init__(self, location, coef, sigma, samples, trained=None):
+        self.location = location
+        self.coef = coef
+        self.sigma = sigma
+        self.samples = samples
+        self.trained = trained
+
+    def predict(self, rainfall, tank_capacity):
+        """
+        Predict (inflow, outflow) arrays for arrays of rainfall and capacity.
+        """
+        predicted = np.maximum(features(rainfall, tank_capacity) @ self.coef, 0)
+        return predicted[:, 0], predicted[:, 1]
+
+    def to_document(self):
+        return {
+            'coef': Binary(self.coef.astype('<f8').tobytes()),
+            'sigma': self.sigma.tolist(),
+        }
+
+    @classmethod
+    def from_document(cls, document):
+        if not document.get('coef') or document.get('n', 0) < settings.PREDICTION_MIN_SAMPLES:
+            return None
+        coef = np.frombuffer(bytes(document['coef']), dtype='<f8').reshape(_P, _T).copy()
+        return cls(document['_id'], coef, np.asarray(document['sigma']), document['n'], document.get('trained'))
+
+# location -> (loaded at, Model or None)
+_cache = {}
+_cache_lock = threading.Lock()
+
+# Locations being retrained by this process
+_training = set()
+
+def get_model(location):
+    """
+    Get the fitted model for a location (None if there isn't enough data yet).
+    """
+    now = time.monotonic()
+    cached = _cache.get(location)
+    if cached is not None and now - cached[0] < settings.PREDICTION_CACHE_SECONDS:
+        return cached[1]
+    document = _collection().find_one({'_id': location}, {'stats': 0})
+    model = Model.from_document(document) if document else None
+    with _cache_lock:
+        _cache[location] = (now, model)
+    return model
+
+def predict_usage(location, rainfall, tank_capacity, outflow=None):
+    """
+    Predict a site's daily inflow and outflow from its location's model.
+
+    When the actual `outflow` is given, also says how unusual it is. Returns
+    None when the location has no model yet (or predictions are disabled).
+    """
+    if not settings.PREDICTION_ENABLED:
+        return None
+    model = get_model(location)
+    if model is None:
+        return None
+    inflow, predicted_outflow = model.predict(rainfall, tank_capacity)
+    prediction = {
+        'expectedInflow': round(float(inflow[0]), 2),
+        'expectedOutflow': round(float(predicted_outflow[0]), 2),
+        'samples': model.samples,
+    }
+    if outflow is not None:
+        z = (outflow - predicted_outflow[0]) / max(float(model.sigma[1]), 1e-6)
+        prediction['outflowZScore'] = round(float(z), 2)
+        prediction['unusualOutflow'] = bool(z > UNUSUAL_OUTFLOW_Z)
+    return prediction
+
+def _window_start(high_water):
+    return ObjectId.from_datetime(
+        high_water.generation_time - timedelta(seconds=settings.PREDICTION_TRAIN_OVERLAP_SECONDS)
+    )
+
+def train(location, batch_size=1000):
+    """
+    Fold the location's history entries not trained on yet into the model's
+    statistics and refit. Returns the number of entries added, or None if
+    another trainer updated the model first.
+    """
+    from .database import db
+
+    collection = _collection()
+    document = collection.find_one({'_id': location}) or {}
+    revision = document.get('rev', 0)
+    stats = (
+        SufficientStats.from_binary(document['stats'], document['n'])
+        if document.get('stats') else SufficientStats()
+    )
+    trained_until = document.get('until')
+    seen = set(document.get('seen') or [])
+    pending = document.get('pending', 0)
+
+    query = {'location': location}
+    if isinstance(trained_until, ObjectId):
+        query['_id'] = {'$gte': _window_start(trained_until)}
+    elif trained_until:
+        # Model trained before the _id high-water mark: continue from its timestamp once
+        query['timestamp'] = {'$gt': trained_until}
+        trained_until = None
+    cursor = db.historical_data.find(
+        query, {'timestamp': 1, 'rainfall': 1, 'weatherData.averageRainfall': 1,
+                'tankCapacity': 1, 'inflow': 1, 'outflow': 1}
+    ).sort('_id', ASCENDING).batch_size(batch_size)
+
+    added = 0
+    batch = []
+    for entry in cursor:
+        if entry['_id'] in seen:
+            continue
+        batch.append(entry)
+        seen.add(entry['_id'])
+        if trained_until is None or entry['_id'] > trained_until:
+            trained_until = entry['_id']
+        if len(batch) >= batch_size:
+            stats.add(*entry_arrays(batch))
+            added += len(batch)
+            batch = []
+    if batch:
+        stats.add(*entry_arrays(batch))
+        added += len(batch)
+
+    # Only ids inside the next run's overlap window can be read again
+    if trained_until is not None:
+        window_start = _window_start(trained_until)
+        seen = {entry_id for entry_id in seen if entry_id >= window_start}
+    update = {
+        'stats': stats.to_binary(),
+        'n': stats.n,
+        'until': trained_until,
+        'seen': sorted(seen),
+        'trained': datetime.utcnow(),
+    }
+    model = None
+    if stats.n:
+        coef, sigma = stats.fit()
+        model = Model(location, coef, sigma, stats.n, update['trained'])
+        update.update(model.to_document())
+
+    try:
+        result = collection.update_one(
+            {'_id': location, 'rev': revision} if revision else {'_id': location, 'rev': {'$exists': False}},
+            {'$set': update, '$inc': {'rev': 1, 'pending': -pending}},
+            upsert=not document
+        )
+        stored = result.matched_count or result.upserted_id is not None
+    except DuplicateKeyError:
+        # Another trainer created the model first
+        stored = False
+    if stored:
+        with _cache_lock:
+            _cache[location] = (time.monotonic(), model if stats.n >= settings.PREDICTION_MIN_SAMPLES else None)
+        logger.info(f"Trained prediction model for {location} on {added} new entries ({stats.n} total)")
+        return added
+    logger.info(f"Prediction model for {location} was updated concurrently; skipping")
+    return None
+
+def _train_in_background(location):
+    try:
+        train(location)
+    except Exception as e:
+        logger.error(f"Error training prediction model for {location}: {str(e)}")
+    finally:
+        with _cache_lock:
+            _training.discard(location)
+
+def record_new_entry(location):
+    """
+    Count a new history entry for a location and start a background retrain
+    once enough have arrived.
+    """
+    if not location or not settings.PREDICTION_ENABLED:
+        return
+    document = _collection().find_one_and_update(
+        {'_id': location},
+        {'$inc': {'pending': 1}},
+        projection={'pending': 1},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    if document['pending'] < settings.PREDICTION_RETRAIN_MIN_NEW:
+        return
+    with _cache_lock:
+        if location in _training:
+            return
+        _training.add(location)
+    threading.Thread(target=_train_in_background, args=(location,), daemon=True).start()
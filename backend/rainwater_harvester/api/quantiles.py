@@ -0,0 +1,292 @@
+"""
+Streaming percentile sketches of inflow, outflow and ROI.
+
+Every saved history entry is added to a t-digest per (location, month) and
+metric, stored in `quantile_sketches`. A t-digest summarises a distribution
+in at most ~SKETCH_COMPRESSION weighted centroids (a few KB as packed float64
+arrays), with most precision kept in the tails, and two digests merge into a
+digest of the combined data. So percentiles of any set of locations and
+months are answered by merging their small digests instead of sorting
+`historical_data`.
+
+Adding a value is one atomic `$push` onto the document's pending values.
+Once SKETCH_BUFFER_SIZE values are pending they are folded into the digest,
+guarded by a revision check so a concurrent insert is never lost (the fold
+is simply retried on the next insert). Readers merge the pending values too.
+"""
+import logging
+import numpy as np
+from bson.binary import Binary
+from django.conf import settings
+from . import repository
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Metric -> value of a history entry (None when missing)
+SKETCH_METRICS = {
+    'inflow': lambda entry: entry.get('inflow'),
+    'outflow': lambda entry: entry.get('outflow'),
+    'roi': lambda entry: (entry.get('roi') or {}).get('roi'),
+}
+
+# Percentiles reported when none are asked for
+DEFAULT_QUANTILES = (0.1, 0.25, 0.5, 0.75, 0.9)
+
+# Values kept pending per metric while rebuilding, before folding
+_BUILD_BATCH = 10000
+
+def _scale(q, compression):
+    # k1 scale function: centroids are small near q = 0 and q = 1
+    return compression / (2 * np.pi) * np.arcsin(2 * q - 1)
+
+def _scale_inverse(k, compression):
+    return (np.sin(min(k * 2 * np.pi / compression, np.pi / 2)) + 1) / 2
+
+class TDigest:
+    """
+    A merging t-digest: sorted centroid means and weights, plus the exact
+    minimum and maximum.
+    """
+    def __init__(self, means=(), weights=(), minimum=np.inf, maximum=-np.inf):
+        self.means = np.asarray(means, dtype=np.float64)
+        self.weights = np.asarray(weights, dtype=np.float64)
+        self.min = float(minimum)
+        self.max = float(maximum)
+
+    @property
+    def count(self):
+        return float(self.weights.sum())
+
+    @classmethod
+    def of(cls, values, compression):
+        values = np.asarray([value for value in values if value is not None], dtype=np.float64)
+        values = values[np.isfinite(values)]
+        if not len(values):
+            return cls()
+        return cls(values, np.ones(len(values)), values.min(), values.max()).compress(compression)
+
+    @classmethod
+    def merge(cls, digests, compression):
+        """
+        Merge digests into one digest of all their data.
+        """
+        digests = [digest for digest in digests if len(digest.means)]
+        if not digests:
+            return cls()
+        return cls(
+            np.concatenate([digest.means for digest in digests]),
+            np.concatenate([digest.weights for digest in digests]),
+            min(digest.min for digest in digests),
+            max(digest.max for digest in digests),
+        ).compress(compression)
+
+    def compress(self, compression):
+        """
+        Merge neighbouring centroids as far as the scale function allows.
+        """
+        if len(self.means) < 2:
+            return self
+        order = np.argsort(self.means, kind='mergesort')
+        means, weights = self.means[order], self.weights[order]
+        total = weights.sum()
+
+        merged_means, merged_weights = [], []
+        mean, weight = means[0], weights[0]
+        done = 0.0
+        limit = total * _scale_inverse(_scale(0.0, compression) + 1, compression)
+        for next_mean, next_weight in zip(means[1:], weights[1:]):
+            if done + weight + next_weight <= limit:
+                weight += next_weight
+                mean += (next_mean - mean) * next_weight / weight
+            else:
+                merged_means.append(mean)
+                merged_weights.append(weight)
+                done += weight
+                limit = total * _scale_inverse(_scale(done / total, compression) + 1, compression)
+                mean, weight = next_mean, next_weight
+        merged_means.append(mean)
+        merged_weights.append(weight)
+        self.means = np.array(merged_means)
+        self.weights = np.array(merged_weights)
+        return self
+
+    def _points(self):
+        # Cumulative weight at each centroid's centre, anchored at the min and max
+        centres = np.cumsum(self.weights) - self.weights / 2
+        return (
+            np.concatenate([[0.0], centres, [self.count]]),
+            np.concatenate([[self.min], self.means, [self.max]]),
+        )
+
+    def quantile(self, q):
+        """
+        Estimate the value at quantile q (0..1); None when empty.
+        """
+        if not len(self.means):
+            return None
+        ranks, values = self._points()
+        return float(np.interp(min(max(q, 0.0), 1.0) * self.count, ranks, values))
+
+    def cdf(self, value):
+        """
+        Estimate the fraction of the data at or below `value`; None when empty.
+        """
+        if not len(self.means):
+            return None
+        if value < self.min:
+            return 0.0
+        if value >= self.max:
+            return 1.0
+        ranks, values = self._points()
+        return float(np.interp(value, values, ranks) / self.count)
+
+    def to_binary(self):
+        """
+        Pack as float64: min, max, then the means and the weights.
+        """
+        packed = np.concatenate([[self.min, self.max], self.means, self.weights])
+        return Binary(packed.astype('<f8').tobytes())
+
+    @classmethod
+    def from_binary(cls, data):
+        if not data:
+            return cls()
+        packed = np.frombuffer(bytes(data), dtype='<f8')
+        size = (len(packed) - 2) // 2
+        return cls(packed[2:2 + size], packed[2 + size:], packed[0], packed[1])
+
+def sketch_id(location, month):
+    return f"{location}|{month}"
+
+def entry_values(entry):
+    """
+    Get the sketched metric values of a history entry.
+    """
+    values = {}
+    for metric, extract in SKETCH_METRICS.items():
+        try:
+            value = extract(entry)
+            if value is not None:
+                values[metric] = float(value)
+        except (AttributeError, TypeError, ValueError):
+            continue
+    return values
+
+def document_digest(document, metric, compression=None):
+    """
+    Get a sketch document's digest of a metric, pending values included.
+    """
+    compression = compression or settings.SKETCH_COMPRESSION
+    digest = TDigest.from_binary((document.get('digests') or {}).get(metric))
+    pending = (document.get('pending') or {}).get(metric) or []
+    if not pending:
+        return digest
+    return TDigest.merge([digest, TDigest.of(pending, compression)], compression)
+
+def folded(document):
+    """
+    Fold a sketch document's pending values into its digests. Returns the
+    packed digests by metric.
+    """
+    return {
+        metric: document_digest(document, metric).to_binary()
+        for metric in SKETCH_METRICS
+        if (document.get('digests') or {}).get(metric) or (document.get('pending') or {}).get(metric)
+    }
+
+def record_entry(entry):
+    """
+    Add a saved history entry to its location's sketches for the month.
+    """
+    values = entry_values(entry)
+    timestamp = entry.get('timestamp')
+    if not values or not entry.get('location') or not isinstance(timestamp, str):
+        return
+    document = repository.sketches.add(
+        sketch_id(entry['location'], timestamp[:7]), entry['location'], timestamp[:7], values
+    )
+    pending = max((len(items) for items in (document.get('pending') or {}).values()), default=0)
+    if pending >= settings.SKETCH_BUFFER_SIZE:
+        if not repository.sketches.compact(document['_id'], document['rev'], folded(document)):
+            logger.debug(f"Sketch {document['_id']} changed while folding; will fold on a later insert")
+
+def build_documents(entries):
+    """
+    Build sketch documents from scratch for an iterable of history entries.
+    Memory stays bounded by the number of (location, month) pairs.
+    """
+    documents = {}
+    for entry in entries:
+        values = entry_values(entry)
+        timestamp = entry.get('timestamp')
+        if not values or not entry.get('location') or not isinstance(timestamp, str):
+            continue
+        key = sketch_id(entry['location'], timestamp[:7])
+        document = documents.setdefault(key, {
+            '_id': key, 'location': entry['location'], 'month': timestamp[:7],
+            'count': 0, 'rev': 0, 'digests': {}, 'pending': {},
+        })
+        document['count'] += 1
+        for metric, value in values.items():
+            document['pending'].setdefault(metric, []).append(value)
+        if max(len(items) for items in document['pending'].values()) >= _BUILD_BATCH:
+            document['digests'], document['pending'] = folded(document), {}
+
+    for document in documents.values():
+        document['digests'], document['pending'] = folded(document), {}
+    return list(documents.values())
+
+def merged_digest(documents, metric):
+    return TDigest.merge(
+        [document_digest(document, metric) for document in documents], settings.SKETCH_COMPRESSION
+    )
+
+def percentiles(metric, quantiles=DEFAULT_QUANTILES, location=None, start=None, end=None):
+    """
+    Estimate percentiles of a metric over the history entries of a location
+    (all locations by default) in the months [start, end] ('YYYY-MM').
+    """
+    documents = repository.sketches.find(location=location, start=start, end=end)
+    digest = merged_digest(documents, metric)
+    return {
+        'metric': metric,
+        'location': location,
+        'start': start,
+        'end': end,
+        'count': int(digest.count),
+        'min': digest.min if digest.count else None,
+        'max': digest.max if digest.count else None,
+        'percentiles': {
+            f"p{round(q * 100, 2):g}": _rounded(digest.quantile(q)) for q in quantiles
+        },
+    }
+
+def peer_rank(metric, location, value=None, start=None, end=None):
+    """
+    Rank a location against all other locations: the share of peer entries
+    whose metric is at or below `value` (the location's own median by default).
+    """
+    documents = repository.sketches.find(start=start, end=end)
+    own = [document for document in documents if document['location'] == location]
+    peers = [document for document in documents if document['location'] != location]
+    own_digest = merged_digest(own, metric)
+    if value is None:
+        value = own_digest.quantile(0.5)
+    peer_digest = merged_digest(peers, metric)
+    rank = peer_digest.cdf(value) if value is not None else None
+    return {
+        'metric': metric,
+        'location': location,
+        'start': start,
+        'end': end,
+        'value': _rounded(value),
+        'count': int(own_digest.count),
+        'percentileRank': round(rank * 100, 1) if rank is not None else None,
+        'peerLocations': len({document['location'] for document in peers}),
+        'peerCount': int(peer_digest.count),
+        'peerMedian': _rounded(peer_digest.quantile(0.5)),
+    }
+
+def _rounded(value):
+    return round(value, 2) if value is not None else None
@@ -0,0 +1,165 @@
+"""
+Read routing for MongoDB replica sets.
+
+Heavy and analytic GET endpoints can read from secondaries so they don't
+compete with the write path on the primary. Each route in
+settings.MONGODB_READ_ROUTING has a `mode`:
+
+- 'primary': read from the primary
+- 'secondary': read from a secondary whose replication lag is at most
+  `max_staleness` seconds (at least 90, MongoDB's minimum), falling back to
+  the primary when none qualifies
+
+Read-your-writes uses causal sessions: write endpoints return the session's
+operation and cluster time as an opaque `X-Causal-Token` header. A read that
+sends it back runs in a causally consistent session advanced to that time, so
+even a secondary waits until it has applied the client's writes before
+answering. The guarantee holds for writes acknowledged by a majority
+(MONGODB_WRITE_CONCERN_W = 'majority'), so with any other write concern every
+route reads from the primary. The frontend (services/api.js) keeps the token
+of its last write and sends it with every request.
+
+Routing is scoped with `route_reads` / `causal_writes` (or the `reads_routed`
+/ `writes_causal` decorators) around a view's work; repositories pick it up
+through `routed` and `current_session`. It only applies to the MongoDB
+storage backend.
+"""
+import base64
+import contextvars
+import functools
+import logging
+from contextlib import contextmanager
+from bson import json_util
+from django.conf import settings
+from pymongo.read_preferences import Primary, SecondaryPreferred
+from .database import client
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+CAUSAL_TOKEN_HEADER = 'X-Causal-Token'
+
+# (read preference or None, session or None) of the current request
+_current = contextvars.ContextVar('read_route', default=(None, None))
+
+def majority_writes():
+    return str(settings.MONGODB_WRITE_CONCERN_W) == 'majority'
+
+def read_preference(route):
+    """
+    Build the read preference configured for a route (primary if unknown, or
+    if writes aren't majority-acknowledged and so can't be read back causally).
+    """
+    policy = settings.MONGODB_READ_ROUTING.get(route) or {}
+    if policy.get('mode') == 'secondary' and majority_writes():
+        return SecondaryPreferred(max_staleness=max(90, int(policy.get('max_staleness', 90))))
+    return Primary()
+
+def encode_token(session):
+    """
+    Encode a session's operation and cluster time as a causal token (None if
+    the server doesn't report them, e.g. a standalone server).
+    """
+    if session is None or session.operation_time is None or session.cluster_time is None:
+        return None
+    payload = json_util.dumps({'op': session.operation_time, 'ct': session.cluster_time})
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii')
+
+def decode_token(token):
+    """
+    Decode a causal token into (operation time, cluster time), or None if it
+    is missing or malformed.
+    """
+    if not token:
+        return None
+    try:
+        payload = json_util.loads(base64.urlsafe_b64decode(token.encode('ascii')).decode('utf-8'))
+        return payload['op'], payload['ct']
+    except (ValueError, KeyError, TypeError) as e:
+        logger.warning(f"Ignoring malformed causal token: {str(e)}")
+        return None
+
+def request_token(request):
+    return request.META.get('HTTP_' + CAUSAL_TOKEN_HEADER.upper().replace('-', '_'))
+
+@contextmanager
+def route_reads(route, token=None):
+    """
+    Route the reads made inside the block per the route's policy; with a
+    causal token, they also see the writes the token was issued for.
+    """
+    times = decode_token(token)
+    session = None
+    if times is not None:
+        session = client.start_session(causal_consistency=True)
+        operation_time, cluster_time = times
+        session.advance_cluster_time(cluster_time)
+        session.advance_operation_time(operation_time)
+    reset = _current.set((read_preference(route), session))
+    try:
+        yield session
+    finally:
+        _current.reset(reset)
+        if session is not None:
+            session.end_session()
+
+@contextmanager
+def causal_writes():
+    """
+    Run the writes made inside the block in one causally consistent session.
+    Yields the session (None on other storage backends).
+    """
+    if settings.STORAGE_BACKEND != 'mongodb':
+        yield None
+        return
+    with client.start_session(causal_consistency=True) as session:
+        reset = _current.set((None, session))
+        try:
+            yield session
+        finally:
+            _current.reset(reset)
+
+def current_session():
+    return _current.get()[1]
+
+def routed(collection):
+    """
+    Apply the current read route to a collection. Returns (collection, session).
+    """
+    preference, session = _current.get()
+    if preference is not None:
+        collection = collection.with_options(read_preference=preference)
+    return collection, session
+
+def with_causal_token(response, session):
+    """
+    Attach the causal token of a write session to a response.
+    """
+    token = encode_token(session)
+    if token:
+        response[CAUSAL_TOKEN_HEADER] = token
+    return response
+
+def reads_routed(route):
+    """
+    Decorator for view methods: route the method's reads, honouring the
+    request's causal token.
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(view, request, *args, **kwargs):
+            with route_reads(route, request_token(request)):
+                return method(view, request, *args, **kwargs)
+        return wrapper
+    return decorator
+
+def writes_causal(method):
+    """
+    Decorator for view methods: run the method's writes in one causal session
+    and return its causal token with the response.
+    """
+    @functools.wraps(method)
+    def wrapper(view, request, *args, **kwargs):
+        with causal_writes() as session:
+            return with_causal_token(method(view, request, *args, **kwargs), session)
+    return wrapper
@@ -0,0 +1,340 @@
+"""
+Incremental recomputation of stored calculation results.
+
+When an input such as the water tariff changes, only the result fields that
+depend on it are recomputed, using the weather snapshot (average rainfall)
+already stored with each result, so no weather is fetched. The allocation
+plan is recomputed from the result's stored forecast (`fid`). Documents are
+processed in `_id` order in batches of bulk `$set` updates by a background
+thread. Progress is kept in the `recompute_jobs` collection, including the last
+processed `_id`, so an interrupted job can be resumed.
+
+A run claims its job with a lease (RECOMPUTE_LEASE_SECONDS) renewed after
+every batch, so a job is only run by one process at a time; a job whose
+process stopped is claimed again once its lease has expired.
+
+Compact documents record the new input values under `ovr` (the referenced
+input document is left untouched); legacy documents have their embedded
+inputs updated in place.
+"""
+import logging
+import threading
+import uuid
+from datetime import datetime, timedelta
+import numpy as np
+from bson.objectid import ObjectId
+from pymongo import ASCENDING, ReturnDocument, UpdateOne
+from django.conf import settings
+from .database import db, bump_collection_version
+from .result_schema import SCHEMA_VERSION, encode_field, decode_forecast, RESULT_FIELDS
+from .allocation import plan_allocation
+from .calculation_service import (
+    calculate_inflow,
+    detect_leak,
+    calculate_roi,
+    optimize_water_usage,
+    recommend_tank_size
+)
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Result field -> inputs it depends on ('weather' is the stored rainfall snapshot)
+# allocationPlan also needs the daily forecast, so it is skipped for results without one
+FIELD_DEPENDENCIES = {
+    'inflow': {'roofArea', 'weather'},
+    'leakDetection': {'roofArea', 'outflow', 'weather'},
+    'roi': {'roofArea', 'waterCostPerLiter', 'setupCost', 'maintenanceCost', 'weather'},
+    'waterUsage': {'tankCapacity', 'weather'},
+    'tankRecommendation': {'roofArea', 'outflow', 'weather'},
+    'allocationPlan': {'tankCapacity', 'roofArea', 'outflow', 'weather'},
+}
+
+# Inputs that can be changed by a recompute
+RECOMPUTABLE_INPUTS = {'roofArea', 'outflow', 'tankCapacity', 'waterCostPerLiter', 'setupCost', 'maintenanceCost'}
+
+# Defaults used by process_inputs for optional inputs
+INPUT_DEFAULTS = {
+    'roofArea': 0,
+    'outflow': 0,
+    'tankCapacity': 0,
+    'waterCostPerLiter': 0.002,
+    'setupCost': 5000,
+    'maintenanceCost': 500,
+}
+
+def affected_fields(changed_inputs):
+    """
+    Get the result fields that depend on any of the changed inputs.
+    """
+    changed = set(changed_inputs)
+    return sorted(field for field, inputs in FIELD_DEPENDENCIES.items() if inputs & changed)
+
+def recompute_fields(fields, inputs, average_rainfall, stored_inflow, forecast=None):
+    """
+    Recompute the given result fields (API shape) with the same formulas as
+    process_inputs. `stored_inflow` is used when inflow itself is not recomputed;
+    `forecast` is the stored daily forecast (weatherData['forecast']).
+    """
+    values = {key: inputs.get(key, default) for key, default in INPUT_DEFAULTS.items()}
+    daily_inflow = calculate_inflow(average_rainfall, values['roofArea'])
+    inflow = {
+        'dailyInflow': daily_inflow,
+        'monthlyInflow': daily_inflow * 30,
+        'yearlyInflow': daily_inflow * 365
+    } if 'inflow' in fields or stored_inflow is None else stored_inflow
+
+    updated = {}
+    for field in fields:
+        if field == 'inflow':
+            updated['inflow'] = inflow
+        elif field == 'leakDetection':
+            updated['leakDetection'] = detect_leak(inflow['dailyInflow'], values['outflow'])
+        elif field == 'roi':
+            updated['roi'] = calculate_roi(
+                inflow['yearlyInflow'], values['waterCostPerLiter'],
+                values['setupCost'], values['maintenanceCost']
+            )
+        elif field == 'waterUsage':
+            updated['waterUsage'] = optimize_water_usage(
+                average_rainfall, values['tankCapacity'], values['tankCapacity'] * 0.5
+            )
+        elif field == 'tankRecommendation':
+            updated['tankRecommendation'] = recommend_tank_size(
+                average_rainfall, values['roofArea'], values['outflow']
+            )
+        elif field == 'allocationPlan' and forecast:
+            rainfall = np.array([float(day.get('rainfall', 0)) for day in forecast])
+            updated['allocationPlan'] = plan_allocation(
+                values['tankCapacity'],
+                values['tankCapacity'] * 0.5,
+                calculate_inflow(rainfall, values['roofArea']).tolist(),
+                values['outflow'],
+                [day.get('date') for day in forecast]
+            )
+    return updated
+
+def _stored_inflow(document):
+    if document.get('v') == SCHEMA_VERSION:
+        stored = (document.get('d') or {}).get(RESULT_FIELDS['inflow'][0])
+        if not stored:
+            return None
+        return {
+            'dailyInflow': stored.get('d', 0),
+            'monthlyInflow': stored.get('m', 0),
+            'yearlyInflow': stored.get('y', 0)
+        }
+    return (document.get('data') or {}).get('inflow')
+
+def _build_update(document, changes, fields, input_doc, forecast_doc=None):
+    """
+    Build the UpdateOne for one result document, or None if it can't be recomputed.
+    """
+    compact = document.get('v') == SCHEMA_VERSION
+    if compact:
+        inputs = dict(input_doc or {})
+        inputs.update(document.get('ovr') or {})
+        average_rainfall = document.get('ar')
+        forecast = decode_forecast(forecast_doc)['forecast'] if forecast_doc else None
+    else:
+        data = document.get('data') or {}
+        inputs = dict(document.get('input_data') or data.get('inputs') or {})
+        average_rainfall = (data.get('weatherData') or {}).get('averageRainfall')
+        forecast = (data.get('weatherData') or {}).get('forecast')
+    if average_rainfall is None or not inputs:
+        return None
+
+    inputs.update(changes)
+    updated = recompute_fields(fields, inputs, average_rainfall, _stored_inflow(document), forecast)
+
+    update = {}
+    for name, value in updated.items():
+        if compact:
+            short, stored = encode_field(name, value)
+            update[f'd.{short}'] = stored
+        else:
+            update[f'data.{name}'] = value
+    for name, value in changes.items():
+        if compact:
+            update[f'ovr.{name}'] = value
+        else:
+            update[f'input_data.{name}'] = value
+            update[f'data.inputs.{name}'] = value
+    return UpdateOne({'_id': document['_id']}, {'$set': update})
+
+def _process_batch(batch, changes, fields):
+    input_ids = {doc['iid'] for doc in batch if doc.get('iid') is not None}
+    inputs = {}
+    if input_ids:
+        inputs = {doc['_id']: doc for doc in db.user_inputs.find({'_id': {'$in': list(input_ids)}})}
+    forecasts = {}
+    forecast_ids = {doc['fid'] for doc in batch if doc.get('fid') is not None}
+    if 'allocationPlan' in fields and forecast_ids:
+        forecasts = {doc['_id']: doc for doc in db.forecasts.find({'_id': {'$in': list(forecast_ids)}})}
+
+    operations = []
+    for document in batch:
+        operation = _build_update(
+            document, changes, fields, inputs.get(document.get('iid')), forecasts.get(document.get('fid'))
+        )
+        if operation is not None:
+            operations.append(operation)
+    if operations:
+        db.calculation_results.bulk_write(operations, ordered=False)
+    return len(operations)
+
+def _claim(owner, job_id=None):
+    """
+    Claim a queued job, or one left running by a process whose lease expired
+    (a specific job if `job_id` is given). Returns the job document or None.
+    """
+    now = datetime.utcnow()
+    query = {
+        'status': {'$in': ['queued', 'running']},
+        '$or': [{'lease': {'$lt': now}}, {'lease': {'$exists': False}}],
+    }
+    if job_id is not None:
+        query['_id'] = job_id
+    return db.recompute_jobs.find_one_and_update(
+        query,
+        {'$set': {
+            'status': 'running',
+            'owner': owner,
+            'lease': now + timedelta(seconds=settings.RECOMPUTE_LEASE_SECONDS),
+        }},
+        sort=[('_id', ASCENDING)],
+        return_document=ReturnDocument.AFTER
+    )
+
+def run_recompute(job_id, job=None):
+    """
+    Run (or resume) a recompute job to completion, recording progress.
+    Does nothing if the job is finished or another process holds it.
+    """
+    owner = uuid.uuid4().hex
+    if job is None:
+        job = _claim(owner, job_id)
+    else:
+        owner = job['owner']
+    if job is None:
+        return
+    changes = job['changes']
+    fields = job['fields']
+    query = job.get('query') or {}
+    last_id = job.get('last_id')
+    updated = job.get('updated', 0)
+    processed = job.get('processed', 0)
+
+    owned = {'_id': job_id, 'owner': owner}
+    try:
+        while True:
+            batch_query = dict(query)
+            if last_id is not None:
+                batch_query['_id'] = {'$gt': last_id}
+            batch = list(
+                db.calculation_results.find(batch_query)
+                .sort('_id', ASCENDING)
+                .limit(settings.RECOMPUTE_BATCH_SIZE)
+            )
+            if not batch:
+                break
+            updated += _process_batch(batch, changes, fields)
+            processed += len(batch)
+            last_id = batch[-1]['_id']
+            renewed = db.recompute_jobs.update_one(owned, {'$set': {
+                'processed': processed,
+                'updated': updated,
+                'last_id': last_id,
+                'updated_at': datetime.now().isoformat(),
+                'lease': datetime.utcnow() + timedelta(seconds=settings.RECOMPUTE_LEASE_SECONDS),
+            }})
+            bump_collection_version('calculation_results')
+            if renewed.matched_count == 0:
+                logger.warning(f"Recompute job {job_id} was claimed by another process; stopping")
+                return
+
+        db.recompute_jobs.update_one(owned, {'$set': {
+            'status': 'completed',
+            'finished_at': datetime.now().isoformat()
+        }})
+        logger.info(f"Recompute job {job_id} completed: {updated} results updated")
+    except Exception as e:
+        logger.error(f"Recompute job {job_id} failed: {str(e)}", exc_info=True)
+        db.recompute_jobs.update_one(owned, {'$set': {
+            'status': 'failed',
+            'error': str(e)
+        }})
+
+def create_recompute_job(changes, location=None):
+    """
+    Record a recompute job for changed inputs and return the job document.
+
+    `changes` maps input names (see RECOMPUTABLE_INPUTS) to their new values.
+    """
+    unknown = set(changes) - RECOMPUTABLE_INPUTS
+    if unknown:
+        raise ValueError(f"Inputs cannot be recomputed: {', '.join(sorted(unknown))}")
+
+    query = {}
+    if location:
+        query = {'$or': [{'loc': location}, {'input_data.location': location}]}
+    job = {
+        '_id': ObjectId(),
+        'changes': changes,
+        'fields': affected_fields(changes),
+        'query': query,
+        'status': 'queued',
+        'total': db.calculation_results.count_documents(query),
+        'processed': 0,
+        'updated': 0,
+        'last_id': None,
+        'created_at': datetime.now().isoformat(),
+    }
+    db.recompute_jobs.insert_one(job)
+    return job
+
+def start_recompute(changes, location=None):
+    """
+    Start a recompute job in a background thread and return the job document.
+    """
+    job = create_recompute_job(changes, location)
+    threading.Thread(target=run_recompute, args=(job['_id'],), daemon=True).start()
+    return job
+
+def get_job(job_id):
+    """
+    Get a recompute job's progress in API shape, or None.
+    """
+    if not ObjectId.is_valid(str(job_id)):
+        return None
+    job = db.recompute_jobs.find_one({'_id': ObjectId(str(job_id))})
+    if job is None:
+        return None
+    total = job.get('total') or 0
+    return {
+        'id': str(job['_id']),
+        'status': job['status'],
+        'changes': job['changes'],
+        'fields': job['fields'],
+        'total': total,
+        'processed': job.get('processed', 0),
+        'updated': job.get('updated', 0),
+        'progress': (job.get('processed', 0) / total) if total else 1.0,
+        'error': job.get('error'),
+        'createdAt': job.get('created_at'),
+        'finishedAt': job.get('finished_at'),
+    }
+
+def resume_unfinished():
+    """
+    Run the jobs left queued or running by a process that stopped, one after
+    another in this thread. Jobs still held by a live process are skipped.
+    Returns the number of jobs run.
+    """
+    resumed = 0
+    while True:
+        job = _claim(uuid.uuid4().hex)
+        if job is None:
+            return resumed
+        run_recompute(job['_id'], job)
+        resumed += 1
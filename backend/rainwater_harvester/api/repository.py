@@ -0,0 +1,543 @@
+"""
+Repository layer for MongoDB persistence.
+
+Each repository wraps one collection. Writes return the stored document
+directly (insert_one fills in `_id` on the dict it was given) instead of
+reading it back, results are linked to their input by explicit ID, and bulk
+writes are unordered with a configurable write concern. Every write that
+changes what a GET endpoint returns bumps the collection's version (used for
+ETags). Reads follow the read route of the current request and writes join
+its causal session, if any (see read_routing.py).
+
+Use the module-level instances: `inputs`, `results`, `history`, `user_settings`,
+`site_summaries`, `maintenance`, `sketches`. With STORAGE_BACKEND = 'sqlite' they are the
+embedded equivalents from `sqlite_storage.py` instead.
+"""
+import logging
+from datetime import datetime, timedelta
+from bson.objectid import ObjectId
+from django.conf import settings
+from pymongo import ASCENDING, DESCENDING, ReturnDocument, UpdateOne, ReplaceOne
+from pymongo.errors import DuplicateKeyError
+from pymongo.write_concern import WriteConcern
+from .database import db, bump_collection_version, get_collection_version, SKETCH_INDEXES
+from .result_schema import SCHEMA_VERSION, encode_forecast, encode_result, decode_result
+from .portfolio import build_site_summary, portfolio_pipeline, format_portfolio
+from .maintenance import merge_tasks, to_datetime
+from .retention import find_with_archive
+from .read_routing import routed, current_session
+from .history_series import series_pipeline
+from .history_search import derive_fields, build_query
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+def to_object_id(value):
+    """
+    Convert a string ID to an ObjectId; other values are returned unchanged.
+    """
+    if isinstance(value, str) and ObjectId.is_valid(value):
+        return ObjectId(value)
+    return value
+
+def default_write_concern():
+    """
+    Build the write concern configured in settings.
+    """
+    w = settings.MONGODB_WRITE_CONCERN_W
+    return WriteConcern(
+        w=int(w) if str(w).isdigit() else w,
+        j=settings.MONGODB_WRITE_CONCERN_J or None
+    )
+
+class MongoRepository:
+    """
+    Base class for a repository backed by one MongoDB collection.
+    """
+    collection_name = None
+
+    def __init__(self, database, write_concern=None):
+        self.collection = database[self.collection_name].with_options(
+            write_concern=write_concern or default_write_concern()
+        )
+
+    def _collection(self, write_concern=None):
+        if write_concern is None:
+            return self.collection
+        return self.collection.with_options(write_concern=write_concern)
+
+    def _reader(self, collection=None):
+        """
+        Get the collection (this one by default) and session to read with.
+        """
+        return routed(self.collection if collection is None else collection)
+
+    def version(self):
+        """
+        Get the collection's change counter.
+        """
+        return get_collection_version(self.collection_name)
+
+    def changed(self):
+        bump_collection_version(self.collection_name)
+
+    def state(self):
+        """
+        Get (version, document count) for building ETags. The count is an
+        estimate from collection metadata. Both are read from the same kind
+        of member as the data, so routed reads are tagged with the version
+        they can see.
+        """
+        versions, session = self._reader(db.collection_versions)
+        document = versions.find_one({'_id': self.collection_name}, session=session)
+        collection, _ = self._reader()
+        return (document or {}).get('version', 0), collection.estimated_document_count()
+
+    def watch(self, **kwargs):
+        return self.collection.watch(**kwargs)
+
+    def insert_many(self, documents, write_concern=None):
+        """
+        Insert documents in one unordered batch and return them (with `_id`).
+        """
+        documents = list(documents)
+        if documents:
+            self._collection(write_concern).insert_many(documents, ordered=False)
+            self.changed()
+        return documents
+
+    def delete(self, document_id):
+        """
+        Delete a document by ID. Returns True if it existed.
+        """
+        result = self.collection.delete_one({'_id': to_object_id(document_id)})
+        if result.deleted_count > 0:
+            self.changed()
+            return True
+        return False
+
+class InputRepository(MongoRepository):
+    collection_name = 'user_inputs'
+
+    def save(self, input_data):
+        """
+        Save a user input and return it with its `_id`.
+        """
+        input_data.setdefault('timestamp', datetime.now().isoformat())
+        self.collection.insert_one(input_data, session=current_session())
+        logger.info(f"Input data saved to MongoDB with ID: {input_data['_id']}")
+        self.changed()
+        return input_data
+
+    def get(self, input_id):
+        collection, session = self._reader()
+        return collection.find_one({'_id': to_object_id(input_id)}, session=session)
+
+    def latest(self):
+        collection, session = self._reader()
+        return collection.find_one(sort=[('timestamp', DESCENDING)], session=session)
+
+class ResultRepository(MongoRepository):
+    collection_name = 'calculation_results'
+
+    def _forecast_operation(self, location, results):
+        forecast_id, forecast_doc = encode_forecast(location, results.get('weatherData'))
+        if not forecast_doc:
+            return None, None
+        return forecast_id, UpdateOne(
+            {'_id': forecast_id}, {'$setOnInsert': forecast_doc}, upsert=True
+        )
+
+    def save(self, input_id, location, results):
+        """
+        Store API-shaped results for an input in the compact schema.
+
+        The forecast is written once per location cell and start day; the input
+        is referenced by ID. Returns the stored document.
+        """
+        forecast_id, forecast_op = self._forecast_operation(location, results)
+        if forecast_op:
+            db.forecasts.bulk_write([forecast_op], session=current_session())
+
+        document = encode_result(to_object_id(input_id), location, results, forecast_id)
+        self.collection.insert_one(document, session=current_session())
+        logger.info(f"Calculation results saved to MongoDB with ID: {document['_id']}")
+        self.changed()
+        return document
+
+    def save_many(self, items, write_concern=None):
+        """
+        Store many (input_id, location, results) tuples with two bulk writes.
+        """
+        forecast_ops = {}
+        documents = []
+        for input_id, location, results in items:
+            forecast_id, forecast_op = self._forecast_operation(location, results)
+            if forecast_op:
+                forecast_ops[forecast_id] = forecast_op
+            documents.append(encode_result(to_object_id(input_id), location, results, forecast_id))
+        if forecast_ops:
+            db.forecasts.bulk_write(list(forecast_ops.values()), ordered=False)
+        return self.insert_many(documents, write_concern)
+
+    def find_by_input_id(self, input_id):
+        """
+        Find the stored result document for an input ID (compact or legacy).
+        """
+        collection, session = self._reader()
+        if ObjectId.is_valid(str(input_id)):
+            document = collection.find_one({'iid': ObjectId(str(input_id))}, session=session)
+            if document:
+                return document
+        return collection.find_one({'input_data._id': str(input_id)}, session=session)
+
+    def latest(self):
+        """
+        Find the most recent stored result document (compact or legacy).
+        """
+        collection, session = self._reader()
+        document = collection.find_one(
+            {'v': SCHEMA_VERSION},
+            sort=[('ts', DESCENDING)],
+            session=session
+        )
+        if document:
+            return document
+        # Only legacy documents exist (e.g. before the migration has run)
+        return collection.find_one(sort=[('timestamp', DESCENDING)], session=session)
+
+    def hydrate(self, documents):
+        """
+        Translate stored result documents into API-shaped results.
+
+        Referenced inputs and forecasts are fetched with one query each.
+        """
+        documents = list(documents)
+        input_ids = {doc['iid'] for doc in documents if doc.get('iid') is not None}
+        forecast_ids = {doc['fid'] for doc in documents if doc.get('fid')}
+
+        inputs = {}
+        if input_ids:
+            collection, session = self._reader(db.user_inputs)
+            inputs = {doc['_id']: doc for doc in collection.find({'_id': {'$in': list(input_ids)}}, session=session)}
+        forecasts = {}
+        if forecast_ids:
+            collection, session = self._reader(db.forecasts)
+            forecasts = {doc['_id']: doc for doc in collection.find({'_id': {'$in': list(forecast_ids)}}, session=session)}
+
+        return [
+            decode_result(doc, inputs.get(doc.get('iid')), forecasts.get(doc.get('fid')))
+            for doc in documents
+        ]
+
+class HistoryRepository(MongoRepository):
+    collection_name = 'historical_data'
+
+    def save(self, entry):
+        """
+        Save a historical data entry and return it with its `_id`.
+        """
+        entry.setdefault('timestamp', datetime.now().isoformat())
+        derive_fields(entry)
+        self.collection.insert_one(entry, session=current_session())
+        logger.info(f"Historical data saved to MongoDB with ID: {entry['_id']}")
+        self.changed()
+        return entry
+
+    def save_many(self, entries, write_concern=None):
+        timestamp = datetime.now().isoformat()
+        entries = list(entries)
+        for entry in entries:
+            entry.setdefault('timestamp', timestamp)
+            derive_fields(entry)
+        return self.insert_many(entries, write_concern)
+
+    def list(self, limit=None):
+        """
+        Get entries newest first, optionally limited to the most recent `limit`.
+        """
+        collection, session = self._reader()
+        cursor = collection.find(session=session).sort('timestamp', DESCENDING)
+        if limit:
+            cursor = cursor.limit(limit)
+        return list(cursor)
+
+    def between(self, start=None, end=None):
+        """
+        Get entries with timestamps in [start, end), newest first, including
+        archived ones.
+        """
+        return find_with_archive(self.collection_name, start, end)
+
+    def series(self, bucket, start=None, end=None, location=None):
+        """
+        Aggregate entries into time buckets (see history_series.py), oldest first.
+        """
+        collection, session = self._reader()
+        return list(collection.aggregate(series_pipeline(bucket, start, end, location), session=session))
+
+    def search(self, search):
+        """
+        Get one page of entries matching a search (see history_search.py).
+        """
+        query, sort = build_query(search)
+        collection, session = self._reader()
+        return list(collection.find(query, session=session).sort(sort).limit(search['limit']))
+
+class SettingsRepository(MongoRepository):
+    collection_name = 'user_settings'
+
+    # We only need one settings document
+    settings_id = 'default'
+
+    def get(self):
+        """
+        Get the settings document, or None if settings were never saved.
+        """
+        document = self.collection.find_one({'_id': self.settings_id})
+        if document is None:
+            # Settings written by older versions had a generated _id
+            document = self.collection.find_one()
+        return document
+
+    def replace(self, settings_data):
+        """
+        Replace the settings document and return it.
+        """
+        settings_data['last_updated'] = datetime.now().isoformat()
+        settings_data['_id'] = self.settings_id
+        self.collection.replace_one({'_id': self.settings_id}, settings_data, upsert=True)
+        self.changed()
+        return settings_data
+
+    def update(self, settings_data):
+        """
+        Merge fields into the settings document and return the result.
+        """
+        settings_data['last_updated'] = datetime.now().isoformat()
+        document = self.collection.find_one_and_update(
+            {'_id': self.settings_id},
+            {'$set': settings_data},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        self.changed()
+        return document
+
+class SiteSummaryRepository(MongoRepository):
+    collection_name = 'site_summaries'
+
+    def save(self, input_data, results):
+        """
+        Upsert the summary for the input's site unless a newer one is stored.
+        """
+        summary = build_site_summary(input_data, results)
+        summary['iid'] = to_object_id(summary['iid'])
+        try:
+            self.collection.replace_one(
+                {'_id': summary['_id'], 'ts': {'$lte': summary['ts']}},
+                summary,
+                upsert=True,
+                session=current_session()
+            )
+        except DuplicateKeyError:
+            # A newer calculation for this site was stored concurrently
+            return summary
+        self.changed()
+        return summary
+
+    def save_many(self, summaries, write_concern=None):
+        """
+        Replace the summaries of many sites in one unordered bulk write.
+        """
+        operations = [ReplaceOne({'_id': summary['_id']}, summary, upsert=True) for summary in summaries]
+        if operations:
+            self._collection(write_concern).bulk_write(operations, ordered=False)
+            self.changed()
+        return len(operations)
+
+    def portfolio(self, metric='yearlyInflow', top_k=10, roi_buckets=10, location=None):
+        """
+        Aggregate all site summaries into one portfolio report.
+        """
+        pipeline = portfolio_pipeline(metric, top_k, roi_buckets, location)
+        collection, session = self._reader()
+        facets = next(collection.aggregate(pipeline, allowDiskUse=True, session=session))
+        return format_portfolio(facets, metric)
+
+class MaintenanceRepository(MongoRepository):
+    collection_name = 'maintenance_tasks'
+
+    def register_site(self, site, location, install_date=None, last_service_date=None):
+        """
+        Create a site's maintenance tasks, or re-anchor them when the install or
+        last service date is given. `site` is portfolio.site_key of the input,
+        so inputs without a siteId get their own calendar. Returns the site's
+        task documents.
+        """
+        existing = {task['_id']: task for task in self.collection.find({'site': site}, session=current_session())}
+        tasks, changed = merge_tasks(existing, site, location, install_date, last_service_date)
+        operations = [
+            UpdateOne(
+                {'_id': task['_id']},
+                {'$set': {key: value for key, value in task.items() if key != '_id'}},
+                upsert=True
+            )
+            for task in changed
+        ]
+        if operations:
+            self.collection.bulk_write(operations, ordered=False, session=current_session())
+            self.changed()
+        return tasks
+
+    def due(self, before, task_types, after=None, site=None, location=None, limit=100):
+        """
+        Get tasks due before a date, soonest first. `after` is the (due, _id)
+        of the last task of the previous page.
+        """
+        query = {'type': {'$in': list(task_types)}, 'due': {'$lt': before}}
+        if site:
+            query['site'] = site
+        if location:
+            query['location'] = location
+        if after:
+            after_due, after_id = after
+            query['$or'] = [
+                {'due': {'$gt': after_due}},
+                {'due': after_due, '_id': {'$gt': after_id}},
+            ]
+        collection, session = self._reader()
+        cursor = collection.find(query, session=session).sort([('due', ASCENDING), ('_id', ASCENDING)])
+        return list(cursor.limit(limit))
+
+    def stream_due(self, until, task_types):
+        """
+        Cursor over tasks due before `until`, sorted by due date.
+        """
+        collection, session = self._reader()
+        return collection.find(
+            {'type': {'$in': list(task_types)}, 'due': {'$lte': until}},
+            session=session
+        ).sort('due', ASCENDING).batch_size(1000)
+
+    def mark_done(self, task_id, done_date=None):
+        """
+        Record a task as done and move its due date one interval past it.
+        Returns the updated task, or None if it does not exist.
+        """
+        done = to_datetime(done_date or datetime.now())
+        task = self.collection.find_one({'_id': task_id}, {'interval_days': 1}, session=current_session())
+        if task is None:
+            return None
+        document = self.collection.find_one_and_update(
+            {'_id': task_id},
+            {
+                '$set': {'last_done': done, 'due': done + timedelta(days=task['interval_days'])},
+                '$push': {'history': {'$each': [done], '$slice': -20}},
+            },
+            return_document=ReturnDocument.AFTER,
+            session=current_session()
+        )
+        self.changed()
+        return document
+
+class SketchRepository(MongoRepository):
+    collection_name = 'quantile_sketches'
+
+    def add(self, sketch_id, location, month, values):
+        """
+        Append metric values to a (location, month) sketch's pending values in
+        one atomic update. Returns the updated document.
+        """
+        update = {
+            '$push': {f'pending.{metric}': value for metric, value in values.items()},
+            '$inc': {'count': 1, 'rev': 1},
+            '$setOnInsert': {'location': location, 'month': month},
+        }
+        try:
+            document = self.collection.find_one_and_update(
+                {'_id': sketch_id}, update, upsert=True,
+                return_document=ReturnDocument.AFTER, session=current_session()
+            )
+        except DuplicateKeyError:
+            # Created by a concurrent insert; it exists now
+            document = self.collection.find_one_and_update(
+                {'_id': sketch_id}, update,
+                return_document=ReturnDocument.AFTER, session=current_session()
+            )
+        self.changed()
+        return document
+
+    def compact(self, sketch_id, rev, digests):
+        """
+        Replace a sketch's digests and clear its pending values, unless it
+        changed since revision `rev`. Returns True if it was compacted.
+        """
+        result = self.collection.update_one(
+            {'_id': sketch_id, 'rev': rev},
+            {'$set': {'digests': digests, 'pending': {}}, '$inc': {'rev': 1}}
+        )
+        return result.modified_count == 1
+
+    def find(self, location=None, start=None, end=None):
+        """
+        Get the sketches of a location (all by default) for months in [start, end].
+        """
+        query = {}
+        if location:
+            query['location'] = location
+        months = {}
+        if start:
+            months['$gte'] = start
+        if end:
+            months['$lte'] = end
+        if months:
+            query['month'] = months
+        collection, session = self._reader()
+        return list(collection.find(query, session=session))
+
+    def rebuild(self, documents, write_concern=None):
+        """
+        Replace all sketches. The new set is written to a staging collection
+        and swapped in with one rename, so readers never see a partial set.
+        """
+        documents = list(documents)
+        staging = db[f'{self.collection_name}_rebuild'].with_options(
+            write_concern=write_concern or self.collection.write_concern
+        )
+        staging.drop()
+        for keys in SKETCH_INDEXES:
+            staging.create_index(keys)
+        if documents:
+            staging.insert_many(documents, ordered=False)
+        staging.rename(self.collection_name, dropTarget=True)
+        self.changed()
+        return documents
+
+if settings.STORAGE_BACKEND == 'sqlite':
+    from .sqlite_storage import repositories
+    inputs, results, history, user_settings, site_summaries, maintenance, sketches = repositories(
+        settings.SQLITE_STORAGE_PATH, settings.SQLITE_SYNCHRONOUS
+    )
+else:
+    inputs = InputRepository(db)
+    results = ResultRepository(db)
+    history = HistoryRepository(db)
+    user_settings = SettingsRepository(db)
+    site_summaries = SiteSummaryRepository(db)
+    maintenance = MaintenanceRepository(db)
+    sketches = SketchRepository(db)
+
+_BY_COLLECTION = {
+    repository.collection_name: repository
+    for repository in (inputs, results, history, user_settings, site_summaries, maintenance, sketches)
+}
+
+def collection_state(collection_name):
+    """
+    Get (version, document count) of a collection through its repository.
+    """
+    repository = _BY_COLLECTION.get(collection_name)
+    if repository is not None:
+        return repository.state()
+    return get_collection_version(collection_name), db[collection_name].estimated_document_count()
@@ -0,0 +1,220 @@
+"""
+Compact (version 2) document schema for calculation results.
+
+Version 1 documents embed a full copy of the user input and of the weather
+forecast next to the results. Version 2 documents instead:
+
+- reference the input in `user_inputs` by ObjectId (`iid`)
+- reference a shared forecast document in `forecasts` (`fid`), which stores
+  the daily rainfall series once per location cell and start day as a packed
+  little-endian float64 array
+- use short field names, translated back to the API names on read
+
+The functions here are pure; database access lives in `repository.py`.
+"""
+import struct
+from datetime import datetime, timedelta
+from bson.binary import Binary
+
+SCHEMA_VERSION = 2
+
+# API field name -> (stored field name, nested field map)
+# Nested maps apply to dict values and to each dict inside list values.
+RESULT_FIELDS = {
+    'inflow': ('in', {
+        'dailyInflow': 'd',
+        'monthlyInflow': 'm',
+        'yearlyInflow': 'y'
+    }),
+    'leakDetection': ('lk', {
+        'isLeaking': 'l',
+        'difference': 'df',
+        'severity': 'sv'
+    }),
+    'roi': ('r', {
+        'roi': 'r',
+        'savings': 's',
+        'costs': 'c',
+        'paybackPeriod': 'pb'
+    }),
+    'waterUsage': ('wu', {
+        'drinking': 'dr',
+        'cleaning': 'cl',
+        'gardening': 'gd'
+    }),
+    'tankRecommendation': ('tr', {
+        'recommendedSize': 'rs',
+        'monthlyInflow': 'mi',
+        'monthlyConsumption': 'mc'
+    }),
+    'allocationPlan': ('ap', None),
+    'usagePrediction': ('up', {
+        'expectedInflow': 'ei',
+        'expectedOutflow': 'eo',
+        'samples': 'n',
+        'outflowZScore': 'z',
+        'unusualOutflow': 'u'
+    }),
+    'maintenanceSchedule': ('ms', {
+        'type': 't',
+        'date': 'dt',
+        'description': 'ds'
+    }),
+    'error': ('err', None),
+}
+
+# Fields that are not part of the stored data map
+_LIFTED_FIELDS = ('inputs', 'input_id', 'timestamp', 'weatherData')
+
+# Grid size (degrees) used when the location is given as coordinates
+COORDINATE_CELL_SIZE = 0.1
+
+def _translate(value, field_map):
+    """
+    Rename the keys of a dict (or of every dict in a list) using field_map.
+    Unknown keys are kept as-is.
+    """
+    if not field_map:
+        return value
+    if isinstance(value, dict):
+        return {field_map.get(key, key): item for key, item in value.items()}
+    if isinstance(value, list):
+        return [_translate(item, field_map) for item in value]
+    return value
+
+def _invert(field_map):
+    return {short: long for long, short in field_map.items()} if field_map else None
+
+_SHORT_FIELDS = {
+    short: (long, _invert(nested)) for long, (short, nested) in RESULT_FIELDS.items()
+}
+
+def location_cell(location):
+    """
+    Normalise a location string to the key forecasts are shared under.
+
+    City names are case- and whitespace-insensitive; "lat,lon" strings are
+    snapped to a COORDINATE_CELL_SIZE grid.
+    """
+    location = (location or '').strip().lower()
+    parts = location.split(',')
+    if len(parts) == 2:
+        try:
+            lat, lon = (float(part) for part in parts)
+        except ValueError:
+            return location
+        lat = round(lat / COORDINATE_CELL_SIZE) * COORDINATE_CELL_SIZE
+        lon = round(lon / COORDINATE_CELL_SIZE) * COORDINATE_CELL_SIZE
+        return f"{lat:.1f},{lon:.1f}"
+    return location
+
+def pack_series(values):
+    """
+    Pack a sequence of floats into a BSON binary (little-endian float64).
+    """
+    return Binary(struct.pack(f'<{len(values)}d', *values))
+
+def unpack_series(packed):
+    """
+    Unpack a BSON binary produced by pack_series.
+    """
+    data = bytes(packed)
+    return list(struct.unpack(f'<{len(data) // 8}d', data))
+
+def encode_forecast(location, weather_data):
+    """
+    Build the shared forecast document for a weather payload.
+
+    Returns (forecast_id, document), or (None, None) if there is no forecast.
+    """
+    forecast = (weather_data or {}).get('forecast') or []
+    if not forecast:
+        return None, None
+    start = forecast[0]['date']
+    cell = location_cell(location)
+    forecast_id = f"{cell}:{start}"
+    document = {
+        '_id': forecast_id,
+        'cell': cell,
+        'start': start,
+        'r': pack_series([float(day.get('rainfall', 0)) for day in forecast]),
+        'avg': float(weather_data.get('averageRainfall', 0)),
+    }
+    if weather_data.get('note'):
+        document['note'] = weather_data['note']
+    return forecast_id, document
+
+def decode_forecast(document):
+    """
+    Expand a shared forecast document back into the API weatherData shape.
+    """
+    start = datetime.strptime(document['start'], '%Y-%m-%d')
+    rainfall = unpack_series(document['r'])
+    weather_data = {
+        'forecast': [
+            {'date': (start + timedelta(days=i)).strftime('%Y-%m-%d'), 'rainfall': value}
+            for i, value in enumerate(rainfall)
+        ],
+        'averageRainfall': document.get('avg', 0),
+    }
+    if document.get('note'):
+        weather_data['note'] = document['note']
+    return weather_data
+
+def encode_field(name, value):
+    """
+    Translate one API result field to its (stored name, stored value).
+    """
+    short, nested = RESULT_FIELDS.get(name, (name, None))
+    return short, _translate(value, nested)
+
+def encode_result(input_id, location, results, forecast_id=None):
+    """
+    Build a version 2 calculation result document from API-shaped results.
+    """
+    data = dict(
+        encode_field(key, value) for key, value in results.items() if key not in _LIFTED_FIELDS
+    )
+
+    document = {
+        'v': SCHEMA_VERSION,
+        'ts': results.get('timestamp') or datetime.now().isoformat(),
+        'iid': input_id,
+        'loc': location,
+        'd': data,
+    }
+    weather_data = results.get('weatherData') or {}
+    if forecast_id:
+        document['fid'] = forecast_id
+    if 'averageRainfall' in weather_data:
+        # Kept per result because shared forecasts are first-writer-wins
+        document['ar'] = weather_data['averageRainfall']
+    return document
+
+def decode_result(document, input_doc=None, forecast_doc=None):
+    """
+    Translate a stored calculation result back into the API response shape.
+
+    Input overrides applied by a recompute (`ovr`) are merged into the
+    referenced input. Version 1 documents are returned unchanged.
+    """
+    if document.get('v') != SCHEMA_VERSION:
+        return document.get('data', {})
+
+    results = {}
+    if input_doc is not None:
+        input_doc = dict(input_doc)
+        input_doc.update(document.get('ovr') or {})
+        input_doc['_id'] = str(input_doc['_id'])
+        results['inputs'] = input_doc
+    results['timestamp'] = document.get('ts')
+    for short, value in document.get('d', {}).items():
+        long, nested = _SHORT_FIELDS.get(short, (short, None))
+        results[long] = _translate(value, nested)
+    if forecast_doc is not None:
+        results['weatherData'] = decode_forecast(forecast_doc)
+        if 'ar' in document:
+            results['weatherData']['averageRainfall'] = document['ar']
+    if document.get('iid') is not None:
+        results['input_id'] = str(document['iid'])
+    return results
@@ -0,0 +1,292 @@
+"""
+Retention policies and compressed archival tiers for MongoDB collections.
+
+Documents older than a collection's hot window are written to compressed
+JSONL part files partitioned by month
+
+    ARCHIVE_DIR/<collection>/<YYYY-MM>/part-<first id>-<last id>-<unique>.jsonl.zst
+
+and then deleted from MongoDB in batches. Timestamps are ISO strings, so the
+window is applied with plain string comparison (TTL indexes can't be used).
+A document is only deleted if it is unchanged since it was archived, and
+documents still referenced by hot documents of another collection (inputs of
+calculation results, see REFERENCED_BY) are kept until those are archived.
+`find_with_archive` reads hot and archived documents for a time range
+transparently.
+
+zstandard is used when installed, gzip otherwise.
+"""
+import gzip
+import io
+import logging
+import os
+import uuid
+from datetime import datetime, timedelta
+from bson import json_util
+from django.conf import settings
+from pymongo import ASCENDING, DESCENDING, DeleteOne
+from .database import db, bump_collection_version
+from .read_routing import routed
+
+try:
+    import zstandard
+except ImportError:  # zstandard is optional, fall back to gzip
+    zstandard = None
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Timestamp fields per collection, in order of preference.
+# Compact calculation results use `ts`, legacy ones `timestamp`.
+TIMESTAMP_FIELDS = {
+    'user_inputs': ['timestamp'],
+    'calculation_results': ['ts', 'timestamp'],
+    'historical_data': ['timestamp'],
+}
+
+# Collection -> (referencing collection, field) pairs; a referenced document
+# stays hot while a hot document references it (results hydrate inputs by `iid`)
+REFERENCED_BY = {
+    'user_inputs': [('calculation_results', 'iid')],
+}
+
+JSON_OPTIONS = json_util.CANONICAL_JSON_OPTIONS
+
+def _extension():
+    return '.jsonl.zst' if zstandard is not None else '.jsonl.gz'
+
+def _compress(payload):
+    if zstandard is not None:
+        return zstandard.ZstdCompressor(level=settings.ARCHIVE_ZSTD_LEVEL).compress(payload)
+    return gzip.compress(payload, mtime=0)
+
+def _open_part(path):
+    """
+    Open a part file for line-by-line reading, whichever codec wrote it.
+    """
+    raw = open(path, 'rb')
+    if path.endswith('.zst'):
+        if zstandard is None:
+            raw.close()
+            raise RuntimeError(f"zstandard is required to read {path}")
+        return io.TextIOWrapper(zstandard.ZstdDecompressor().stream_reader(raw), encoding='utf-8')
+    return io.TextIOWrapper(gzip.GzipFile(fileobj=raw), encoding='utf-8')
+
+def get_timestamp(collection_name, document):
+    """
+    Get a document's ISO timestamp string, or '' if it has none.
+    """
+    for field in TIMESTAMP_FIELDS.get(collection_name, ['timestamp']):
+        value = document.get(field)
+        if value:
+            return value.isoformat() if isinstance(value, datetime) else str(value)
+    return ''
+
+def timestamp_range_query(collection_name, start=None, end=None):
+    """
+    Build a query matching documents whose timestamp lies in [start, end).
+    """
+    bounds = {}
+    if start:
+        bounds['$gte'] = start
+    if end:
+        bounds['$lt'] = end
+    if not bounds:
+        return {}
+    fields = TIMESTAMP_FIELDS.get(collection_name, ['timestamp'])
+    if len(fields) == 1:
+        return {fields[0]: bounds}
+    return {'$or': [{field: bounds} for field in fields]}
+
+def hot_window_cutoff(collection_name, now=None):
+    """
+    Get the ISO timestamp before which documents are archived, or None if the
+    collection has no retention policy.
+    """
+    days = settings.RETENTION_DAYS.get(collection_name)
+    if not days:
+        return None
+    now = now or datetime.now()
+    return (now - timedelta(days=days)).isoformat()
+
+def _write_part(collection_name, month, documents):
+    """
+    Write one compressed part file atomically and return its path.
+    """
+    directory = os.path.join(settings.ARCHIVE_DIR, collection_name, month)
+    os.makedirs(directory, exist_ok=True)
+    # Unique per write: a later run may archive the same first and last id
+    # again (documents that changed), and must not replace the earlier part
+    name = f"part-{documents[0]['_id']}-{documents[-1]['_id']}-{uuid.uuid4().hex[:12]}{_extension()}"
+    path = os.path.join(directory, name)
+
+    payload = ''.join(
+        json_util.dumps(doc, json_options=JSON_OPTIONS) + '\n' for doc in documents
+    ).encode('utf-8')
+
+    temp_path = path + '.tmp'
+    with open(temp_path, 'wb') as fh:
+        fh.write(_compress(payload))
+        fh.flush()
+        os.fsync(fh.fileno())
+    os.replace(temp_path, path)
+    return path
+
+def _referenced_ids(collection_name, ids):
+    """
+    Get the ids among `ids` that hot documents of other collections reference.
+    """
+    referenced = set()
+    for other, field in REFERENCED_BY.get(collection_name, []):
+        referenced.update(db[other].distinct(field, {field: {'$in': ids}}))
+    return referenced
+
+def _unchanged(document):
+    # Matches the document only while it is exactly as it was archived
+    return {'_id': document['_id'], '$expr': {'$eq': ['$$ROOT', {'$literal': document}]}}
+
+def archive_collection(collection_name, days=None, batch_size=None, dry_run=False):
+    """
+    Archive and delete documents that are older than the hot window.
+
+    Each batch is written to disk (and fsynced) before it is deleted, so an
+    interruption can at worst leave documents in both tiers; the read path
+    de-duplicates them. Documents updated in between (e.g. by a recompute
+    job) are not deleted and are archived again by a later run; the newest
+    part file wins when reading. Returns the number of archived documents.
+    """
+    batch_size = batch_size or settings.RETENTION_BATCH_SIZE
+    if days is not None:
+        cutoff = (datetime.now() - timedelta(days=days)).isoformat()
+    else:
+        cutoff = hot_window_cutoff(collection_name)
+    if cutoff is None:
+        logger.info(f"No retention policy for {collection_name}, skipping")
+        return 0
+
+    query = timestamp_range_query(collection_name, end=cutoff)
+    collection = db[collection_name]
+    if dry_run:
+        return collection.count_documents(query)
+
+    archived = changed = kept = 0
+    last_id = None
+    while True:
+        batch_query = query if last_id is None else {'$and': [query, {'_id': {'$gt': last_id}}]}
+        batch = list(collection.find(batch_query).sort('_id', ASCENDING).limit(batch_size))
+        if not batch:
+            break
+        last_id = batch[-1]['_id']
+
+        referenced = _referenced_ids(collection_name, [doc['_id'] for doc in batch])
+        if referenced:
+            kept += len(referenced)
+            batch = [doc for doc in batch if doc['_id'] not in referenced]
+            if not batch:
+                continue
+
+        by_month = {}
+        for doc in batch:
+            month = get_timestamp(collection_name, doc)[:7] or 'unknown'
+            by_month.setdefault(month, []).append(doc)
+        for month, documents in by_month.items():
+            _write_part(collection_name, month, documents)
+
+        result = collection.bulk_write([DeleteOne(_unchanged(doc)) for doc in batch], ordered=False)
+        archived += result.deleted_count
+        changed += len(batch) - result.deleted_count
+        logger.info(f"Archived {archived} documents from {collection_name}")
+
+    if changed:
+        logger.info(f"{changed} documents of {collection_name} changed while archiving and stay hot")
+    if kept:
+        logger.info(f"{kept} documents of {collection_name} are still referenced and stay hot")
+
+    if archived:
+        bump_collection_version(collection_name)
+    return archived
+
+def apply_retention(dry_run=False):
+    """
+    Apply the configured retention policy to every collection.
+    """
+    return {
+        name: archive_collection(name, dry_run=dry_run)
+        for name in settings.RETENTION_DAYS
+    }
+
+def _matches(document, query):
+    """
+    Evaluate a simple equality filter against an archived document.
+    """
+    for key, expected in (query or {}).items():
+        value = document
+        for part in key.split('.'):
+            value = value.get(part) if isinstance(value, dict) else None
+        if value != expected:
+            return False
+    return True
+
+def iter_archived(collection_name, start=None, end=None, query=None):
+    """
+    Yield archived documents with a timestamp in [start, end).
+
+    Only month partitions overlapping the range are opened, newest part file
+    first, so the latest archived version of a document comes first. `query`
+    is a flat equality filter (dotted keys allowed), e.g. {'location': 'Chennai'}.
+    """
+    base = os.path.join(settings.ARCHIVE_DIR, collection_name)
+    if not os.path.isdir(base):
+        return
+
+    for month in sorted(os.listdir(base)):
+        if month != 'unknown':
+            if start and month < start[:7]:
+                continue
+            if end and month > end[:7]:
+                continue
+        directory = os.path.join(base, month)
+        names = [name for name in os.listdir(directory) if not name.endswith('.tmp')]
+        names.sort(key=lambda name: os.path.getmtime(os.path.join(directory, name)), reverse=True)
+        for name in names:
+            with _open_part(os.path.join(directory, name)) as fh:
+                for line in fh:
+                    document = json_util.loads(line, json_options=JSON_OPTIONS)
+                    timestamp = get_timestamp(collection_name, document)
+                    if start and timestamp < start:
+                        continue
+                    if end and timestamp >= end:
+                        continue
+                    if _matches(document, query):
+                        yield document
+
+def find_with_archive(collection_name, start=None, end=None, query=None, limit=None):
+    """
+    Query a time range across the hot collection and the archive.
+
+    The archive is only read when the range starts before the hot window.
+    Results are sorted newest first.
+    """
+    mongo_query = dict(query or {})
+    range_query = timestamp_range_query(collection_name, start, end)
+    if range_query:
+        mongo_query = {'$and': [mongo_query, range_query]} if mongo_query else range_query
+
+    collection, session = routed(db[collection_name])
+    cursor = collection.find(mongo_query, session=session)
+    timestamp_field = TIMESTAMP_FIELDS.get(collection_name, ['timestamp'])[0]
+    cursor = cursor.sort(timestamp_field, DESCENDING)
+    documents = list(cursor.limit(limit) if limit else cursor)
+
+    cutoff = hot_window_cutoff(collection_name)
+    if cutoff is not None and (start is None or start < cutoff):
+        seen = {doc['_id'] for doc in documents}
+        for document in iter_archived(collection_name, start, end, query):
+            if document['_id'] not in seen:
+                seen.add(document['_id'])
+                documents.append(document)
+        documents.sort(key=lambda doc: get_timestamp(collection_name, doc), reverse=True)
+        if limit:
+            documents = documents[:limit]
+
+    return documents
@@ -1,6 +1,7 @@
 """
 Serializers for the rainwater harvester API.
 """
+import math
 from rest_framework import serializers
 
 class InputSerializer(serializers.Serializer):
@@ -15,6 +16,9 @@ class InputSerializer(serializers.Serializer):
     waterCostPerLiter = serializers.FloatField(required=False, default=0.002)
     setupCost = serializers.FloatField(required=False, default=5000)
     maintenanceCost = serializers.FloatField(required=False, default=500)
+    siteId = serializers.CharField(required=False)
+    installDate = serializers.DateField(required=False)
+    lastServiceDate = serializers.DateField(required=False)
 
 class SettingsSerializer(serializers.Serializer):
     """
@@ -23,6 +27,28 @@ class SettingsSerializer(serializers.Serializer):
     data = serializers.JSONField()
     alertForCleaning = serializers.BooleanField(required=False, default=True)
 
+    # Settings used as calculation inputs, stored as numbers
+    NUMERIC_FIELDS = ('waterCostPerLiter', 'setupCost', 'maintenanceCost')
+
+    def validate_data(self, value):
+        """
+        Check the settings are an object and coerce the numeric ones.
+        """
+        if not isinstance(value, dict):
+            raise serializers.ValidationError('Expected an object of settings.')
+        value = dict(value)
+        for field in self.NUMERIC_FIELDS:
+            if field not in value:
+                continue
+            try:
+                number = float(value[field])
+            except (TypeError, ValueError):
+                raise serializers.ValidationError({field: 'Expected a number.'})
+            if not math.isfinite(number) or number < 0:
+                raise serializers.ValidationError({field: 'Expected a non-negative number.'})
+            value[field] = number
+        return value
+
 class ResultIdSerializer(serializers.Serializer):
     """
     Serializer for result ID.
@@ -34,3 +60,84 @@ class ResultIdSerializer(serializers.Serializer):
     Serializer for result ID.
     """
     id = serializers.CharField(required=True)
+
+class ScenarioAxisField(serializers.Field):
+    """
+    A sweep axis: a single number, a list of numbers, or {"min", "max", "steps"}.
+    Always deserializes to a list of floats.
+    """
+    default_error_messages = {
+        'invalid': 'Expected a number, a list of numbers, or {"min", "max", "steps"}.',
+        'too_many': 'An axis can have at most {max_steps} values.',
+    }
+
+    def __init__(self, max_steps=200, **kwargs):
+        self.max_steps = max_steps
+        super().__init__(**kwargs)
+
+    def to_internal_value(self, data):
+        try:
+            if isinstance(data, dict):
+                start = float(data['min'])
+                stop = float(data['max'])
+                steps = int(data.get('steps', 10))
+                if steps < 1:
+                    self.fail('invalid')
+                if steps == 1:
+                    values = [start]
+                else:
+                    values = [start + (stop - start) * i / (steps - 1) for i in range(steps)]
+            elif isinstance(data, (list, tuple)):
+                values = [float(value) for value in data]
+            else:
+                values = [float(data)]
+        except (KeyError, TypeError, ValueError):
+            self.fail('invalid')
+        if not values:
+            self.fail('invalid')
+        if len(values) > self.max_steps:
+            self.fail('too_many', max_steps=self.max_steps)
+        return values
+
+    def to_representation(self, value):
+        return value
+
+class ScenarioSweepSerializer(serializers.Serializer):
+    """
+    Serializer for a what-if scenario sweep request.
+    """
+    location = serializers.CharField(required=True)
+    outflow = serializers.FloatField(required=True)
+    roofArea = ScenarioAxisField(required=True)
+    tankCapacity = ScenarioAxisField(required=True)
+    waterCostPerLiter = ScenarioAxisField(required=False, default=[0.002])
+    setupCost = ScenarioAxisField(required=False, default=[5000])
+    maintenanceCost = ScenarioAxisField(required=False, default=[500])
+
+class MonteCarloSerializer(serializers.Serializer):
+    """
+    Serializer for a Monte Carlo tank simulation job.
+    """
+    location = serializers.CharField(required=True)
+    roofArea = serializers.FloatField(required=True, min_value=0)
+    tankCapacity = serializers.FloatField(required=True, min_value=0)
+    outflow = serializers.FloatField(required=True, min_value=0)
+    days = serializers.IntegerField(required=False, default=365, min_value=1, max_value=3650)
+    runs = serializers.IntegerField(required=False, default=1000, min_value=1, max_value=100000)
+    seed = serializers.IntegerField(required=False, default=None, allow_null=True)
+
+class AllocationSiteSerializer(serializers.Serializer):
+    """
+    Serializer for one site of a water allocation plan request.
+    """
+    location = serializers.CharField(required=True)
+    roofArea = serializers.FloatField(required=True, min_value=0)
+    tankCapacity = serializers.FloatField(required=True, min_value=0)
+    outflow = serializers.FloatField(required=True, min_value=0)
+    currentLevel = serializers.FloatField(required=False, min_value=0)
+
+class AllocationSerializer(serializers.Serializer):
+    """
+    Serializer for a batch water allocation plan request.
+    """
+    sites = AllocationSiteSerializer(many=True, allow_empty=False, max_length=1000)
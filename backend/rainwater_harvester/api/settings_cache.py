@@ -0,0 +1,107 @@
+"""
+In-process cache of the user settings document.
+
+Settings are read on every calculation but change rarely, so each process
+keeps a copy in memory. A background thread keeps it fresh: it follows a
+MongoDB change stream on `user_settings` and re-reads the document whenever it
+changes. Change streams need a replica set; on a standalone server (or while a
+stream is failing) the thread polls instead, every
+SETTINGS_CACHE_POLL_INTERVAL seconds. Either way a change made by any worker
+is visible everywhere within that bound, and requests never query MongoDB for
+settings after the first load.
+"""
+import copy
+import logging
+import sqlite3
+import threading
+import time
+from django.conf import settings
+from pymongo.errors import PyMongoError
+from . import repository
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Errors of either storage backend that the watcher survives
+STORE_ERRORS = (PyMongoError, sqlite3.Error)
+
+class SettingsCache:
+    """
+    Holds the settings document and keeps it up to date in the background.
+    """
+    def __init__(self, settings_repository, poll_interval):
+        self.repository = settings_repository
+        self.poll_interval = poll_interval
+        self.mode = 'idle'
+        self._document = None
+        self._loaded = False
+        self._lock = threading.Lock()
+        self._watcher = None
+
+    def get(self):
+        """
+        Get a copy of the cached settings document (None if never saved).
+        """
+        if not self._loaded:
+            self.refresh()
+            self._start_watcher()
+        with self._lock:
+            return copy.deepcopy(self._document)
+
+    def set(self, document):
+        """
+        Update the local copy after this process wrote new settings.
+        """
+        with self._lock:
+            self._document = copy.deepcopy(document)
+            self._loaded = True
+        # A process whose first settings call is a write must still follow other writers
+        self._start_watcher()
+
+    def refresh(self):
+        """
+        Re-read the settings document from the store.
+        """
+        try:
+            document = self.repository.get()
+        except STORE_ERRORS as e:
+            logger.error(f"Error refreshing settings cache: {str(e)}")
+            return
+        self.set(document)
+
+    def _start_watcher(self):
+        with self._lock:
+            if self._watcher is not None:
+                return
+            self._watcher = threading.Thread(
+                target=self._run, name='settings-cache-watcher', daemon=True
+            )
+        self._watcher.start()
+
+    def _run(self):
+        while True:
+            try:
+                self._follow_change_stream()
+            except (*STORE_ERRORS, NotImplementedError) as e:
+                if self.mode != 'polling':
+                    logger.warning(f"Settings change stream unavailable, polling instead: {str(e)}")
+                self.mode = 'polling'
+            # Poll once per interval until the change stream can be (re)opened
+            time.sleep(self.poll_interval)
+            try:
+                self.refresh()
+            except Exception as e:
+                # Never let the watcher die; the next poll tries again
+                logger.error(f"Unexpected error polling settings: {str(e)}", exc_info=True)
+
+    def _follow_change_stream(self):
+        with self.repository.watch(max_await_time_ms=1000) as stream:
+            self.mode = 'change_stream'
+            # Catch changes made between the last read and opening the stream
+            self.refresh()
+            while stream.alive:
+                change = stream.try_next()
+                if change is not None:
+                    self.refresh()
+
+settings_cache = SettingsCache(repository.user_settings, settings.SETTINGS_CACHE_POLL_INTERVAL)
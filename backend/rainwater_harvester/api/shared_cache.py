@@ -0,0 +1,81 @@
+"""
+Node-wide cache shared by all worker processes.
+
+Uses the Django cache named 'shared' (settings.CACHES), which is a diskcache
+DjangoCache when diskcache is installed: an on-disk SQLite-backed store in
+SHARED_CACHE_DIR with least-recently-used eviction above
+SHARED_CACHE_SIZE_LIMIT bytes, per-key TTLs and hit/miss statistics. Every
+gunicorn worker on the node reads and writes the same store, so a value is
+fetched once per node rather than once per worker. Without diskcache it falls
+back to Django's file-based cache, which is shared too but has no statistics.
+
+Values are pickled, so anything picklable (e.g. a Forecast) can be cached.
+Cache errors never fail a request: the value is just computed again.
+"""
+import logging
+import threading
+from django.core.cache import caches
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Namespace -> counters of this process
+_counts = {}
+_counts_lock = threading.Lock()
+
+# Marks a miss (None is a valid cached value)
+_MISSING = object()
+
+def _cache():
+    # Looked up per call: weather_service is also loaded in job workers before django.setup()
+    return caches['shared']
+
+def _count(namespace, outcome):
+    with _counts_lock:
+        counts = _counts.setdefault(namespace, {'hits': 0, 'misses': 0, 'errors': 0})
+        counts[outcome] += 1
+
+def get_or_set(namespace, key, compute, timeout, cacheable=None):
+    """
+    Get `namespace:key` from the shared cache, or compute, store and return it.
+
+    `cacheable(value)` can reject values that must not be stored (e.g.
+    fallback data); `timeout` is in seconds.
+    """
+    cache_key = f"{namespace}:{key}"
+    try:
+        value = _cache().get(cache_key, _MISSING)
+    except Exception as e:
+        logger.warning(f"Shared cache read failed for {cache_key}: {str(e)}")
+        _count(namespace, 'errors')
+        value = _MISSING
+    if value is not _MISSING:
+        _count(namespace, 'hits')
+        return value
+
+    _count(namespace, 'misses')
+    value = compute()
+    if cacheable is None or cacheable(value):
+        try:
+            _cache().set(cache_key, value, timeout)
+        except Exception as e:
+            logger.warning(f"Shared cache write failed for {cache_key}: {str(e)}")
+            _count(namespace, 'errors')
+    return value
+
+def stats():
+    """
+    Get this process's counters per namespace, plus the store's own
+    node-wide statistics when the backend keeps them.
+    """
+    cache = _cache()
+    with _counts_lock:
+        report = {'namespaces': {namespace: dict(counts) for namespace, counts in _counts.items()}}
+    report['backend'] = f"{type(cache).__module__}.{type(cache).__name__}"
+    try:
+        if hasattr(cache, 'stats'):
+            hits, misses = cache.stats()
+            report['node'] = {'hits': hits, 'misses': misses, 'volumeBytes': cache.volume()}
+    except Exception as e:
+        logger.warning(f"Could not read shared cache statistics: {str(e)}")
+    return report
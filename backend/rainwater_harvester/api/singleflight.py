@@ -0,0 +1,210 @@
+"""
+Single-flight coalescing of identical concurrent work.
+
+When many requests need the same thing at once (e.g. the forecast for one city
+right after it expired everywhere), only one of them does the work and the
+others wait for its result.
+
+- Within a process, callers of `SingleFlight.do` with the same key share one
+  in-flight call.
+- Across processes, a lease document in `singleflight_leases` makes one
+  process the leader for a key. The leader stores the result on the lease for
+  SINGLEFLIGHT_RESULT_SECONDS; other processes wait for it instead of calling
+  upstream themselves. A lease whose leader died expires after
+  SINGLEFLIGHT_LEASE_SECONDS, and if MongoDB is unavailable callers just do
+  the work themselves.
+
+Results handed to callers other than the one that computed them are deep
+copies, so callers may modify what they get. Groups whose results aren't
+BSON-serializable pass a `codec` of (encode, decode) functions used for the
+copy stored on the lease.
+"""
+import copy
+import logging
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from django.conf import settings
+from pymongo.errors import DuplicateKeyError, PyMongoError
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Seconds between checks while waiting for another process's result
+REMOTE_POLL_INTERVAL = 0.05
+
+class _Call:
+    __slots__ = ('done', 'result', 'error', 'waiters')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+def _lease_collection():
+    # Imported lazily: this module is also loaded in job workers before django.setup()
+    from .database import db
+    return db.singleflight_leases
+
+class SingleFlight:
+    """
+    A named group of coalesced calls with its own counters.
+    """
+    def __init__(self, name, cross_process=False, codec=None):
+        self.name = name
+        self.cross_process = cross_process
+        self.encode, self.decode = codec or (None, None)
+        self.owner = f"{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.stats = {
+            'calls': 0,
+            'executions': 0,
+            'coalesced': 0,
+            'remote_hits': 0,
+            'lease_timeouts': 0,
+        }
+
+    def do(self, key, fn):
+        """
+        Return fn()'s result, sharing one execution among concurrent callers
+        with the same key.
+        """
+        with self._lock:
+            self.stats['calls'] += 1
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                call.waiters += 1
+                self.stats['coalesced'] += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return copy.deepcopy(call.result)
+
+        result = None
+        try:
+            result = self._run(key, fn)
+            return result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+                waiters = call.waiters
+            # Waiters copy a snapshot taken before the leader's caller can modify the result
+            try:
+                if waiters and call.error is None:
+                    call.result = copy.deepcopy(result)
+            finally:
+                call.done.set()
+
+    def _run(self, key, fn):
+        if not self.cross_process or not settings.SINGLEFLIGHT_CROSS_PROCESS:
+            return self._execute(fn)
+
+        lease_id = f"{self.name}:{key}"
+        try:
+            leader = self._acquire(lease_id)
+        except PyMongoError as e:
+            logger.warning(f"Single-flight lease unavailable for {lease_id}: {str(e)}")
+            return self._execute(fn)
+
+        if not leader:
+            found, result = self._wait_for_remote(lease_id)
+            if found:
+                self.stats['remote_hits'] += 1
+                return self.decode(result) if self.decode else result
+            self.stats['lease_timeouts'] += 1
+            return self._execute(fn)
+
+        try:
+            result = self._execute(fn)
+        except Exception:
+            self._release(lease_id)
+            raise
+        self._publish(lease_id, result)
+        return result
+
+    def _execute(self, fn):
+        self.stats['executions'] += 1
+        return fn()
+
+    def _acquire(self, lease_id):
+        """
+        Try to become the leader for a key. Returns False if another process
+        holds an unexpired lease (or a fresh result) for it.
+        """
+        now = datetime.utcnow()
+        try:
+            _lease_collection().update_one(
+                {'_id': lease_id, 'expires': {'$lt': now}},
+                {
+                    '$set': {
+                        'owner': self.owner,
+                        'expires': now + timedelta(seconds=settings.SINGLEFLIGHT_LEASE_SECONDS),
+                    },
+                    '$unset': {'result': ''},
+                },
+                upsert=True
+            )
+            return True
+        except DuplicateKeyError:
+            return False
+
+    def _wait_for_remote(self, lease_id):
+        """
+        Wait for the leader's result. Returns (found, result).
+        """
+        deadline = time.monotonic() + settings.SINGLEFLIGHT_LEASE_SECONDS
+        while time.monotonic() < deadline:
+            try:
+                lease = _lease_collection().find_one({'_id': lease_id})
+            except PyMongoError:
+                return False, None
+            if lease is None or lease['expires'] < datetime.utcnow():
+                return False, None
+            if 'result' in lease:
+                return True, lease['result']
+            time.sleep(REMOTE_POLL_INTERVAL)
+        return False, None
+
+    def _publish(self, lease_id, result):
+        try:
+            _lease_collection().update_one(
+                {'_id': lease_id, 'owner': self.owner},
+                {'$set': {
+                    'result': self.encode(result) if self.encode else result,
+                    'expires': datetime.utcnow() + timedelta(seconds=settings.SINGLEFLIGHT_RESULT_SECONDS),
+                }}
+            )
+        except PyMongoError as e:
+            logger.warning(f"Could not publish single-flight result for {lease_id}: {str(e)}")
+
+    def _release(self, lease_id):
+        try:
+            _lease_collection().delete_one({'_id': lease_id, 'owner': self.owner})
+        except PyMongoError:
+            pass
+
+# Every group, for the metrics endpoint
+FLIGHTS = {}
+
+def flight(name, cross_process=False, codec=None):
+    """
+    Get (or create) the single-flight group with this name.
+    """
+    if name not in FLIGHTS:
+        FLIGHTS[name] = SingleFlight(name, cross_process, codec)
+    return FLIGHTS[name]
+
+def stats():
+    return {name: dict(group.stats) for name, group in FLIGHTS.items()}
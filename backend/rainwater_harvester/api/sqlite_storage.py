@@ -0,0 +1,530 @@
+"""
+Embedded SQLite storage backend for single-node deployments.
+
+Implements the same repository interface as `repository.py` (selected with
+STORAGE_BACKEND = 'sqlite'), so the views work unchanged without a MongoDB
+server. Every collection is a table holding each document as BSON next to the
+few columns it is queried by (ID, timestamp, location, ...), which are
+indexed. The database runs in WAL mode, so readers never block the writer
+and a write is a local fsync-free append (synchronous=NORMAL by default).
+
+Each thread has its own connection. Collection versions (for ETags) live in
+a `collection_versions` table, as they do in MongoDB.
+
+Only the repositories are covered: background jobs, recompute, retention,
+export, bulk data generation and the prediction models still need MongoDB.
+"""
+import logging
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+import bson
+from bson.objectid import ObjectId
+from .result_schema import encode_forecast, encode_result, decode_result
+from .portfolio import build_site_summary, portfolio_facets, format_portfolio
+from .maintenance import merge_tasks, to_datetime
+from .history_series import aggregate_entries
+from .history_search import derive_fields, search_entries
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+def _object_id(value):
+    if isinstance(value, str) and ObjectId.is_valid(value):
+        return ObjectId(value)
+    return value
+
+def _key(value):
+    """
+    Convert a document ID (ObjectId or string) to the text primary key.
+    """
+    return str(value)
+
+def _iso(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+class SQLiteStore:
+    """
+    A SQLite database file with one connection per thread.
+    """
+    def __init__(self, path, synchronous='NORMAL'):
+        self.path = path
+        self.synchronous = synchronous
+        self._local = threading.local()
+        self._schema = []
+        self._lock = threading.Lock()
+
+    def connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            # Autocommit; multi-statement writes use transaction()
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute(f'PRAGMA synchronous={self.synchronous}')
+            with self._lock:
+                for statement in self._schema:
+                    connection.execute(statement)
+            self._local.connection = connection
+        return connection
+
+    def execute(self, sql, params=()):
+        return self.connection().execute(sql, params)
+
+    @contextmanager
+    def transaction(self):
+        connection = self.connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            yield connection
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+
+    def add_schema(self, statements):
+        """
+        Register CREATE statements, run on every new connection (they are
+        IF NOT EXISTS, so only the first one does any work).
+        """
+        with self._lock:
+            self._schema.extend(statements)
+
+    def bump_version(self, name):
+        self.execute(
+            'INSERT INTO collection_versions (name, version) VALUES (?, 1) '
+            'ON CONFLICT(name) DO UPDATE SET version = version + 1',
+            (name,)
+        )
+
+    def get_version(self, name):
+        row = self.execute('SELECT version FROM collection_versions WHERE name = ?', (name,)).fetchone()
+        return row[0] if row else 0
+
+class SQLiteRepository:
+    """
+    Base class for a repository backed by one table.
+
+    `columns` maps each indexed column to a function extracting its value
+    from a document; `indexes` lists the column tuples to index.
+    """
+    collection_name = None
+    columns = {}
+    indexes = ()
+
+    def __init__(self, store):
+        self.store = store
+        column_sql = ''.join(f', {name}' for name in self.columns)
+        statements = [
+            'CREATE TABLE IF NOT EXISTS collection_versions (name TEXT PRIMARY KEY, version INTEGER NOT NULL)',
+            f'CREATE TABLE IF NOT EXISTS {self.collection_name} (id TEXT PRIMARY KEY{column_sql}, doc BLOB NOT NULL)',
+        ]
+        for index in self.indexes:
+            statements.append(
+                f"CREATE INDEX IF NOT EXISTS {self.collection_name}_{'_'.join(index)} "
+                f"ON {self.collection_name} ({', '.join(index)})"
+            )
+        store.add_schema(statements)
+
+    def _row(self, document):
+        return (
+            _key(document['_id']),
+            *(extract(document) for extract in self.columns.values()),
+            bson.encode(document),
+        )
+
+    def _write(self, documents, connection=None, replace=True):
+        verb = 'INSERT OR REPLACE' if replace else 'INSERT'
+        placeholders = ', '.join('?' * (len(self.columns) + 2))
+        (connection or self.store.connection()).executemany(
+            f"{verb} INTO {self.collection_name} (id{''.join(f', {name}' for name in self.columns)}, doc) "
+            f"VALUES ({placeholders})",
+            [self._row(document) for document in documents]
+        )
+
+    def _find(self, where='', params=(), order='', limit=None):
+        sql = f'SELECT doc FROM {self.collection_name}'
+        if where:
+            sql += f' WHERE {where}'
+        if order:
+            sql += f' ORDER BY {order}'
+        if limit:
+            sql += f' LIMIT {int(limit)}'
+        return [bson.decode(row[0]) for row in self.store.execute(sql, params)]
+
+    def _find_one(self, where='', params=(), order=''):
+        documents = self._find(where, params, order, 1)
+        return documents[0] if documents else None
+
+    def _by_ids(self, ids):
+        ids = [_key(value) for value in ids]
+        if not ids:
+            return []
+        return self._find(f"id IN ({', '.join('?' * len(ids))})", ids)
+
+    def version(self):
+        return self.store.get_version(self.collection_name)
+
+    def changed(self):
+        self.store.bump_version(self.collection_name)
+
+    def state(self):
+        """
+        Get (version, document count) for building ETags.
+        """
+        count = self.store.execute(f'SELECT COUNT(*) FROM {self.collection_name}').fetchone()[0]
+        return self.version(), count
+
+    def watch(self, **kwargs):
+        raise NotImplementedError('SQLite storage has no change streams')
+
+    def insert_many(self, documents, write_concern=None):
+        documents = list(documents)
+        for document in documents:
+            document.setdefault('_id', ObjectId())
+        if documents:
+            with self.store.transaction() as connection:
+                self._write(documents, connection, replace=False)
+            self.changed()
+        return documents
+
+    def delete(self, document_id):
+        cursor = self.store.execute(f'DELETE FROM {self.collection_name} WHERE id = ?', (_key(document_id),))
+        if cursor.rowcount > 0:
+            self.changed()
+            return True
+        return False
+
+class InputRepository(SQLiteRepository):
+    collection_name = 'user_inputs'
+    columns = {'ts': lambda doc: doc.get('timestamp')}
+    indexes = (('ts',),)
+
+    def save(self, input_data):
+        input_data.setdefault('timestamp', datetime.now().isoformat())
+        input_data.setdefault('_id', ObjectId())
+        self._write([input_data], replace=False)
+        logger.info(f"Input data saved to SQLite with ID: {input_data['_id']}")
+        self.changed()
+        return input_data
+
+    def get(self, input_id):
+        return self._find_one('id = ?', (_key(input_id),))
+
+    def latest(self):
+        return self._find_one(order='ts DESC')
+
+class ForecastRepository(SQLiteRepository):
+    collection_name = 'forecasts'
+
+class ResultRepository(SQLiteRepository):
+    collection_name = 'calculation_results'
+    columns = {
+        'iid': lambda doc: _key(doc['iid']) if doc.get('iid') is not None else None,
+        'ts': lambda doc: doc.get('ts'),
+        'location': lambda doc: doc.get('loc'),
+    }
+    indexes = (('iid',), ('ts',), ('location', 'ts'))
+
+    def __init__(self, store, inputs):
+        super().__init__(store)
+        self.inputs = inputs
+        self.forecasts = ForecastRepository(store)
+
+    def _documents(self, items):
+        forecasts = {}
+        documents = []
+        for input_id, location, results in items:
+            forecast_id, forecast_doc = encode_forecast(location, results.get('weatherData'))
+            if forecast_doc:
+                # The first forecast stored for a cell and start day wins, as in MongoDB
+                forecasts[forecast_id] = dict(forecast_doc, _id=forecast_id)
+            document = encode_result(_object_id(input_id), location, results, forecast_id if forecast_doc else None)
+            document['_id'] = ObjectId()
+            documents.append(document)
+        return list(forecasts.values()), documents
+
+    def save(self, input_id, location, results):
+        return self.save_many([(input_id, location, results)])[0]
+
+    def save_many(self, items, write_concern=None):
+        forecasts, documents = self._documents(items)
+        if documents:
+            with self.store.transaction() as connection:
+                connection.executemany(
+                    'INSERT OR IGNORE INTO forecasts (id, doc) VALUES (?, ?)',
+                    [(_key(doc['_id']), bson.encode(doc)) for doc in forecasts]
+                )
+                self._write(documents, connection, replace=False)
+            self.changed()
+        return documents
+
+    def find_by_input_id(self, input_id):
+        return self._find_one('iid = ?', (_key(input_id),))
+
+    def latest(self):
+        return self._find_one(order='ts DESC')
+
+    def hydrate(self, documents):
+        documents = list(documents)
+        inputs = {
+            doc['_id']: doc
+            for doc in self.inputs._by_ids({doc['iid'] for doc in documents if doc.get('iid') is not None})
+        }
+        forecasts = {
+            doc['_id']: doc
+            for doc in self.forecasts._by_ids({doc['fid'] for doc in documents if doc.get('fid')})
+        }
+        return [
+            decode_result(doc, inputs.get(doc.get('iid')), forecasts.get(doc.get('fid')))
+            for doc in documents
+        ]
+
+class HistoryRepository(SQLiteRepository):
+    collection_name = 'historical_data'
+    columns = {
+        'ts': lambda doc: doc.get('timestamp'),
+        'location': lambda doc: doc.get('location'),
+    }
+    indexes = (('ts',), ('location', 'ts'))
+
+    def save(self, entry):
+        entry.setdefault('timestamp', datetime.now().isoformat())
+        entry.setdefault('_id', ObjectId())
+        derive_fields(entry)
+        self._write([entry], replace=False)
+        logger.info(f"Historical data saved to SQLite with ID: {entry['_id']}")
+        self.changed()
+        return entry
+
+    def save_many(self, entries, write_concern=None):
+        timestamp = datetime.now().isoformat()
+        entries = list(entries)
+        for entry in entries:
+            entry.setdefault('timestamp', timestamp)
+            derive_fields(entry)
+        return self.insert_many(entries, write_concern)
+
+    def list(self, limit=None):
+        return self._find(order='ts DESC', limit=limit)
+
+    def search(self, search):
+        # Narrow by the indexed columns, then filter, sort and page in Python
+        conditions, params = [], []
+        if 'location' in search['equals']:
+            conditions.append('location = ?')
+            params.append(search['equals']['location'])
+        operators = {'gt': '>', 'gte': '>=', 'lt': '<', 'lte': '<='}
+        for op, bound in search['ranges'].get('timestamp', {}).items():
+            conditions.append(f'ts {operators[op]} ?')
+            params.append(bound)
+        return search_entries(self._find(' AND '.join(conditions), params), search)
+
+    def between(self, start=None, end=None, location=None):
+        conditions, params = [], []
+        if location:
+            conditions.append('location = ?')
+            params.append(location)
+        if start:
+            conditions.append('ts >= ?')
+            params.append(start)
+        if end:
+            conditions.append('ts < ?')
+            params.append(end)
+        return self._find(' AND '.join(conditions), params, order='ts DESC')
+
+    def series(self, bucket, start=None, end=None, location=None):
+        return aggregate_entries(self.between(start, end, location), bucket)
+
+class SettingsRepository(SQLiteRepository):
+    collection_name = 'user_settings'
+
+    settings_id = 'default'
+
+    def get(self):
+        return self._find_one('id = ?', (self.settings_id,))
+
+    def replace(self, settings_data):
+        settings_data['last_updated'] = datetime.now().isoformat()
+        settings_data['_id'] = self.settings_id
+        self._write([settings_data])
+        self.changed()
+        return settings_data
+
+    def update(self, settings_data):
+        settings_data['last_updated'] = datetime.now().isoformat()
+        with self.store.transaction() as connection:
+            row = connection.execute('SELECT doc FROM user_settings WHERE id = ?', (self.settings_id,)).fetchone()
+            document = bson.decode(row[0]) if row else {'_id': self.settings_id}
+            document.update(settings_data)
+            self._write([document], connection)
+        self.changed()
+        return document
+
+class SiteSummaryRepository(SQLiteRepository):
+    collection_name = 'site_summaries'
+    columns = {
+        'location': lambda doc: doc.get('location'),
+        'ts': lambda doc: doc.get('ts'),
+    }
+    indexes = (('location',),)
+
+    def save(self, input_data, results):
+        """
+        Upsert the summary for the input's site unless a newer one is stored.
+        """
+        summary = build_site_summary(input_data, results)
+        summary['iid'] = _object_id(summary['iid'])
+        cursor = self.store.execute(
+            'INSERT INTO site_summaries (id, location, ts, doc) VALUES (?, ?, ?, ?) '
+            'ON CONFLICT(id) DO UPDATE SET location = excluded.location, ts = excluded.ts, doc = excluded.doc '
+            'WHERE site_summaries.ts IS NULL OR site_summaries.ts <= excluded.ts',
+            self._row(summary)
+        )
+        if cursor.rowcount > 0:
+            self.changed()
+        return summary
+
+    def save_many(self, summaries, write_concern=None):
+        summaries = list(summaries)
+        if summaries:
+            with self.store.transaction() as connection:
+                self._write(summaries, connection)
+            self.changed()
+        return len(summaries)
+
+    def portfolio(self, metric='yearlyInflow', top_k=10, roi_buckets=10, location=None):
+        summaries = self._find('location = ?', (location,)) if location else self._find()
+        return format_portfolio(portfolio_facets(summaries, metric, top_k, roi_buckets), metric)
+
+class MaintenanceRepository(SQLiteRepository):
+    collection_name = 'maintenance_tasks'
+    columns = {
+        'site': lambda doc: doc.get('site'),
+        'location': lambda doc: doc.get('location'),
+        'type': lambda doc: doc.get('type'),
+        'due': lambda doc: _iso(doc.get('due')),
+    }
+    indexes = (('type', 'due', 'id'), ('due',), ('site',))
+
+    def register_site(self, site, location, install_date=None, last_service_date=None):
+        existing = {task['_id']: task for task in self._find('site = ?', (site,))}
+        tasks, changed = merge_tasks(existing, site, location, install_date, last_service_date)
+        if changed:
+            # Keep fields (e.g. history) that re-anchoring doesn't touch
+            for task in changed:
+                task.update({key: value for key, value in existing.get(task['_id'], {}).items() if key not in task})
+            with self.store.transaction() as connection:
+                self._write(changed, connection)
+            self.changed()
+        return tasks
+
+    def _due_query(self, task_types, bound, inclusive=False):
+        task_types = list(task_types)
+        where = f"type IN ({', '.join('?' * len(task_types))}) AND due {'<=' if inclusive else '<'} ?"
+        return where, [*task_types, _iso(bound)]
+
+    def due(self, before, task_types, after=None, site=None, location=None, limit=100):
+        where, params = self._due_query(task_types, before)
+        if site:
+            where += ' AND site = ?'
+            params.append(site)
+        if location:
+            where += ' AND location = ?'
+            params.append(location)
+        if after:
+            after_due, after_id = after
+            where += ' AND (due > ? OR (due = ? AND id > ?))'
+            params.extend([_iso(after_due), _iso(after_due), after_id])
+        return self._find(where, params, order='due, id', limit=limit)
+
+    def stream_due(self, until, task_types):
+        where, params = self._due_query(task_types, until, inclusive=True)
+        cursor = self.store.execute(f'SELECT doc FROM maintenance_tasks WHERE {where} ORDER BY due', params)
+        return (bson.decode(row[0]) for row in cursor)
+
+    def mark_done(self, task_id, done_date=None):
+        done = to_datetime(done_date or datetime.now())
+        with self.store.transaction() as connection:
+            row = connection.execute('SELECT doc FROM maintenance_tasks WHERE id = ?', (task_id,)).fetchone()
+            if row is None:
+                return None
+            task = bson.decode(row[0])
+            task['last_done'] = done
+            task['due'] = done + timedelta(days=task['interval_days'])
+            task['history'] = (task.get('history') or [])[-19:] + [done]
+            self._write([task], connection)
+        self.changed()
+        return task
+
+class SketchRepository(SQLiteRepository):
+    collection_name = 'quantile_sketches'
+    columns = {
+        'location': lambda doc: doc.get('location'),
+        'month': lambda doc: doc.get('month'),
+    }
+    indexes = (('location', 'month'), ('month',))
+
+    def add(self, sketch_id, location, month, values):
+        with self.store.transaction() as connection:
+            row = connection.execute('SELECT doc FROM quantile_sketches WHERE id = ?', (sketch_id,)).fetchone()
+            document = bson.decode(row[0]) if row else {
+                '_id': sketch_id, 'location': location, 'month': month, 'count': 0, 'rev': 0, 'pending': {},
+            }
+            pending = document.setdefault('pending', {})
+            for metric, value in values.items():
+                pending.setdefault(metric, []).append(value)
+            document['count'] += 1
+            document['rev'] += 1
+            self._write([document], connection)
+        self.changed()
+        return document
+
+    def compact(self, sketch_id, rev, digests):
+        with self.store.transaction() as connection:
+            row = connection.execute('SELECT doc FROM quantile_sketches WHERE id = ?', (sketch_id,)).fetchone()
+            document = bson.decode(row[0]) if row else None
+            if document is None or document.get('rev') != rev:
+                return False
+            document.update(digests=digests, pending={}, rev=rev + 1)
+            self._write([document], connection)
+        return True
+
+    def find(self, location=None, start=None, end=None):
+        conditions, params = [], []
+        if location:
+            conditions.append('location = ?')
+            params.append(location)
+        if start:
+            conditions.append('month >= ?')
+            params.append(start)
+        if end:
+            conditions.append('month <= ?')
+            params.append(end)
+        return self._find(' AND '.join(conditions), params)
+
+    def rebuild(self, documents, write_concern=None):
+        documents = list(documents)
+        with self.store.transaction() as connection:
+            connection.execute('DELETE FROM quantile_sketches')
+            self._write(documents, connection)
+        self.changed()
+        return documents
+
+def repositories(path, synchronous='NORMAL'):
+    """
+    Open the SQLite database at `path` and build the repositories, in the
+    order (inputs, results, history, user_settings, site_summaries,
+    maintenance, sketches).
+    """
+    store = SQLiteStore(path, synchronous)
+    inputs = InputRepository(store)
+    return (
+        inputs,
+        ResultRepository(store, inputs),
+        HistoryRepository(store),
+        SettingsRepository(store),
+        SiteSummaryRepository(store),
+        MaintenanceRepository(store),
+        SketchRepository(store),
+    )
@@ -0,0 +1,304 @@
+"""
+Seeded synthetic data generator for scale testing.
+
+Sites are spread over a handful of cities, each with a monthly rainfall
+climatology. Daily rainfall follows a wet/dry Markov chain with gamma
+amounts, so wet spells persist across days and rainfall is correlated
+between sites in the same city and season. Leaks are multi-day episodes that
+raise outflow above consumption. Tank levels come from a daily water balance.
+
+Generation is vectorised across the sites of a chunk; each chunk is written
+by its own process with unordered `insert_many` batches.
+"""
+import logging
+import time
+from datetime import datetime, timedelta
+import numpy as np
+from django.conf import settings
+from pymongo import MongoClient, UpdateOne
+from .calculation_service import calculate_roi, optimize_water_usage, recommend_tank_size
+from .result_schema import encode_forecast, encode_result
+from .maintenance import build_tasks
+from .history_search import derive_fields
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Mean daily rainfall (mm) per calendar month
+CLIMATOLOGY = {
+    'Chennai': [0.8, 0.5, 0.4, 0.5, 1.5, 1.6, 2.9, 3.8, 3.9, 9.0, 11.5, 4.7],
+    'Mumbai': [0.1, 0.1, 0.1, 0.1, 0.6, 17.5, 27.0, 18.0, 11.0, 2.5, 0.5, 0.1],
+    'Bangalore': [0.1, 0.2, 0.5, 1.5, 4.0, 3.5, 3.5, 4.5, 6.5, 5.5, 2.0, 0.5],
+    'Delhi': [0.6, 0.6, 0.5, 0.4, 0.9, 2.5, 6.5, 7.5, 4.0, 0.5, 0.2, 0.3],
+    'Hyderabad': [0.2, 0.2, 0.5, 0.6, 1.0, 3.5, 5.5, 5.5, 5.5, 3.0, 0.8, 0.2],
+    'Coimbatore': [0.3, 0.3, 0.5, 1.5, 2.0, 1.0, 1.0, 1.0, 2.0, 5.0, 4.5, 1.0],
+}
+
+# Wet/dry Markov chain transition probabilities
+P_WET_AFTER_DRY = 0.25
+P_WET_AFTER_WET = 0.70
+WET_FRACTION = P_WET_AFTER_DRY / (P_WET_AFTER_DRY + 1 - P_WET_AFTER_WET)
+GAMMA_SHAPE = 0.8
+
+# Leak episodes: daily start probability, mean duration (days), outflow multiplier range
+LEAK_START_PROBABILITY = 0.004
+LEAK_MEAN_DURATION = 10
+LEAK_OUTFLOW_FACTOR = (1.3, 1.9)
+
+def site_id(index):
+    return f"site-{index:07d}"
+
+def _simulate_chunk(rng, site_count, days, end_date):
+    """
+    Simulate daily series for a chunk of sites. Arrays are (sites, days).
+    """
+    cities = list(CLIMATOLOGY)
+    city_index = rng.integers(0, len(cities), site_count)
+    dates = [end_date - timedelta(days=days - 1 - i) for i in range(days)]
+    months = np.array([date.month - 1 for date in dates])
+
+    # City rainfall shared by all sites in a city, plus a little local variation
+    climatology = np.array([CLIMATOLOGY[city] for city in cities])
+    city_wet = np.zeros((len(cities), days), dtype=bool)
+    wet = rng.random(len(cities)) < WET_FRACTION
+    for day in range(days):
+        probability = np.where(wet, P_WET_AFTER_WET, P_WET_AFTER_DRY)
+        wet = rng.random(len(cities)) < probability
+        city_wet[:, day] = wet
+    mean = climatology[:, months]
+    scale = mean / (WET_FRACTION * GAMMA_SHAPE)
+    city_rain = np.where(city_wet, rng.gamma(GAMMA_SHAPE, 1.0, (len(cities), days)) * scale, 0.0)
+    rainfall = city_rain[city_index] * rng.lognormal(0.0, 0.2, (site_count, days))
+
+    roof_area = rng.uniform(60, 250, site_count)
+    tank_capacity = rng.choice([1000, 2000, 3000, 5000, 7500, 10000], site_count).astype(float)
+    consumption = rng.uniform(80, 400, site_count)
+
+    inflow = rainfall * roof_area[:, None] * 0.9
+    outflow = consumption[:, None] * rng.normal(1.0, 0.1, (site_count, days)).clip(0.5)
+
+    # Leak episodes
+    leaking = np.zeros((site_count, days), dtype=bool)
+    remaining = np.zeros(site_count, dtype=int)
+    factor = np.ones(site_count)
+    for day in range(days):
+        starts = (remaining == 0) & (rng.random(site_count) < LEAK_START_PROBABILITY)
+        remaining[starts] = rng.geometric(1 / LEAK_MEAN_DURATION, starts.sum())
+        factor[starts] = rng.uniform(*LEAK_OUTFLOW_FACTOR, starts.sum())
+        active = remaining > 0
+        leaking[:, day] = active
+        remaining[active] -= 1
+    outflow = np.where(leaking, outflow * factor[:, None], outflow)
+
+    # Daily tank balance
+    level = np.zeros((site_count, days))
+    current = tank_capacity * 0.5
+    for day in range(days):
+        current = np.clip(current + inflow[:, day] - outflow[:, day], 0, tank_capacity)
+        level[:, day] = current
+
+    return {
+        'cities': [cities[i] for i in city_index],
+        'dates': dates,
+        'rainfall': rainfall,
+        'roofArea': roof_area,
+        'tankCapacity': tank_capacity,
+        'consumption': consumption,
+        'inflow': inflow,
+        'outflow': outflow,
+        'isLeaking': leaking,
+        'currentLevel': level,
+    }
+
+def _historical_documents(chunk, first_site):
+    """
+    Yield historical_data documents for a simulated chunk, day by day.
+    """
+    timestamps = [date.isoformat() for date in chunk['dates']]
+    for site in range(len(chunk['cities'])):
+        sid = site_id(first_site + site)
+        location = chunk['cities'][site]
+        roof_area = round(float(chunk['roofArea'][site]), 1)
+        capacity = float(chunk['tankCapacity'][site])
+        for day, timestamp in enumerate(timestamps):
+            inflow = float(chunk['inflow'][site, day])
+            outflow = float(chunk['outflow'][site, day])
+            level = float(chunk['currentLevel'][site, day])
+            leaking = bool(chunk['isLeaking'][site, day])
+            yield derive_fields({
+                'timestamp': timestamp,
+                'siteId': sid,
+                'location': location,
+                'roofArea': roof_area,
+                'tankCapacity': capacity,
+                'inflow': round(inflow, 2),
+                'outflow': round(outflow, 2),
+                'rainfall': round(float(chunk['rainfall'][site, day]), 2),
+                'currentLevel': round(level, 1),
+                'waterUsage': optimize_water_usage(
+                    float(chunk['rainfall'][site, day]), capacity, level
+                ),
+                'isLeaking': leaking,
+                'leakDetection': {
+                    'isLeaking': leaking,
+                    'difference': round(max(0.0, outflow - float(chunk['consumption'][site])), 2),
+                    'severity': 'high' if leaking else 'low'
+                },
+            })
+
+def _insert_batches(collection, documents, batch_size):
+    inserted = 0
+    batch = []
+    for document in documents:
+        batch.append(document)
+        if len(batch) >= batch_size:
+            inserted += len(collection.insert_many(batch, ordered=False).inserted_ids)
+            batch = []
+    if batch:
+        inserted += len(collection.insert_many(batch, ordered=False).inserted_ids)
+    return inserted
+
+def generate_chunk(task):
+    """
+    Generate and insert one chunk of sites. Runs in a worker process.
+
+    Returns a {collection: inserted count} mapping.
+    """
+    chunk_index, first_site, site_count, days, seed, batch_size, end_date = task
+    rng = np.random.default_rng([seed, chunk_index])
+    # Each worker process needs its own client (clients are not fork-safe)
+    client = MongoClient(settings.MONGODB_URI)
+    db = client[settings.MONGODB_NAME]
+    counts = {}
+    try:
+        chunk = _simulate_chunk(rng, site_count, days, end_date)
+
+        counts['historical_data'] = _insert_batches(
+            db.historical_data, _historical_documents(chunk, first_site), batch_size
+        )
+
+        # One input per site, inserted first so results can reference it
+        inputs = []
+        for site in range(site_count):
+            inputs.append({
+                'timestamp': chunk['dates'][-1].isoformat(),
+                'siteId': site_id(first_site + site),
+                'location': chunk['cities'][site],
+                'roofArea': round(float(chunk['roofArea'][site]), 1),
+                'outflow': round(float(chunk['consumption'][site]), 1),
+                'tankCapacity': float(chunk['tankCapacity'][site]),
+                'waterCostPerLiter': 0.002,
+                'setupCost': 5000.0,
+                'maintenanceCost': 500.0,
+            })
+        input_ids = db.user_inputs.insert_many(inputs, ordered=False).inserted_ids
+        counts['user_inputs'] = len(input_ids)
+
+        # A 7-day forecast per city, shared by every site in it
+        forecasts = {}
+        start = end_date + timedelta(days=1)
+        for city, monthly in CLIMATOLOGY.items():
+            values = [
+                round(float(rng.gamma(GAMMA_SHAPE, monthly[(start + timedelta(days=i)).month - 1] / GAMMA_SHAPE)), 1)
+                for i in range(7)
+            ]
+            weather_data = {
+                'forecast': [
+                    {'date': (start + timedelta(days=i)).strftime('%Y-%m-%d'), 'rainfall': value}
+                    for i, value in enumerate(values)
+                ],
+                'averageRainfall': sum(values) / len(values),
+            }
+            forecasts[city] = (weather_data, *encode_forecast(city, weather_data))
+        db.forecasts.bulk_write([
+            UpdateOne({'_id': forecast_id}, {'$setOnInsert': document}, upsert=True)
+            for _, forecast_id, document in forecasts.values()
+        ], ordered=False)
+
+        results = []
+        for site, input_doc in enumerate(inputs):
+            weather_data, forecast_id, _ = forecasts[input_doc['location']]
+            daily_inflow = weather_data['averageRainfall'] * input_doc['roofArea'] * 0.9
+            leaking = bool(chunk['isLeaking'][site, -1])
+            site_results = {
+                'timestamp': input_doc['timestamp'],
+                'inflow': {
+                    'dailyInflow': daily_inflow,
+                    'monthlyInflow': daily_inflow * 30,
+                    'yearlyInflow': daily_inflow * 365
+                },
+                'leakDetection': {
+                    'isLeaking': leaking,
+                    'difference': 0,
+                    'severity': 'high' if leaking else 'low'
+                },
+                'roi': calculate_roi(daily_inflow * 365, 0.002, 5000, 500),
+                'waterUsage': optimize_water_usage(
+                    weather_data['averageRainfall'],
+                    input_doc['tankCapacity'],
+                    float(chunk['currentLevel'][site, -1])
+                ),
+                'tankRecommendation': recommend_tank_size(
+                    weather_data['averageRainfall'], input_doc['roofArea'], input_doc['outflow']
+                ),
+                'maintenanceSchedule': [],
+                'weatherData': weather_data,
+            }
+            results.append(encode_result(input_ids[site], input_doc['location'], site_results, forecast_id))
+        counts['calculation_results'] = _insert_batches(db.calculation_results, results, batch_size)
+
+        # Maintenance calendar: installed up to three years before the history
+        # starts, most sites serviced at some point in the last four months
+        tasks = []
+        for site, input_doc in enumerate(inputs):
+            installed = end_date - timedelta(days=days + int(rng.integers(0, 3 * 365)))
+            serviced = None
+            if rng.random() < 0.8:
+                serviced = end_date - timedelta(days=int(rng.integers(0, 120)))
+            tasks.extend(build_tasks(input_doc['siteId'], input_doc['location'], installed, serviced))
+        counts['maintenance_tasks'] = _insert_batches(db.maintenance_tasks, tasks, batch_size)
+    finally:
+        client.close()
+    return counts
+
+def plan_chunks(sites, days, seed, batch_size, chunk_sites, end_date=None):
+    """
+    Split the site range into generation tasks.
+    """
+    end_date = end_date or datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    tasks = []
+    for chunk_index, first_site in enumerate(range(0, sites, chunk_sites)):
+        site_count = min(chunk_sites, sites - first_site)
+        tasks.append((chunk_index, first_site, site_count, days, seed, batch_size, end_date))
+    return tasks
+
+def write_settings(db):
+    """
+    Write the single user settings document used by the API.
+    """
+    db.user_settings.replace_one({}, {
+        'data': {'waterCostPerLiter': 0.002, 'maintenanceCost': 500},
+        'alertForCleaning': True,
+        'last_updated': datetime.now().isoformat()
+    }, upsert=True)
+    return 1
+
+def run_generator(pool_map, tasks):
+    """
+    Run tasks through `pool_map` and aggregate counts, reporting the ingestion rate.
+
+    Returns (counts, elapsed seconds).
+    """
+    started = time.time()
+    totals = {}
+    done = 0
+    for counts in pool_map(generate_chunk, tasks):
+        done += 1
+        for name, count in counts.items():
+            totals[name] = totals.get(name, 0) + count
+        elapsed = max(time.time() - started, 1e-6)
+        logger.info(
+            f"Chunk {done}/{len(tasks)}: {sum(totals.values())} documents "
+            f"({sum(totals.values()) / elapsed:.0f} docs/s)"
+        )
+    return totals, time.time() - started
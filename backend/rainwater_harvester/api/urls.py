@@ -8,7 +8,20 @@ from .views import (
     SaveResultsView,
     WeatherView,
     HistoricalDataView,
-    SettingsView
+    HistorySeriesView,
+    HistorySearchView,
+    SettingsView,
+    ExportView,
+    ScenarioSweepView,
+    RecomputeView,
+    PortfolioView,
+    PercentilesView,
+    PeerRankView,
+    JobsView,
+    MaintenanceView,
+    MaintenanceUpcomingView,
+    MetricsView,
+    AllocationView
 )
 
 urlpatterns = [
@@ -17,6 +30,22 @@ urlpatterns = [
     path('save-results/', SaveResultsView.as_view(), name='save-results'),
     path('weather/', WeatherView.as_view(), name='weather'),
     path('historical-data/', HistoricalDataView.as_view(), name='historical-data'),
+    path('historical-data/series/', HistorySeriesView.as_view(), name='historical-data-series'),
+    path('historical-data/search/', HistorySearchView.as_view(), name='historical-data-search'),
     path('historical-data/<str:result_id>/', HistoricalDataView.as_view(), name='delete-historical-data'),
     path('settings/', SettingsView.as_view(), name='settings'),
+    path('export/', ExportView.as_view(), name='export'),
+    path('scenarios/', ScenarioSweepView.as_view(), name='scenarios'),
+    path('recompute/', RecomputeView.as_view(), name='recompute'),
+    path('recompute/<str:job_id>/', RecomputeView.as_view(), name='recompute-job'),
+    path('portfolio/', PortfolioView.as_view(), name='portfolio'),
+    path('percentiles/', PercentilesView.as_view(), name='percentiles'),
+    path('percentiles/rank/', PeerRankView.as_view(), name='percentiles-rank'),
+    path('jobs/', JobsView.as_view(), name='jobs'),
+    path('jobs/<str:job_id>/', JobsView.as_view(), name='job'),
+    path('maintenance/', MaintenanceView.as_view(), name='maintenance'),
+    path('maintenance/upcoming/', MaintenanceUpcomingView.as_view(), name='maintenance-upcoming'),
+    path('maintenance/<str:task_id>/done/', MaintenanceView.as_view(), name='maintenance-done'),
+    path('metrics/', MetricsView.as_view(), name='metrics'),
+    path('allocation/', AllocationView.as_view(), name='allocation'),
 ]
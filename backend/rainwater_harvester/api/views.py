@@ -1,35 +1,66 @@
 """
 Views for the rainwater harvester API.
 """
-from datetime import datetime
+from datetime import datetime, timedelta
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
+from django.http import StreamingHttpResponse
 import json
 import logging
-from pymongo import MongoClient
+import os
 from django.conf import settings
-from .serializers import InputSerializer, SettingsSerializer, ResultIdSerializer
-from .calculation_service import process_inputs
-from .weather_service import get_weather_forecast
-
-# MongoDB setup
-client = MongoClient(settings.MONGODB_URI)
-db = client[settings.MONGODB_NAME]
-
-# MongoDB collections
-user_inputs = db['user_inputs']
-calculation_results = db['calculation_results']
-historical_data = db['historical_data']
-user_settings = db['user_settings']
+import numpy as np
+from .serializers import (
+    InputSerializer,
+    SettingsSerializer,
+    ResultIdSerializer,
+    ScenarioSweepSerializer,
+    MonteCarloSerializer,
+    AllocationSerializer
+)
+from .calculation_service import process_inputs, sweep_scenarios, plan_site_allocations, SCENARIO_AXES
+from .weather_service import get_weather_forecast, get_forecast
+from . import repository
+from . import prediction
+from . import quantiles
+from .settings_cache import settings_cache
+from .recompute import start_recompute, get_job
+from .portfolio import PORTFOLIO_METRICS, site_key
+from .maintenance import MAINTENANCE_TASKS, active_task_types, site_schedule, upcoming, format_task, to_datetime
+from . import jobs
+from . import singleflight
+from . import shared_cache
+from .middleware import AdmissionControlMiddleware
+from .export import iter_export, missing_dependency, EXPORT_COLUMNS, EXPORT_FORMATS
+from .history_series import BUCKET_SIZES, DOWNSAMPLE_METRICS, format_series
+from .history_search import parse_search, format_page
+from .conditional import collection_etag, etag_matches, not_modified, with_etag
+from .read_routing import reads_routed, writes_causal
+from .idempotency import idempotent
+from . import idempotency
 
 # Set up logging
 logger = logging.getLogger(__name__)
 
+# Input fields that fall back to the saved settings when a request omits them
+SETTINGS_DEFAULT_FIELDS = ('waterCostPerLiter', 'setupCost', 'maintenanceCost')
+
+# Settings whose change makes every stored result stale (tariff and upkeep)
+SETTINGS_RECOMPUTE_FIELDS = ('waterCostPerLiter', 'maintenanceCost')
+
+# Parameter serializer for each background job type
+JOB_SERIALIZERS = {
+    'scenario_sweep': ScenarioSweepSerializer,
+    'monte_carlo': MonteCarloSerializer,
+}
+
 class InputsView(APIView):
     """
     API view for handling user inputs and calculations.
     """
+    @idempotent('inputs')
+    @writes_causal
     def post(self, request):
         """
         Process user inputs and return calculation results.
@@ -42,31 +73,54 @@ class InputsView(APIView):
                 # Add timestamp to input data
                 input_data = serializer.validated_data
                 input_data['timestamp'] = datetime.now().isoformat()
+                for field in ('installDate', 'lastServiceDate'):
+                    if field in input_data:
+                        input_data[field] = input_data[field].isoformat()
+                
+                # Fill omitted cost fields from the cached settings
+                user_settings = settings_cache.get() or {}
+                setting_defaults = user_settings.get('data') or {}
+                for field in SETTINGS_DEFAULT_FIELDS:
+                    if field not in request.data and field in setting_defaults:
+                        # Settings saved before they were validated may hold strings
+                        try:
+                            input_data[field] = float(setting_defaults[field])
+                        except (TypeError, ValueError):
+                            logger.warning(f"Ignoring non-numeric {field} setting: {setting_defaults[field]!r}")
                 
                 logger.info(f"Validated input data: {input_data}")
                 
-                # Save inputs to database using MongoDB directly
-                result = db.user_inputs.insert_one(input_data)
-                input_id = str(result.inserted_id)
+                # Save inputs to database
+                saved_input = repository.inputs.save(input_data)
+                input_id = str(saved_input['_id'])
                 logger.info(f"Input data saved to database with ID: {input_id}")
                 
                 # Add input ID to input data
                 input_data['_id'] = input_id
                 
                 # Process inputs and get results
-                results = process_inputs(input_data)
+                results = process_inputs(input_data, user_settings)
                 
                 # Add input ID to results
                 results['input_id'] = input_id
                 
-                # Save results using MongoDB directly
-                result_doc = {
-                    'timestamp': datetime.now().isoformat(),
-                    'input_data': input_data,
-                    'data': results
-                }
-                result = db.calculation_results.insert_one(result_doc)
-                logger.info(f"Results saved to database with ID: {result.inserted_id}")
+                # Anchor the maintenance schedule on the site's persistent calendar
+                tasks = repository.maintenance.register_site(
+                    site_key(input_data),
+                    input_data['location'],
+                    input_data.get('installDate'),
+                    input_data.get('lastServiceDate')
+                )
+                active_types = active_task_types(user_settings)
+                results['maintenanceSchedule'] = site_schedule(
+                    [task for task in tasks if task['type'] in active_types]
+                )
+                
+                # Save results in the compact schema (input and forecast by reference)
+                repository.results.save(input_id, input_data['location'], results)
+                
+                # Keep the site's portfolio summary current
+                repository.site_summaries.save(input_data, results)
                 
                 return Response(results, status=status.HTTP_200_OK)
             except Exception as e:
@@ -88,6 +142,7 @@ class ResultsView(APIView):
     """
     API view for retrieving calculation results.
     """
+    @reads_routed('results')
     def get(self, request):
         """
         Get the latest calculation results.
@@ -95,20 +150,30 @@ class ResultsView(APIView):
         try:
             user_input_id = request.query_params.get('user_input_id', None)
             
-            if user_input_id:
-                logger.info(f"Fetching results for user_input_id: {user_input_id}")
-                result = db.calculation_results.find_one({'input_data._id': user_input_id})
-                if result:
-                    return Response(result['data'], status=status.HTTP_200_OK)
-                else:
-                    return Response({'message': 'No results found for the given input ID'}, status=status.HTTP_404_NOT_FOUND)
-            else:
-                logger.info("Fetching latest results")
-                result = db.calculation_results.find_one(sort=[('timestamp', -1)])
-                if result:
-                    return Response(result['data'], status=status.HTTP_200_OK)
+            # Answer unchanged polls without running the query
+            etag = collection_etag('calculation_results', variant=user_input_id or '')
+            if etag_matches(request, etag):
+                return not_modified(etag)
+            
+            def lookup():
+                if user_input_id:
+                    logger.info(f"Fetching results for user_input_id: {user_input_id}")
+                    result = repository.results.find_by_input_id(user_input_id)
                 else:
-                    return Response({'message': 'No results found'}, status=status.HTTP_404_NOT_FOUND)
+                    logger.info("Fetching latest results")
+                    result = repository.results.latest()
+                return repository.results.hydrate([result])[0] if result else None
+            
+            # The ETag changes with every write, so cached results never go stale
+            data = shared_cache.get_or_set(
+                'results', etag.strip('"'), lookup, settings.RESULT_CACHE_SECONDS,
+                cacheable=lambda data: data is not None
+            )
+            if data is not None:
+                return with_etag(Response(data, status=status.HTTP_200_OK), etag)
+            if user_input_id:
+                return Response({'message': 'No results found for the given input ID'}, status=status.HTTP_404_NOT_FOUND)
+            return Response({'message': 'No results found'}, status=status.HTTP_404_NOT_FOUND)
         
         except Exception as e:
             logger.error(f"Error retrieving results: {str(e)}")
@@ -125,6 +190,8 @@ class SaveResultsView(APIView):
     """
     API view for saving calculation results to historical data.
     """
+    @idempotent('save-results')
+    @writes_causal
     def post(self, request):
         """
         Save calculation results to historical data.
@@ -155,6 +222,8 @@ class SaveResultsView(APIView):
                 'maintenanceSchedule': data.get('maintenanceSchedule', []),
                 'weatherData': data.get('weatherData', {})
             }
+            if data.get('currentLevel') is not None:
+                historical_entry['currentLevel'] = float(data['currentLevel'])
             
             # Validate required fields
             required_fields = ['location', 'inflow', 'outflow', 'tankCapacity']
@@ -171,13 +240,20 @@ class SaveResultsView(APIView):
                 )
             
             # Save to MongoDB
-            result = historical_data.insert_one(historical_entry)
-            logger.info(f"Results saved to historical data with ID: {result.inserted_id}")
+            saved_doc = repository.history.save(historical_entry)
+            saved_doc['_id'] = str(saved_doc['_id'])  # Convert ObjectId to string
             
-            # Return saved document
-            saved_doc = historical_data.find_one({'_id': result.inserted_id})
-            if saved_doc:
-                saved_doc['_id'] = str(saved_doc['_id'])  # Convert ObjectId to string
+            # Retrain the location's prediction model once enough new data has arrived
+            try:
+                prediction.record_new_entry(historical_entry['location'])
+            except Exception as e:
+                logger.warning(f"Could not record new history entry for prediction: {str(e)}")
+            
+            # Add the entry to its location's percentile sketches
+            try:
+                quantiles.record_entry(historical_entry)
+            except Exception as e:
+                logger.warning(f"Could not add history entry to percentile sketches: {str(e)}")
             
             return Response(
                 {
@@ -213,17 +289,30 @@ class HistoricalDataView(APIView):
     """
     API view for retrieving and managing historical data.
     """
+    @reads_routed('history')
     def get(self, request):
         """
         Get historical data for analysis.
         """
         try:
+            # Optional ISO time range; older ranges are served from the archive too
+            start = request.query_params.get('start')
+            end = request.query_params.get('end')
+            
+            # Answer unchanged polls without running the query
+            etag = collection_etag('historical_data', variant=f"{start or ''}:{end or ''}")
+            if etag_matches(request, etag):
+                return not_modified(etag)
+            
             # Get historical data from database
-            data = list(historical_data.find().sort('timestamp', -1))
+            if start or end:
+                data = repository.history.between(start, end)
+            else:
+                data = repository.history.list()
             # Convert ObjectId to string for JSON serialization
             for item in data:
                 item['_id'] = str(item['_id'])
-            return Response(data, status=status.HTTP_200_OK)
+            return with_etag(Response(data, status=status.HTTP_200_OK), etag)
         
         except Exception as e:
             logger.error(f"Error retrieving historical data: {str(e)}")
@@ -248,10 +337,7 @@ class HistoricalDataView(APIView):
                 )
                 
             # Delete the result from MongoDB
-            from bson.objectid import ObjectId
-            result = historical_data.delete_one({'_id': ObjectId(result_id)})
-            
-            if result.deleted_count > 0:
+            if repository.history.delete(result_id):
                 return Response(
                     {'message': 'Result deleted successfully'}, 
                     status=status.HTTP_200_OK
@@ -273,6 +359,99 @@ class HistoricalDataView(APIView):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
+class HistorySearchView(APIView):
+    """
+    API view for filtering, sorting and paging historical data.
+    """
+    @reads_routed('history')
+    def get(self, request):
+        """
+        Get one page of history entries matching the filters, e.g.
+        ?location=Chennai&tankCapacity__gt=3000&sort=tankCapacity&limit=50.
+        Pass the returned `next` cursor as `after` for the following page.
+        """
+        try:
+            search = parse_search(
+                request.query_params,
+                settings.HISTORY_SEARCH_DEFAULT_LIMIT,
+                settings.HISTORY_SEARCH_MAX_LIMIT
+            )
+        except ValueError as e:
+            return Response({'message': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            etag = collection_etag('historical_data', variant=f"search:{request.query_params.urlencode()}")
+            if etag_matches(request, etag):
+                return not_modified(etag)
+            
+            page = format_page(repository.history.search(search), search)
+            return with_etag(Response(page, status=status.HTTP_200_OK), etag)
+        except Exception as e:
+            logger.error(f"Error searching historical data: {str(e)}")
+            return Response(
+                {
+                    'error': 'An error occurred while searching historical data.',
+                    'details': str(e),
+                    'message': 'This could be due to a database connection issue. Please check your database connection and try again.'
+                }, 
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+class HistorySeriesView(APIView):
+    """
+    API view for time-bucketed history series (for charts).
+    """
+    @reads_routed('history')
+    def get(self, request):
+        """
+        Get per-bucket aggregates of the history in [start, end), optionally
+        for one location, downsampled to at most `points` points.
+        """
+        bucket = request.query_params.get('bucket', 'day')
+        metric = request.query_params.get('metric', 'outflow')
+        start = request.query_params.get('start')
+        end = request.query_params.get('end')
+        location = request.query_params.get('location')
+        if bucket not in BUCKET_SIZES:
+            return Response(
+                {'message': f'bucket must be one of: {", ".join(BUCKET_SIZES)}'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if metric not in DOWNSAMPLE_METRICS:
+            return Response(
+                {'message': f'metric must be one of: {", ".join(DOWNSAMPLE_METRICS)}'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            points = min(int(request.query_params.get('points', settings.HISTORY_SERIES_DEFAULT_POINTS)),
+                         settings.HISTORY_SERIES_MAX_POINTS)
+        except ValueError:
+            return Response({'message': 'points must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            # Answer unchanged polls without running the aggregation
+            etag = collection_etag(
+                'historical_data',
+                variant=f"series:{bucket}:{metric}:{points}:{start or ''}:{end or ''}:{location or ''}"
+            )
+            if etag_matches(request, etag):
+                return not_modified(etag)
+            
+            rows = repository.history.series(bucket, start, end, location)
+            series = format_series(rows, bucket, max(points, 3), metric)
+            series.update(start=start, end=end, location=location, metric=metric)
+            return with_etag(Response(series, status=status.HTTP_200_OK), etag)
+        except Exception as e:
+            logger.error(f"Error aggregating history series: {str(e)}")
+            return Response(
+                {
+                    'error': 'An error occurred while aggregating historical data.',
+                    'details': str(e),
+                    'message': 'This could be due to a database connection issue. Please check your database connection and try again.'
+                }, 
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
 class SettingsView(APIView):
     """
     API view for managing user settings.
@@ -282,9 +461,10 @@ class SettingsView(APIView):
         Get user settings.
         """
         try:
-            # Get settings from database
-            settings = user_settings.find_one()
+            # Get settings from the in-process cache
+            settings = settings_cache.get()
             if settings:
+                settings['_id'] = str(settings['_id'])
                 return Response(settings, status=status.HTTP_200_OK)
             else:
                 return Response({"message": "No settings found"}, status=status.HTTP_404_NOT_FOUND)
@@ -308,14 +488,23 @@ class SettingsView(APIView):
         
         if serializer.is_valid():
             try:
-                # Add timestamp to settings data
-                settings_data = serializer.validated_data
-                settings_data['last_updated'] = datetime.now().isoformat()
+                previous = (settings_cache.get() or {}).get('data') or {}
                 
-                # Update or insert settings
-                result = user_settings.replace_one({}, settings_data, upsert=True)
+                # Update or insert settings (timestamped by the repository)
+                settings_data = repository.user_settings.replace(dict(serializer.validated_data))
+                settings_cache.set(settings_data)
                 logger.info(f"Settings updated successfully")
                 
+                # Refresh the cost fields of stored results in the background
+                new_values = settings_data.get('data') or {}
+                changes = {
+                    field: new_values[field] for field in SETTINGS_RECOMPUTE_FIELDS
+                    if field in new_values and new_values[field] != previous.get(field)
+                }
+                if changes and settings.RECOMPUTE_ON_SETTINGS_CHANGE:
+                    job = start_recompute(changes)
+                    settings_data = dict(settings_data, recomputeJob=str(job['_id']))
+                
                 return Response(settings_data, status=status.HTTP_200_OK)
             except Exception as e:
                 logger.error(f"Error updating settings: {str(e)}")
@@ -357,3 +546,543 @@ class WeatherView(APIView):
                 }, 
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
+
+class ExportView(APIView):
+    """
+    API view for streaming bulk exports of stored data.
+    """
+    def get(self, request):
+        """
+        Stream a collection as CSV or Parquet.
+        """
+        collection_name = request.query_params.get('collection', 'historical_data')
+        export_format = request.query_params.get('format', 'csv')
+        
+        if collection_name not in EXPORT_COLUMNS:
+            return Response(
+                {'message': f'collection must be one of: {", ".join(EXPORT_COLUMNS)}'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if export_format not in EXPORT_FORMATS:
+            return Response(
+                {'message': f'format must be one of: {", ".join(EXPORT_FORMATS)}'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        # Checked before streaming: once the 200 headers are sent an error can only truncate the body
+        missing = missing_dependency(export_format)
+        if missing:
+            return Response({'message': missing}, status=status.HTTP_501_NOT_IMPLEMENTED)
+        
+        try:
+            chunks = iter_export(
+                collection_name,
+                export_format,
+                start=request.query_params.get('start'),
+                end=request.query_params.get('end'),
+                location=request.query_params.get('location')
+            )
+            content_type = 'text/csv' if export_format == 'csv' else 'application/vnd.apache.parquet'
+            response = StreamingHttpResponse(chunks, content_type=content_type)
+            response['Content-Disposition'] = f'attachment; filename="{collection_name}.{export_format}"'
+            return response
+        except Exception as e:
+            logger.error(f"Error exporting data: {str(e)}")
+            return Response(
+                {
+                    'error': 'An error occurred while exporting data.',
+                    'details': str(e),
+                    'message': 'This could be due to a database connection issue or a missing export dependency.'
+                }, 
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+class ScenarioSweepView(APIView):
+    """
+    API view for evaluating a grid of what-if scenarios without persisting them.
+    """
+    def post(self, request):
+        """
+        Evaluate every combination of the given parameter ranges.
+        
+        The weather is fetched once; metrics come back as flat row-major
+        arrays over `shape`, with axes in `order`.
+        """
+        serializer = ScenarioSweepSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        
+        data = serializer.validated_data
+        axes = {name: data[name] for name in SCENARIO_AXES}
+        points = int(np.prod([len(values) for values in axes.values()]))
+        if points > settings.SCENARIO_SWEEP_MAX_POINTS:
+            return Response(
+                {
+                    'message': f'Scenario grid has {points} points; the limit is {settings.SCENARIO_SWEEP_MAX_POINTS}.',
+                    'details': 'Reduce the number of steps on one or more axes.'
+                },
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        try:
+            average_rainfall = get_forecast(data['location']).average_rainfall
+            metrics = sweep_scenarios(average_rainfall, data['outflow'], axes)
+            
+            return Response(
+                {
+                    'location': data['location'],
+                    'averageRainfall': average_rainfall,
+                    'order': list(SCENARIO_AXES),
+                    'axes': axes,
+                    'shape': [len(axes[name]) for name in SCENARIO_AXES],
+                    'metrics': {
+                        name: np.round(values, 2).ravel().tolist()
+                        for name, values in metrics.items()
+                    }
+                },
+                status=status.HTTP_200_OK
+            )
+        except Exception as e:
+            logger.error(f"Error evaluating scenario sweep: {str(e)}", exc_info=True)
+            return Response(
+                {
+                    'error': 'An error occurred while evaluating the scenarios.',
+                    'details': str(e),
+                    'message': 'This could be due to an issue with the OpenWeatherMap API or an invalid location.'
+                }, 
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+class RecomputeView(APIView):
+    """
+    API view for recomputing stored results after an input change.
+    """
+    def unsupported_backend(self):
+        """
+        Get the error response when the storage backend can't recompute, else None.
+        """
+        if settings.STORAGE_BACKEND == 'mongodb':
+            return None
+        return Response(
+            {'message': f'Recompute needs the MongoDB storage backend (STORAGE_BACKEND is {settings.STORAGE_BACKEND!r})'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    def post(self, request):
+        """
+        Start a background recompute, e.g. {"changes": {"waterCostPerLiter": 0.003}}.
+        """
+        unsupported = self.unsupported_backend()
+        if unsupported is not None:
+            return unsupported
+        changes = request.data.get('changes')
+        if not isinstance(changes, dict) or not changes:
+            return Response(
+                {'message': 'changes must be a non-empty object of input values'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        try:
+            changes = {name: float(value) for name, value in changes.items()}
+        except (TypeError, ValueError):
+            return Response({'message': 'changes values must be numbers'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            job = start_recompute(changes, request.data.get('location'))
+            return Response(get_job(job['_id']), status=status.HTTP_202_ACCEPTED)
+        except ValueError as e:
+            return Response({'message': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except Exception as e:
+            logger.error(f"Error starting recompute: {str(e)}")
+            return Response(
+                {
+                    'error': 'An error occurred while starting the recompute.',
+                    'details': str(e),
+                    'message': 'This could be due to a database connection issue. Please check your database connection and try again.'
+                }, 
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+    
+    def get(self, request, job_id=None):
+        """
+        Get the progress of a recompute job.
+        """
+        unsupported = self.unsupported_backend()
+        if unsupported is not None:
+            return unsupported
+        job = get_job(job_id)
+        if job is None:
+            return Response({'message': 'Recompute job not found'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(job, status=status.HTTP_200_OK)
+
+class PortfolioView(APIView):
+    """
+    API view for fleet-level figures across all sites.
+    """
+    @reads_routed('portfolio')
+    def get(self, request):
+        """
+        Get portfolio totals, the ROI distribution, leak counts and the top sites.
+        """
+        metric = request.query_params.get('metric', 'yearlyInflow')
+        location = request.query_params.get('location')
+        if metric not in PORTFOLIO_METRICS:
+            return Response(
+                {'message': f'metric must be one of: {", ".join(PORTFOLIO_METRICS)}'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            top_k = min(int(request.query_params.get('top', 10)), settings.PORTFOLIO_MAX_TOP)
+            roi_buckets = min(int(request.query_params.get('buckets', 10)), 100)
+        except ValueError:
+            return Response({'message': 'top and buckets must be integers'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            # Answer unchanged polls without running the aggregation
+            etag = collection_etag('site_summaries', variant=f"{metric}:{top_k}:{roi_buckets}:{location or ''}")
+            if etag_matches(request, etag):
+                return not_modified(etag)
+            
+            report = repository.site_summaries.portfolio(metric, max(top_k, 1), max(roi_buckets, 1), location)
+            return with_etag(Response(report, status=status.HTTP_200_OK), etag)
+        except Exception as e:
+            logger.error(f"Error aggregating portfolio: {str(e)}")
+            return Response(
+                {
+                    'error': 'An error occurred while aggregating the portfolio.',
+                    'details': str(e),
+                    'message': 'This could be due to a database connection issue. Please check your database connection and try again.'
+                }, 
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+def _sketch_params(request):
+    """
+    Read and validate the metric and month range of a percentile request.
+    Returns (metric, start, end) or raises ValueError.
+    """
+    metric = request.query_params.get('metric', 'outflow')
+    if metric not in quantiles.SKETCH_METRICS:
+        raise ValueError(f'metric must be one of: {", ".join(quantiles.SKETCH_METRICS)}')
+    start = request.query_params.get('start')
+    end = request.query_params.get('end')
+    for month in (start, end):
+        if month:
+            datetime.strptime(month, '%Y-%m')
+    return metric, start, end
+
+class PercentilesView(APIView):
+    """
+    API view for percentile bands of inflow, outflow and ROI.
+    """
+    @reads_routed('history')
+    def get(self, request):
+        """
+        Get percentiles of a metric for a location (all by default) over the
+        months [start, end], e.g. ?metric=outflow&location=Chennai&p=50,90.
+        """
+        location = request.query_params.get('location')
+        try:
+            metric, start, end = _sketch_params(request)
+            requested = request.query_params.get('p')
+            points = [float(p) / 100 for p in requested.split(',')] if requested else quantiles.DEFAULT_QUANTILES
+            if not all(0 <= q <= 1 for q in points):
+                raise ValueError('p must be percentiles between 0 and 100')
+        except ValueError as e:
+            return Response({'message': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            etag = collection_etag(
+                'quantile_sketches',
+                variant=f"p:{metric}:{location or ''}:{start or ''}:{end or ''}:{requested or ''}"
+            )
+            if etag_matches(request, etag):
+                return not_modified(etag)
+            
+            report = quantiles.percentiles(metric, points, location, start, end)
+            return with_etag(Response(report, status=status.HTTP_200_OK), etag)
+        except Exception as e:
+            logger.error(f"Error estimating percentiles: {str(e)}")
+            return Response(
+                {
+                    'error': 'An error occurred while estimating percentiles.',
+                    'details': str(e),
+                    'message': 'This could be due to a database connection issue. Please check your database connection and try again.'
+                }, 
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+class PeerRankView(APIView):
+    """
+    API view for ranking a location against its peers.
+    """
+    @reads_routed('history')
+    def get(self, request):
+        """
+        Get the percentile rank of a location's median (or of `value`) among
+        the entries of all other locations.
+        """
+        location = request.query_params.get('location')
+        if not location:
+            return Response({'message': 'location is required'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            metric, start, end = _sketch_params(request)
+            value = request.query_params.get('value')
+            value = float(value) if value is not None else None
+        except ValueError as e:
+            return Response({'message': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            etag = collection_etag(
+                'quantile_sketches',
+                variant=f"rank:{metric}:{location}:{start or ''}:{end or ''}:{'' if value is None else value}"
+            )
+            if etag_matches(request, etag):
+                return not_modified(etag)
+            
+            report = quantiles.peer_rank(metric, location, value, start, end)
+            return with_etag(Response(report, status=status.HTTP_200_OK), etag)
+        except Exception as e:
+            logger.error(f"Error ranking {location} against peers: {str(e)}")
+            return Response(
+                {
+                    'error': 'An error occurred while ranking against peers.',
+                    'details': str(e),
+                    'message': 'This could be due to a database connection issue. Please check your database connection and try again.'
+                }, 
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+class JobsView(APIView):
+    """
+    API view for queueing CPU-heavy calculations and polling their progress.
+    """
+    def post(self, request):
+        """
+        Queue a job, e.g. {"type": "monte_carlo", "params": {...}}.
+        """
+        job_type = request.data.get('type')
+        if job_type not in JOB_SERIALIZERS:
+            return Response(
+                {'message': f'type must be one of: {", ".join(JOB_SERIALIZERS)}'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        serializer = JOB_SERIALIZERS[job_type](data=request.data.get('params') or {})
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        params = dict(serializer.validated_data)
+        
+        if job_type == 'scenario_sweep':
+            points = int(np.prod([len(params[name]) for name in SCENARIO_AXES]))
+            if points > settings.JOBS_SWEEP_MAX_POINTS:
+                return Response(
+                    {'message': f'Scenario grid has {points} points; the limit is {settings.JOBS_SWEEP_MAX_POINTS}.'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+        
+        try:
+            job = jobs.submit_job(job_type, params)
+            return Response(jobs.get_job(job['_id']), status=status.HTTP_202_ACCEPTED)
+        except Exception as e:
+            logger.error(f"Error queueing job: {str(e)}")
+            return Response(
+                {
+                    'error': 'An error occurred while queueing the job.',
+                    'details': str(e),
+                    'message': 'This could be due to a database connection issue. Please check your database connection and try again.'
+                }, 
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+    
+    def get(self, request, job_id=None):
+        """
+        Get a job's status and progress, and its result once completed.
+        """
+        if not job_id:
+            return Response({'message': 'Job ID is required'}, status=status.HTTP_400_BAD_REQUEST)
+        job = jobs.get_job(job_id)
+        if job is None:
+            return Response({'message': 'Job not found'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(job, status=status.HTTP_200_OK)
+    
+    def delete(self, request, job_id=None):
+        """
+        Cancel a queued or running job.
+        """
+        if not job_id:
+            return Response({'message': 'Job ID is required'}, status=status.HTTP_400_BAD_REQUEST)
+        job = jobs.cancel_job(job_id)
+        if job is None:
+            return Response({'message': 'Job not found'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(job, status=status.HTTP_200_OK)
+
+def maintenance_task_types(request):
+    """
+    Get the task types a maintenance query covers. Cleaning tasks are hidden
+    while alertForCleaning is off.
+    """
+    types = active_task_types(settings_cache.get() or {})
+    requested = request.query_params.get('type')
+    if requested:
+        return [requested] if requested in types else []
+    return types
+
+class MaintenanceView(APIView):
+    """
+    API view for the fleet-wide maintenance calendar.
+    """
+    @reads_routed('maintenance')
+    def get(self, request):
+        """
+        Get the tasks due before `before` (default: a week from today),
+        soonest first, one page at a time.
+        """
+        try:
+            today = to_datetime(datetime.now())
+            before = request.query_params.get('before')
+            before = to_datetime(before) if before else today + timedelta(days=7)
+            limit = min(int(request.query_params.get('limit', 100)), 1000)
+            after = None
+            cursor = request.query_params.get('cursor')
+            if cursor:
+                after_date, _, after_id = cursor.partition('|')
+                after = (to_datetime(after_date), after_id)
+        except ValueError:
+            return Response(
+                {'message': 'before and cursor dates must be YYYY-MM-DD and limit an integer'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        try:
+            tasks = repository.maintenance.due(
+                before,
+                maintenance_task_types(request),
+                after=after,
+                site=request.query_params.get('site'),
+                location=request.query_params.get('location'),
+                limit=limit
+            )
+            next_cursor = None
+            if len(tasks) == limit:
+                last = tasks[-1]
+                next_cursor = f"{last['due'].strftime('%Y-%m-%d')}|{last['_id']}"
+            return Response(
+                {'tasks': [format_task(task) for task in tasks], 'nextCursor': next_cursor},
+                status=status.HTTP_200_OK
+            )
+        except Exception as e:
+            logger.error(f"Error retrieving maintenance tasks: {str(e)}")
+            return Response(
+                {
+                    'error': 'An error occurred while retrieving maintenance tasks.',
+                    'details': str(e),
+                    'message': 'This could be due to a database connection issue. Please check your database connection and try again.'
+                }, 
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+    
+    @writes_causal
+    def post(self, request, task_id=None):
+        """
+        Mark a task as done (today, or on the given `date`).
+        """
+        if task_id is None or task_id.rpartition(':')[2] not in MAINTENANCE_TASKS:
+            return Response({'message': 'Maintenance task not found'}, status=status.HTTP_404_NOT_FOUND)
+        try:
+            done_date = to_datetime(request.data.get('date')) if request.data.get('date') else None
+        except ValueError:
+            return Response({'message': 'date must be YYYY-MM-DD'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            task = repository.maintenance.mark_done(task_id, done_date)
+            if task is None:
+                return Response({'message': 'Maintenance task not found'}, status=status.HTTP_404_NOT_FOUND)
+            return Response(format_task(task), status=status.HTTP_200_OK)
+        except Exception as e:
+            logger.error(f"Error marking maintenance task done: {str(e)}")
+            return Response(
+                {
+                    'error': 'An error occurred while updating the maintenance task.',
+                    'details': str(e),
+                    'message': 'This could be due to a database connection issue. Please check your database connection and try again.'
+                }, 
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+class MaintenanceUpcomingView(APIView):
+    """
+    API view for upcoming maintenance reminders across all sites.
+    """
+    @reads_routed('maintenance')
+    def get(self, request):
+        """
+        Get reminder occurrences (including recurrences) for the next `days`
+        days in date order, up to `limit`. Overdue tasks come first.
+        """
+        try:
+            days = min(int(request.query_params.get('days', 30)), 366)
+            limit = min(int(request.query_params.get('limit', 500)), 10000)
+        except ValueError:
+            return Response({'message': 'days and limit must be integers'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            until = to_datetime(datetime.now()) + timedelta(days=days)
+            tasks = repository.maintenance.stream_due(until, maintenance_task_types(request))
+            reminders = [format_task(task, due) for due, task in upcoming(tasks, until, limit)]
+            tasks.close()
+            return Response(reminders, status=status.HTTP_200_OK)
+        except Exception as e:
+            logger.error(f"Error retrieving maintenance reminders: {str(e)}")
+            return Response(
+                {
+                    'error': 'An error occurred while retrieving maintenance reminders.',
+                    'details': str(e),
+                    'message': 'This could be due to a database connection issue. Please check your database connection and try again.'
+                }, 
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+class MetricsView(APIView):
+    """
+    API view for this process's runtime counters.
+    """
+    def get(self, request):
+        """
+        Get single-flight, admission control, settings cache and shared cache counters.
+        """
+        return Response(
+            {
+                'pid': os.getpid(),
+                'singleflight': singleflight.stats(),
+                'admission': {policy.name: policy.stats() for policy in AdmissionControlMiddleware.policies},
+                'settingsCache': {'mode': settings_cache.mode},
+                'sharedCache': shared_cache.stats(),
+                'idempotency': idempotency.stats(),
+            },
+            status=status.HTTP_200_OK
+        )
+
+class AllocationView(APIView):
+    """
+    API view for planning daily water use over the forecast horizon.
+    """
+    def post(self, request):
+        """
+        Plan daily allocations for a batch of sites ({"sites": [...]}).
+        """
+        serializer = AllocationSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            sites = [dict(site) for site in serializer.validated_data['sites']]
+            return Response({'plans': plan_site_allocations(sites)}, status=status.HTTP_200_OK)
+        except Exception as e:
+            logger.error(f"Error planning water allocation: {str(e)}", exc_info=True)
+            return Response(
+                {
+                    'error': 'An error occurred while planning water allocation.',
+                    'details': str(e),
+                    'message': 'This could be due to an issue with the OpenWeatherMap API or an invalid location.'
+                }, 
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
@@ -0,0 +1,131 @@
+"""
+Typed in-process representation of rainfall forecasts.
+
+A Forecast holds its days as a NumPy structured array of (day number,
+rainfall), where the day number counts days since 1970-01-01 in local time.
+OpenWeatherMap's 3-hour items are bucketed into days in one vectorized pass,
+and padding, sorting and averaging work on the arrays directly. The JSON
+shape ({'forecast': [{'date', 'rainfall'}], 'averageRainfall'}) is only
+built at the edge, by `to_dict`.
+"""
+import time
+from datetime import datetime
+import numpy as np
+from bson.binary import Binary
+
+FORECAST_DTYPE = np.dtype([('day', '<i4'), ('rainfall', '<f8')])
+
+# Number of days a forecast covers
+FORECAST_DAYS = 7
+
+SECONDS_PER_DAY = 86400
+
+def local_day_numbers(timestamps):
+    """
+    Convert Unix timestamps (array) to local day numbers.
+    """
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+    if timestamps.size == 0:
+        return timestamps.astype('<i4')
+    # One UTC offset for the whole (5-day) horizon
+    offset = time.localtime(int(timestamps[0])).tm_gmtoff
+    return ((timestamps + offset) // SECONDS_PER_DAY).astype('<i4')
+
+def today_number(now=None):
+    now = now or datetime.now()
+    return (now.date() - datetime(1970, 1, 1).date()).days
+
+class Forecast:
+    """
+    Daily rainfall for one location, plus its average.
+    """
+    __slots__ = ('days', 'average_rainfall', 'note')
+
+    def __init__(self, days, average_rainfall, note=None):
+        self.days = days
+        self.average_rainfall = average_rainfall
+        self.note = note
+
+    @classmethod
+    def from_items(cls, items, today=None):
+        """
+        Build a forecast from OpenWeatherMap 3-hour items: rainfall is summed
+        per day, and missing days from today on are filled with the average
+        until there are FORECAST_DAYS days.
+        """
+        count = len(items)
+        timestamps = np.fromiter((item['dt'] for item in items), dtype=np.int64, count=count)
+        rainfall = np.fromiter(
+            ((item.get('rain') or {}).get('3h', 0) for item in items), dtype=np.float64, count=count
+        )
+
+        # Bucket the items into days: unique (sorted) days and the sum per day
+        day_numbers, index = np.unique(local_day_numbers(timestamps), return_inverse=True)
+        daily = np.bincount(index, weights=rainfall, minlength=len(day_numbers))
+
+        average_rainfall = float(daily.mean()) if len(daily) else 2.0
+
+        # Pad with the average for days from today that have no items
+        if len(day_numbers) < FORECAST_DAYS:
+            start = today if today is not None else today_number()
+            missing = np.setdiff1d(np.arange(start, start + FORECAST_DAYS), day_numbers)
+            missing = missing[:FORECAST_DAYS - len(day_numbers)]
+            day_numbers = np.concatenate([day_numbers, missing])
+            daily = np.concatenate([daily, np.full(len(missing), average_rainfall)])
+
+        days = np.empty(len(day_numbers), dtype=FORECAST_DTYPE)
+        days['day'] = day_numbers
+        days['rainfall'] = daily
+        days.sort(order='day')
+        return cls(days[:FORECAST_DAYS], average_rainfall)
+
+    @classmethod
+    def from_values(cls, rainfall, average_rainfall=None, start=None, note=None):
+        """
+        Build a forecast of consecutive daily values starting today (or `start`).
+        The average defaults to the mean of the values.
+        """
+        rainfall = np.asarray(rainfall, dtype=np.float64)
+        start = start if start is not None else today_number()
+        days = np.empty(len(rainfall), dtype=FORECAST_DTYPE)
+        days['day'] = np.arange(start, start + len(rainfall))
+        days['rainfall'] = rainfall
+        if average_rainfall is None:
+            average_rainfall = float(rainfall.mean()) if len(rainfall) else 0.0
+        return cls(days, average_rainfall, note)
+
+    def dates(self):
+        """
+        The forecast days as 'YYYY-MM-DD' strings.
+        """
+        return np.datetime_as_string(self.days['day'].astype('datetime64[D]'), unit='D').tolist()
+
+    def to_dict(self):
+        """
+        Convert to the API weatherData shape.
+        """
+        weather_data = {
+            'forecast': [
+                {'date': date, 'rainfall': rainfall}
+                for date, rainfall in zip(self.dates(), self.days['rainfall'].tolist())
+            ],
+            'averageRainfall': self.average_rainfall,
+        }
+        if self.note:
+            weather_data['note'] = self.note
+        return weather_data
+
+    def to_document(self):
+        """
+        Encode for storage in MongoDB (see from_document).
+        """
+        return {
+            'days': Binary(self.days.tobytes()),
+            'avg': self.average_rainfall,
+            'note': self.note,
+        }
+
+    @classmethod
+    def from_document(cls, document):
+        days = np.frombuffer(bytes(document['days']), dtype=FORECAST_DTYPE).copy()
+        return cls(days, document['avg'], document.get('note'))
@@ -2,10 +2,11 @@
 Weather service for fetching rainfall data from OpenWeatherMap API.
 """
 import requests
-import json
-from datetime import datetime, timedelta
 from django.conf import settings
 import logging
+from .singleflight import flight
+from .weather_model import Forecast, FORECAST_DAYS
+from . import shared_cache
 
 # Set up logging
 logger = logging.getLogger(__name__)
@@ -13,6 +14,20 @@ logger = logging.getLogger(__name__)
 # OpenWeatherMap API key from settings
 API_KEY = settings.OPENWEATHERMAP_API_KEY
 
+# Base URL of the OpenWeatherMap API (overridable to point at a stub server)
+BASE_URL = settings.OPENWEATHERMAP_BASE_URL.rstrip('/')
+
+# Concurrent lookups for the same place share one upstream call (across processes too)
+geocode_flight = flight('geocode', cross_process=True)
+forecast_flight = flight(
+    'forecast',
+    cross_process=True,
+    codec=(Forecast.to_document, Forecast.from_document)
+)
+
+def _location_key(location):
+    return ' '.join((location or '').lower().split())
+
 def get_coordinates(location):
     """
     Convert location string to coordinates.
@@ -25,12 +40,19 @@ def get_coordinates(location):
             return lat, lon
         
         # Otherwise, geocode the city name
-        geocoding_url = f"http://api.openweathermap.org/geo/1.0/direct?q={location}&limit=1&appid={API_KEY}"
+        geocoding_url = f"{BASE_URL}/geo/1.0/direct?q={location}&limit=1&appid={API_KEY}"
         
-        response = requests.get(geocoding_url, timeout=5)
-        data = response.json()
+        key = _location_key(location)
+        data = shared_cache.get_or_set(
+            'geocode',
+            key,
+            lambda: geocode_flight.do(key, lambda: requests.get(geocoding_url, timeout=5).json()),
+            settings.GEOCODE_CACHE_SECONDS,
+            # Only cache places that were found (error bodies are non-empty dicts)
+            cacheable=lambda data: isinstance(data, list) and len(data) > 0
+        )
         
-        if data and len(data) > 0:
+        if isinstance(data, list) and len(data) > 0:
             lat = data[0]['lat']
             lon = data[0]['lon']
             return lat, lon
@@ -44,10 +66,33 @@ def get_coordinates(location):
         # Return default coordinates (London)
         return 51.5074, -0.1278
 
+def get_forecast(location):
+    """
+    Get the typed forecast (see weather_model.Forecast) for the given location.
+    
+    Forecasts are cached node-wide for WEATHER_CACHE_SECONDS, and concurrent
+    requests for the same location share one fetch.
+    """
+    key = _location_key(location)
+    return shared_cache.get_or_set(
+        'forecast',
+        key,
+        lambda: forecast_flight.do(key, lambda: _fetch_forecast(location)),
+        settings.WEATHER_CACHE_SECONDS,
+        # Simulated fallback forecasts are not cached, so the API is retried
+        cacheable=lambda forecast: not forecast.note
+    )
+
 def get_weather_forecast(location):
     """
     Get weather forecast for the given location.
-    Returns rainfall data for the next 7 days.
+    Returns rainfall data for the next 7 days in the API response shape.
+    """
+    return get_forecast(location).to_dict()
+
+def _fetch_forecast(location):
+    """
+    Fetch and process the forecast for a location (see get_forecast).
     """
     try:
         logger.info(f"Getting weather forecast for location: {location}")
@@ -64,7 +109,7 @@ def get_weather_forecast(location):
         try:
             # Fetch 5-day forecast (3-hour intervals) from OpenWeatherMap
             logger.info(f"Fetching forecast from OpenWeatherMap API for coordinates: {lat}, {lon}")
-            forecast_url = f"https://api.openweathermap.org/data/2.5/forecast?lat={lat}&lon={lon}&appid={API_KEY}&units=metric"
+            forecast_url = f"{BASE_URL}/data/2.5/forecast?lat={lat}&lon={lon}&appid={API_KEY}&units=metric"
             response = requests.get(forecast_url, timeout=10)  # Increased timeout
             
             if response.status_code != 200:
@@ -74,66 +119,14 @@ def get_weather_forecast(location):
             forecast_data = response.json()
             logger.info("Successfully received forecast data from OpenWeatherMap API")
             
-            # Process forecast data to extract rainfall
-            processed_forecast = []
-            
-            # Group by day
-            daily_rainfall = {}
-            
-            for item in forecast_data.get('list', []):
-                # Extract date
-                timestamp = item['dt']
-                date = datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d')
-                
-                # Extract rainfall (mm)
-                # OpenWeatherMap provides rainfall as 'rain.3h' (rainfall in mm for 3 hours)
-                rainfall = item.get('rain', {}).get('3h', 0)
-                
-                # Accumulate rainfall by day
-                if date in daily_rainfall:
-                    daily_rainfall[date] += rainfall
-                else:
-                    daily_rainfall[date] = rainfall
-            
-            # Convert to list of daily forecasts
-            for date, rainfall in daily_rainfall.items():
-                processed_forecast.append({
-                    'date': date,
-                    'rainfall': rainfall
-                })
-            
-            # Sort by date
-            processed_forecast.sort(key=lambda x: x['date'])
-            
-            # Calculate average rainfall
-            if processed_forecast:
-                total_rainfall = sum(day['rainfall'] for day in processed_forecast)
-                average_rainfall = total_rainfall / len(processed_forecast) if len(processed_forecast) > 0 else 2.0
-            else:
+            # Bucket the 3-hour items into days in one vectorized pass
+            items = forecast_data.get('list', [])
+            if not items:
                 logger.warning("No forecast data available, using default average rainfall")
-                average_rainfall = 2.0
-            
-            # If we have less than 7 days of forecast, extend with average values
-            current_date = datetime.now()
-            forecast_dates = [item['date'] for item in processed_forecast]
-            
-            for i in range(7):
-                date_str = (current_date + timedelta(days=i)).strftime('%Y-%m-%d')
-                if date_str not in forecast_dates and len(processed_forecast) < 7:
-                    processed_forecast.append({
-                        'date': date_str,
-                        'rainfall': average_rainfall
-                    })
+            forecast = Forecast.from_items(items)
             
-            # Sort again and limit to 7 days
-            processed_forecast.sort(key=lambda x: x['date'])
-            processed_forecast = processed_forecast[:7]
-            
-            logger.info(f"Successfully processed forecast data with average rainfall: {average_rainfall}")
-            return {
-                'forecast': processed_forecast,
-                'averageRainfall': average_rainfall
-            }
+            logger.info(f"Successfully processed forecast data with average rainfall: {forecast.average_rainfall}")
+            return forecast
         
         except Exception as e:
             logger.error(f"Error fetching from OpenWeatherMap API: {str(e)}", exc_info=True)
@@ -143,9 +136,6 @@ def get_weather_forecast(location):
     except Exception as e:
         logger.warning(f"Using default rainfall data due to error: {str(e)}")
         # Generate default forecast with reasonable rainfall values
-        current_date = datetime.now()
-        default_forecast = []
-        
         # Use location to determine default rainfall
         location_lower = location.lower() if location else ""
         if "coimbatore" in location_lower:
@@ -161,18 +151,12 @@ def get_weather_forecast(location):
         
         # Generate default forecast with slight variations
         import random
-        for i in range(7):
-            date_str = (current_date + timedelta(days=i)).strftime('%Y-%m-%d')
-            # Add some randomness to make it look realistic
-            rainfall_value = default_rainfall * (0.8 + 0.4 * random.random())
-            default_forecast.append({
-                'date': date_str,
-                'rainfall': round(rainfall_value, 1)
-            })
+        # Add some randomness to make it look realistic
+        rainfall_values = [round(default_rainfall * (0.8 + 0.4 * random.random()), 1) for _ in range(FORECAST_DAYS)]
         
         logger.info(f"Generated default rainfall data with average: {default_rainfall}")
-        return {
-            'forecast': default_forecast,
-            'averageRainfall': default_rainfall,
-            'note': 'Using simulated rainfall data due to API issues'
-        }
+        return Forecast.from_values(
+            rainfall_values,
+            average_rainfall=default_rainfall,
+            note='Using simulated rainfall data due to API issues'
+        )
@@ -5,6 +5,7 @@ Django settings for rainwater_harvester project.
 import os
 from pathlib import Path
 from dotenv import load_dotenv
+from corsheaders.defaults import default_headers
 
 # Load environment variables from .env file
 load_dotenv()
@@ -37,8 +38,10 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'rainwater_harvester.api.middleware.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
+    'rainwater_harvester.api.middleware.AdmissionControlMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
@@ -70,6 +73,37 @@ WSGI_APPLICATION = 'rainwater_harvester.wsgi.application'
 MONGODB_URI = os.getenv('MONGODB_URI', 'mongodb://localhost:27017/')
 MONGODB_NAME = os.getenv('MONGODB_NAME', 'rainwater_harvester')
 
+# Write concern used by the repository layer (w may be a number or 'majority')
+MONGODB_WRITE_CONCERN_W = os.getenv('MONGODB_WRITE_CONCERN_W', '1')
+MONGODB_WRITE_CONCERN_J = os.getenv('MONGODB_WRITE_CONCERN_J', 'False') == 'True'
+
+# Read routing per GET route: 'primary', or 'secondary' (a secondary at most
+# max_staleness seconds behind, >= 90). Clients that send back the
+# X-Causal-Token of their last write always see it (causal sessions).
+# Secondary routes read from the primary unless MONGODB_WRITE_CONCERN_W is 'majority'.
+MONGODB_READ_ROUTING = {
+    route: {
+        'mode': os.getenv(f'READ_ROUTING_{route.upper()}_MODE', mode),
+        'max_staleness': int(os.getenv(f'READ_ROUTING_{route.upper()}_MAX_STALENESS', '90')),
+    }
+    for route, mode in (
+        ('results', 'primary'),
+        ('history', 'secondary'),
+        ('portfolio', 'secondary'),
+        ('maintenance', 'secondary'),
+        ('export', 'secondary'),
+    )
+}
+
+# Where the repositories store data: 'mongodb', or 'sqlite' for an embedded
+# single-node database (SQLITE_STORAGE_PATH, in WAL mode)
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'mongodb')
+SQLITE_STORAGE_PATH = os.getenv('SQLITE_STORAGE_PATH', os.path.join(BASE_DIR, 'storage.sqlite3'))
+SQLITE_SYNCHRONOUS = os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL')
+
+# Upper bound (seconds) on how stale cached settings can be without change streams
+SETTINGS_CACHE_POLL_INTERVAL = float(os.getenv('SETTINGS_CACHE_POLL_INTERVAL', '5'))
+
 DATABASES = {
     'default': {
         'ENGINE': 'djongo',
@@ -136,6 +170,174 @@ CORS_ALLOWED_ORIGINS = [
     'http://127.0.0.1:3000',
     'http://127.0.0.1:63336',  # Browser preview
 ]
+# Let browsers read and send back the read-your-writes token
+CORS_EXPOSE_HEADERS = ['X-Causal-Token', 'Idempotent-Replayed']
+CORS_ALLOW_HEADERS = list(default_headers) + ['x-causal-token', 'idempotency-key']
 
 # OpenWeatherMap API settings
 OPENWEATHERMAP_API_KEY = os.getenv('OPENWEATHERMAP_API_KEY', '')
+OPENWEATHERMAP_BASE_URL = os.getenv('OPENWEATHERMAP_BASE_URL', 'https://api.openweathermap.org')
+
+# Node-wide cache shared by all worker processes (shared_cache.py): diskcache
+# when installed, otherwise Django's file-based cache
+SHARED_CACHE_DIR = os.getenv('SHARED_CACHE_DIR', os.path.join(BASE_DIR, 'cache'))
+SHARED_CACHE_SIZE_LIMIT = int(os.getenv('SHARED_CACHE_SIZE_LIMIT', str(256 * 1024 * 1024)))
+try:
+    import diskcache  # noqa: F401
+    SHARED_CACHE_BACKEND = {
+        'BACKEND': 'diskcache.DjangoCache',
+        'LOCATION': SHARED_CACHE_DIR,
+        'SHARDS': int(os.getenv('SHARED_CACHE_SHARDS', '8')),
+        'DATABASE_TIMEOUT': 0.05,
+        'OPTIONS': {
+            'size_limit': SHARED_CACHE_SIZE_LIMIT,
+            'eviction_policy': 'least-recently-used',
+            'statistics': 1,
+        },
+    }
+except ImportError:  # diskcache is optional
+    SHARED_CACHE_BACKEND = {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': SHARED_CACHE_DIR,
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    }
+CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'shared': SHARED_CACHE_BACKEND,
+}
+
+# How long (seconds) forecasts, geocoding results and result lookups stay in the shared cache
+WEATHER_CACHE_SECONDS = float(os.getenv('WEATHER_CACHE_SECONDS', '1800'))
+GEOCODE_CACHE_SECONDS = float(os.getenv('GEOCODE_CACHE_SECONDS', str(7 * 24 * 3600)))
+RESULT_CACHE_SECONDS = float(os.getenv('RESULT_CACHE_SECONDS', '300'))
+
+# Response compression settings (bodies smaller than this are sent as-is)
+RESPONSE_COMPRESSION_MIN_SIZE = int(os.getenv('RESPONSE_COMPRESSION_MIN_SIZE', '1024'))
+RESPONSE_COMPRESSION_BROTLI_QUALITY = int(os.getenv('RESPONSE_COMPRESSION_BROTLI_QUALITY', '5'))
+
+# Retention settings: days each collection keeps documents in MongoDB before
+# they are moved to the compressed archive (0 disables archival)
+RETENTION_DAYS = {
+    'user_inputs': int(os.getenv('RETENTION_USER_INPUTS_DAYS', '365')),
+    'calculation_results': int(os.getenv('RETENTION_CALCULATION_RESULTS_DAYS', '180')),
+    'historical_data': int(os.getenv('RETENTION_HISTORICAL_DATA_DAYS', '365')),
+}
+RETENTION_BATCH_SIZE = int(os.getenv('RETENTION_BATCH_SIZE', '1000'))
+ARCHIVE_DIR = os.getenv('ARCHIVE_DIR', os.path.join(BASE_DIR, 'archive'))
+ARCHIVE_ZSTD_LEVEL = int(os.getenv('ARCHIVE_ZSTD_LEVEL', '10'))
+
+# Bulk export settings
+EXPORT_BATCH_SIZE = int(os.getenv('EXPORT_BATCH_SIZE', '5000'))
+EXPORT_CHUNK_ROWS = int(os.getenv('EXPORT_CHUNK_ROWS', '10000'))
+EXPORT_PARQUET_ROW_GROUP_ROWS = int(os.getenv('EXPORT_PARQUET_ROW_GROUP_ROWS', '100000'))
+
+# Largest grid a single scenario sweep may evaluate
+SCENARIO_SWEEP_MAX_POINTS = int(os.getenv('SCENARIO_SWEEP_MAX_POINTS', '250000'))
+
+# Results updated per bulk write by the background recompute
+RECOMPUTE_BATCH_SIZE = int(os.getenv('RECOMPUTE_BATCH_SIZE', '1000'))
+# A running recompute job not renewed for this long is picked up again by --resume
+RECOMPUTE_LEASE_SECONDS = int(os.getenv('RECOMPUTE_LEASE_SECONDS', '300'))
+# Recompute stored results when the water or maintenance cost setting changes
+# (recompute needs MongoDB, so off by default on other storage backends)
+RECOMPUTE_ON_SETTINGS_CHANGE = os.getenv(
+    'RECOMPUTE_ON_SETTINGS_CHANGE', str(STORAGE_BACKEND == 'mongodb')
+) == 'True'
+
+# Largest number of top-ranked sites a portfolio report may return
+PORTFOLIO_MAX_TOP = int(os.getenv('PORTFOLIO_MAX_TOP', '100'))
+
+# Background job settings (run_jobs); a job whose lease is not renewed for
+# JOBS_LEASE_SECONDS is picked up by another worker
+JOBS_CONCURRENCY = int(os.getenv('JOBS_CONCURRENCY', str(os.cpu_count() or 1)))
+JOBS_LEASE_SECONDS = int(os.getenv('JOBS_LEASE_SECONDS', '60'))
+JOBS_POLL_INTERVAL = float(os.getenv('JOBS_POLL_INTERVAL', '1.0'))
+JOBS_MAX_ATTEMPTS = int(os.getenv('JOBS_MAX_ATTEMPTS', '3'))
+JOBS_SWEEP_MAX_POINTS = int(os.getenv('JOBS_SWEEP_MAX_POINTS', '2000000'))
+
+# Admission control per endpoint (see api/admission.py); limits are per server
+# process. rate/burst: per-client token bucket (0 disables), concurrency:
+# requests in progress, queue/queue_timeout: requests that may wait for a slot
+ADMISSION_CONTROL = {
+    'inputs': {
+        'path': '/api/inputs/',
+        'methods': ['POST'],
+        'rate': float(os.getenv('ADMISSION_INPUTS_RATE', '2')),
+        'burst': int(os.getenv('ADMISSION_INPUTS_BURST', '10')),
+        'concurrency': int(os.getenv('ADMISSION_INPUTS_CONCURRENCY', '8')),
+        'queue': int(os.getenv('ADMISSION_INPUTS_QUEUE', '16')),
+        'queue_timeout': float(os.getenv('ADMISSION_INPUTS_QUEUE_TIMEOUT', '2')),
+    },
+    'weather': {
+        'path': '/api/weather/',
+        'methods': ['GET'],
+        'rate': float(os.getenv('ADMISSION_WEATHER_RATE', '2')),
+        'burst': int(os.getenv('ADMISSION_WEATHER_BURST', '10')),
+        'concurrency': int(os.getenv('ADMISSION_WEATHER_CONCURRENCY', '8')),
+        'queue': int(os.getenv('ADMISSION_WEATHER_QUEUE', '16')),
+        'queue_timeout': float(os.getenv('ADMISSION_WEATHER_QUEUE_TIMEOUT', '2')),
+    },
+    'scenarios': {
+        'path': '/api/scenarios/',
+        'methods': ['POST'],
+        'rate': float(os.getenv('ADMISSION_SCENARIOS_RATE', '1')),
+        'burst': int(os.getenv('ADMISSION_SCENARIOS_BURST', '5')),
+        'concurrency': int(os.getenv('ADMISSION_SCENARIOS_CONCURRENCY', '4')),
+        'queue': int(os.getenv('ADMISSION_SCENARIOS_QUEUE', '8')),
+        'queue_timeout': float(os.getenv('ADMISSION_SCENARIOS_QUEUE_TIMEOUT', '2')),
+    },
+    'allocation': {
+        'path': '/api/allocation/',
+        'methods': ['POST'],
+        'rate': float(os.getenv('ADMISSION_ALLOCATION_RATE', '1')),
+        'burst': int(os.getenv('ADMISSION_ALLOCATION_BURST', '5')),
+        'concurrency': int(os.getenv('ADMISSION_ALLOCATION_CONCURRENCY', '4')),
+        'queue': int(os.getenv('ADMISSION_ALLOCATION_QUEUE', '8')),
+        'queue_timeout': float(os.getenv('ADMISSION_ALLOCATION_QUEUE_TIMEOUT', '2')),
+    },
+}
+# Only trust X-Forwarded-For behind a proxy that sets it
+ADMISSION_TRUST_FORWARDED_FOR = os.getenv('ADMISSION_TRUST_FORWARDED_FOR', 'False') == 'True'
+ADMISSION_MAX_CLIENTS = int(os.getenv('ADMISSION_MAX_CLIENTS', '10000'))
+
+# Single-flight coalescing: how long a process may lead an upstream fetch
+# before others stop waiting, and how long its result is shared afterwards
+SINGLEFLIGHT_CROSS_PROCESS = os.getenv(
+    'SINGLEFLIGHT_CROSS_PROCESS', str(STORAGE_BACKEND == 'mongodb')
+) == 'True'
+SINGLEFLIGHT_LEASE_SECONDS = float(os.getenv('SINGLEFLIGHT_LEASE_SECONDS', '20'))
+SINGLEFLIGHT_RESULT_SECONDS = float(os.getenv('SINGLEFLIGHT_RESULT_SECONDS', '10'))
+
+# Tank level steps used by the water allocation planner
+ALLOCATION_LEVELS = int(os.getenv('ALLOCATION_LEVELS', '101'))
+
+# History series endpoint: points returned by default and at most
+HISTORY_SERIES_DEFAULT_POINTS = int(os.getenv('HISTORY_SERIES_DEFAULT_POINTS', '200'))
+HISTORY_SERIES_MAX_POINTS = int(os.getenv('HISTORY_SERIES_MAX_POINTS', '2000'))
+
+# History search page size: default and maximum
+HISTORY_SEARCH_DEFAULT_LIMIT = int(os.getenv('HISTORY_SEARCH_DEFAULT_LIMIT', '50'))
+HISTORY_SEARCH_MAX_LIMIT = int(os.getenv('HISTORY_SEARCH_MAX_LIMIT', '500'))
+
+# Percentile sketches: t-digest compression (centroids kept, roughly) and
+# values buffered per sketch before they are folded into the digest
+SKETCH_COMPRESSION = int(os.getenv('SKETCH_COMPRESSION', '100'))
+SKETCH_BUFFER_SIZE = int(os.getenv('SKETCH_BUFFER_SIZE', '32'))
+
+# Per-location prediction models: minimum samples before predicting, how long
+# fitted models stay cached in memory, and new history entries that trigger a retrain
+PREDICTION_ENABLED = os.getenv('PREDICTION_ENABLED', str(STORAGE_BACKEND == 'mongodb')) == 'True'
+PREDICTION_MIN_SAMPLES = int(os.getenv('PREDICTION_MIN_SAMPLES', '10'))
+PREDICTION_CACHE_SECONDS = float(os.getenv('PREDICTION_CACHE_SECONDS', '300'))
+PREDICTION_RETRAIN_MIN_NEW = int(os.getenv('PREDICTION_RETRAIN_MIN_NEW', '50'))
+# Entries whose _id is up to this many seconds older than the last trained one
+# are checked again, so writes that commit late are still trained on
+PREDICTION_TRAIN_OVERLAP_SECONDS = int(os.getenv('PREDICTION_TRAIN_OVERLAP_SECONDS', '300'))
+
+# Idempotency keys on POST /api/inputs/ and /api/save-results/: how long a key
+# is remembered, how long a request owns a key before a retry may take it
+# over, and how long a duplicate waits for the first request
+IDEMPOTENCY_ENABLED = os.getenv('IDEMPOTENCY_ENABLED', str(STORAGE_BACKEND == 'mongodb')) == 'True'
+IDEMPOTENCY_TTL_SECONDS = float(os.getenv('IDEMPOTENCY_TTL_SECONDS', '86400'))
+IDEMPOTENCY_LEASE_SECONDS = float(os.getenv('IDEMPOTENCY_LEASE_SECONDS', '120'))
+IDEMPOTENCY_WAIT_SECONDS = float(os.getenv('IDEMPOTENCY_WAIT_SECONDS', '30'))
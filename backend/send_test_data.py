@@ -7,12 +7,7 @@ import random
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'rainwater_harvester.settings')
 django.setup()
 
-from rainwater_harvester.api.database import (
-    save_user_input,
-    save_calculation_results,
-    save_historical_data,
-    save_user_settings
-)
+from rainwater_harvester.api import repository
 
 def generate_test_data():
     # List of test locations
@@ -29,14 +24,15 @@ def generate_test_data():
             'location': location,
             'timestamp': datetime.now().isoformat()
         }
-        result = save_user_input(input_data)
+        result = repository.inputs.save(input_data)
         print(f"Added input for {location}: {result}")
 
     # 2. Generate Historical Data
     print("\n2. Generating Historical Data...")
+    entries = []
     for i in range(7):  # Last 7 days of data
         for location in locations:
-            historical_data = {
+            entries.append({
                 'timestamp': (datetime.now() - timedelta(days=i)).isoformat(),
                 'location': location,
                 'roofArea': random.randint(80, 200),
@@ -51,9 +47,10 @@ def generate_test_data():
                     'gardening': random.randint(10, 30)
                 },
                 'isLeaking': random.choice([True, False])
-            }
-            result = save_historical_data(historical_data)
-            print(f"Added historical data for {location} on day -{i}: {result.get('_id') if result else 'Failed'}")
+            })
+    # One unordered batch instead of a round trip per document
+    saved = repository.history.save_many(entries)
+    print(f"Added {len(saved)} historical data entries")
 
     # 3. Generate Calculation Results
     print("\n3. Generating Calculation Results...")
@@ -62,7 +59,7 @@ def generate_test_data():
         'tankCapacity': 5000,
         'location': 'Chennai'
     }
-    input_result = save_user_input(latest_input)
+    input_result = repository.inputs.save(latest_input)
     
     if input_result:
         calculation = {
@@ -78,8 +75,8 @@ def generate_test_data():
                 'nextMonth': random.uniform(2000, 4000)
             }
         }
-        result = save_calculation_results(calculation)
-        print(f"Added calculation result: {result.get('_id') if result else 'Failed'}")
+        result = repository.results.save(input_result['_id'], input_result['location'], calculation)
+        print(f"Added calculation result: {result['_id']}")
 
     # 4. Update User Settings
     print("\n4. Updating User Settings...")
@@ -94,8 +91,8 @@ def generate_test_data():
             'measurementUnit': 'metric'
         }
     }
-    result = save_user_settings(settings)
-    print(f"Updated settings: {result.get('_id') if result else 'Failed'}")
+    result = repository.user_settings.update(settings)
+    print(f"Updated settings: {result['_id']}")
 
 if __name__ == "__main__":
     generate_test_data()
@@ -0,0 +1,55 @@
+"""
+Check that every history search shape is served by an index.
+
+Runs explain() for each filter shape in SEARCH_SHAPES (and its second page)
+against the configured MongoDB and fails if a plan scans the collection or
+sorts in memory. Run `python manage.py ensure_indexes` (and
+`python manage.py backfill_history_fields` for older data) first.
+"""
+import os
+import django
+
+# Set up Django environment
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'rainwater_harvester.settings')
+django.setup()
+
+from rainwater_harvester.api.database import db
+from rainwater_harvester.api.history_search import (
+    SEARCH_SHAPES, parse_search, build_query, encode_cursor, decode_cursor, plan_stages
+)
+
+def explain(search):
+    query, sort = build_query(search)
+    plan = db.historical_data.find(query).sort(sort).limit(search['limit']).explain()
+    stats = plan.get('executionStats', {})
+    return plan_stages(plan['queryPlanner']['winningPlan']), stats
+
+def test_history_search():
+    failures = []
+    for name, params in SEARCH_SHAPES.items():
+        search = parse_search(params, default_limit=20)
+        pages = [('page 1', search)]
+        # Keyset paging must stay on the index too
+        query, sort = build_query(search)
+        last = list(db.historical_data.find(query).sort(sort).limit(search['limit']))[-1:]
+        if last:
+            sort_name = search['sort'][0]
+            after = decode_cursor(encode_cursor(last[0], sort_name), sort_name)
+            pages.append(('page 2', dict(search, after=after)))
+
+        for page, page_search in pages:
+            stages, stats = explain(page_search)
+            problems = [stage for stage in stages if stage in ('COLLSCAN', 'SORT')]
+            print(
+                f"{name} ({page}): {' <- '.join(stages)}"
+                f" | keys examined {stats.get('totalKeysExamined', '?')},"
+                f" returned {stats.get('nReturned', '?')}"
+            )
+            if problems:
+                failures.append(f"{name} ({page}): {', '.join(problems)}")
+
+    assert not failures, 'Plans not served by an index:\n' + '\n'.join(failures)
+    print(f"All {len(SEARCH_SHAPES)} search shapes use an index without an in-memory sort")
+
+if __name__ == "__main__":
+    test_history_search()
@@ -14,18 +14,8 @@ class MongoJSONEncoder(json.JSONEncoder):
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'rainwater_harvester.settings')
 django.setup()
 
-from rainwater_harvester.api.database import (
-    get_mongodb_status,
-    save_user_input,
-    get_latest_inputs,
-    save_calculation_results,
-    get_latest_results,
-    save_historical_data,
-    get_historical_data,
-    save_user_settings,
-    get_user_settings,
-    delete_saved_result
-)
+from rainwater_harvester.api.database import get_mongodb_status
+from rainwater_harvester.api import repository
 
 def test_all_operations():
     print("\n=== Testing MongoDB Operations ===\n")
@@ -47,10 +37,10 @@ def test_all_operations():
         'location': 'New York',
         'timestamp': datetime.now().isoformat()
     }
-    saved_input = save_user_input(test_input)
+    saved_input = repository.inputs.save(test_input)
     print("Saved Input:", json.dumps(saved_input, indent=2, cls=MongoJSONEncoder))
 
-    latest_input = get_latest_inputs()
+    latest_input = repository.inputs.latest()
     print("Latest Input:", json.dumps(latest_input, indent=2, cls=MongoJSONEncoder))
 
     # 3. Test Calculation Results
@@ -60,10 +50,10 @@ def test_all_operations():
         'efficiency': 0.85,
         'recommendations': ['Clean gutters', 'Check tank seals']
     }
-    saved_result = save_calculation_results(test_result)
+    saved_result = repository.results.save(saved_input['_id'], saved_input['location'], test_result)
     print("Saved Result:", json.dumps(saved_result, indent=2, cls=MongoJSONEncoder))
 
-    latest_result = get_latest_results()
+    latest_result = repository.results.latest()
     print("Latest Result:", json.dumps(latest_result, indent=2, cls=MongoJSONEncoder))
 
     # 4. Test Historical Data
@@ -73,10 +63,10 @@ def test_all_operations():
         'rainfall': 25.4,
         'waterLevel': 750
     }
-    saved_historical = save_historical_data(test_historical)
+    saved_historical = repository.history.save(test_historical)
     print("Saved Historical Data:", json.dumps(saved_historical, indent=2, cls=MongoJSONEncoder))
 
-    historical_data = get_historical_data(limit=5)
+    historical_data = repository.history.list(limit=5)
     print("Recent Historical Data:", json.dumps(historical_data, indent=2, cls=MongoJSONEncoder))
 
     # 5. Test User Settings
@@ -87,17 +77,17 @@ def test_all_operations():
         'alertThreshold': 0.2,
         'notifications': True
     }
-    saved_settings = save_user_settings(test_settings)
+    saved_settings = repository.user_settings.update(test_settings)
     print("Saved Settings:", json.dumps(saved_settings, indent=2, cls=MongoJSONEncoder))
 
-    current_settings = get_user_settings()
+    current_settings = repository.user_settings.get()
     print("Current Settings:", json.dumps(current_settings, indent=2, cls=MongoJSONEncoder))
 
     # 6. Test Delete Operation
     if saved_result:
         print("\n6. Testing Delete Operation...")
         result_id = saved_result.get('_id')
-        deleted = delete_saved_result(result_id)
+        deleted = repository.results.delete(result_id)
         print(f"Delete Result: {'Success' if deleted else 'Failed'}")
 
 if __name__ == "__main__":
@@ -0,0 +1,63 @@
+"""
+Check read routing against a local replica set.
+
+Start a three-member replica set first, e.g.:
+
+    mkdir -p /tmp/rs/{0,1,2}
+    for i in 0 1 2; do mongod --replSet rs0 --port 2701$i --dbpath /tmp/rs/$i --fork --logpath /tmp/rs/$i.log; done
+    mongo --port 27010 --eval 'rs.initiate({_id: "rs0", members: [{_id: 0, host: "localhost:27010"}, {_id: 1, host: "localhost:27011"}, {_id: 2, host: "localhost:27012"}]})'
+
+then run with MONGODB_URI=mongodb://localhost:27010,localhost:27011,localhost:27012/?replicaSet=rs0
+and MONGODB_WRITE_CONCERN_W=majority.
+"""
+import os
+import django
+
+# Set up Django environment
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'rainwater_harvester.settings')
+django.setup()
+
+from rainwater_harvester.api import repository
+from rainwater_harvester.api.database import client, db
+from rainwater_harvester.api.read_routing import causal_writes, encode_token, majority_writes, route_reads, routed
+
+def test_read_routing(rounds=20):
+    print(f"Primary: {client.primary}, secondaries: {sorted(client.secondaries)}")
+    assert majority_writes(), 'Run with MONGODB_WRITE_CONCERN_W=majority'
+    assert client.secondaries, 'No secondaries; is MONGODB_URI a replica set?'
+    for i in range(rounds):
+        # Write like SaveResultsView does and keep the causal token
+        with causal_writes() as session:
+            entry = repository.history.save({
+                'location': 'ReadRoutingTest',
+                'inflow': 1.0,
+                'outflow': 1.0,
+                'tankCapacity': 1000.0,
+            })
+            token = encode_token(session)
+        assert token, 'No causal token; is MONGODB_URI a replica set?'
+
+        # Read it back like HistoricalDataView does ('history' is a secondary route)
+        with route_reads('history', token):
+            collection, read_session = routed(db.historical_data)
+            cursor = collection.find({'_id': entry['_id']}, session=read_session)
+            found = next(cursor, None)
+            address = cursor.address
+        assert found is not None, f"Round {i}: write not visible with its causal token"
+        assert address != client.primary, f"Round {i}: secondary route was served by the primary {address}"
+
+        # A primary route ('results') never leaves the primary
+        with route_reads('results', token):
+            collection, read_session = routed(db.historical_data)
+            cursor = collection.find({'_id': entry['_id']}, session=read_session)
+            found = next(cursor, None)
+            address = cursor.address
+        assert found is not None, f"Round {i}: write not visible on the primary"
+        assert address == client.primary, f"Round {i}: primary route was served by {address}"
+
+    print(f"{rounds} rounds: causal reads on the secondary route saw their writes from a secondary; "
+          f"the primary route stayed on the primary")
+    db.historical_data.delete_many({'location': 'ReadRoutingTest'})
+
+if __name__ == "__main__":
+    test_read_routing()
@@ -29,19 +29,36 @@ Chart.register(Filler);
 
 const AnalysisPage = () => {
   const [historicalData, setHistoricalData] = useState([]);
+  const [summary, setSummary] = useState(null);
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState('');
   const [timeRange, setTimeRange] = useState('month'); // 'week', 'month', 'year'
 
+  // Fetch the bucketed series for the selected time range; the server
+  // aggregates and downsamples, so the payload stays small for any range
   useEffect(() => {
     const fetchHistoricalData = async () => {
+      const start = new Date();
+      switch (timeRange) {
+        case 'week':
+          start.setDate(start.getDate() - 7);
+          break;
+        case 'year':
+          start.setFullYear(start.getFullYear() - 1);
+          break;
+        default:
+          start.setMonth(start.getMonth() - 1); // Default to month
+      }
+
       try {
-        const response = await apiService.getHistoricalData();
-        if (response && response.length > 0) {
-          setHistoricalData(response);
-        } else {
-          setError('No historical data found. Start using the system to generate data for analysis.');
-        }
+        const response = await apiService.getHistorySeries({
+          start: start.toISOString(),
+          bucket: timeRange === 'year' ? 'week' : 'day',
+          points: 120,
+        });
+        setHistoricalData(response.points || []);
+        setSummary(response.summary || null);
+        setError('');
       } catch (error) {
         console.error('Error fetching historical data:', error);
         setError('An error occurred while fetching historical data. Please try again.');
@@ -51,41 +68,19 @@ const AnalysisPage = () => {
     };
 
     fetchHistoricalData();
-  }, []);
-
-  // Filter data based on selected time range
-  const getFilteredData = () => {
-    if (!historicalData.length) return [];
-
-    const now = new Date();
-    let cutoffDate;
+  }, [timeRange]);
 
-    switch (timeRange) {
-      case 'week':
-        cutoffDate = new Date(now.setDate(now.getDate() - 7));
-        break;
-      case 'month':
-        cutoffDate = new Date(now.setMonth(now.getMonth() - 1));
-        break;
-      case 'year':
-        cutoffDate = new Date(now.setFullYear(now.getFullYear() - 1));
-        break;
-      default:
-        cutoffDate = new Date(now.setMonth(now.getMonth() - 1)); // Default to month
-    }
-
-    return historicalData.filter(item => new Date(item.timestamp) >= cutoffDate);
-  };
-
-  const filteredData = getFilteredData();
+  // Points are already limited to the selected time range
+  const filteredData = historicalData;
+  const labels = filteredData.map(point => new Date(point.t).toLocaleDateString());
 
   // Prepare data for rainfall trends chart
   const rainfallData = {
-    labels: filteredData.map(item => new Date(item.timestamp).toLocaleDateString()),
+    labels,
     datasets: [
       {
         label: 'Rainfall (mm)',
-        data: filteredData.map(item => item.rainfall),
+        data: filteredData.map(point => point.rainfall),
         borderColor: 'rgba(53, 162, 235, 0.8)',
         backgroundColor: 'rgba(53, 162, 235, 0.2)',
         tension: 0.4,
@@ -96,16 +91,16 @@ const AnalysisPage = () => {
 
   // Prepare data for inflow vs outflow chart
   const inflowOutflowData = {
-    labels: filteredData.map(item => new Date(item.timestamp).toLocaleDateString()),
+    labels,
     datasets: [
       {
         label: 'Inflow (liters/day)',
-        data: filteredData.map(item => item.inflow),
+        data: filteredData.map(point => point.inflow),
         backgroundColor: 'rgba(53, 162, 235, 0.5)',
       },
       {
         label: 'Outflow (liters/day)',
-        data: filteredData.map(item => item.outflow),
+        data: filteredData.map(point => point.outflow),
         backgroundColor: 'rgba(255, 99, 132, 0.5)',
       },
     ],
@@ -113,34 +108,25 @@ const AnalysisPage = () => {
 
   // Prepare data for tank capacity utilization chart
   const tankUtilizationData = {
-    labels: filteredData.map(item => new Date(item.timestamp).toLocaleDateString()),
+    labels,
     datasets: [
       {
         label: 'Tank Utilization (%)',
-        data: filteredData.map(item => (item.currentLevel / item.tankCapacity) * 100),
+        data: filteredData.map(point => point.utilization),
         backgroundColor: 'rgba(75, 192, 192, 0.5)',
       },
     ],
   };
 
-  // Calculate average values
+  // Average values over the whole range (computed by the server across all buckets)
   const calculateAverages = () => {
-    if (!filteredData.length) return { avgRainfall: 0, avgInflow: 0, avgOutflow: 0, avgUtilization: 0 };
-
-    const sum = filteredData.reduce((acc, item) => {
-      return {
-        rainfall: acc.rainfall + item.rainfall,
-        inflow: acc.inflow + item.inflow,
-        outflow: acc.outflow + item.outflow,
-        utilization: acc.utilization + ((item.currentLevel / item.tankCapacity) * 100),
-      };
-    }, { rainfall: 0, inflow: 0, outflow: 0, utilization: 0 });
+    if (!summary) return { avgRainfall: 0, avgInflow: 0, avgOutflow: 0, avgUtilization: 0 };
 
     return {
-      avgRainfall: (sum.rainfall / filteredData.length).toFixed(2),
-      avgInflow: (sum.inflow / filteredData.length).toFixed(2),
-      avgOutflow: (sum.outflow / filteredData.length).toFixed(2),
-      avgUtilization: (sum.utilization / filteredData.length).toFixed(2),
+      avgRainfall: (summary.rainfall || 0).toFixed(2),
+      avgInflow: (summary.inflow || 0).toFixed(2),
+      avgOutflow: (summary.outflow || 0).toFixed(2),
+      avgUtilization: (summary.utilization || 0).toFixed(2),
     };
   };
 
@@ -13,9 +13,26 @@ const api = axios.create({
   withCredentials: false
 });
 
+// Read-your-writes token of the last write (X-Causal-Token), sent with every
+// request so reads served by a database secondary still see our own writes
+let causalToken = null;
+
+api.interceptors.request.use(config => {
+  if (causalToken) {
+    config.headers['X-Causal-Token'] = causalToken;
+  }
+  return config;
+});
+
 // Add response interceptor for better error handling
 api.interceptors.response.use(
-  response => response,
+  response => {
+    const token = response.headers['x-causal-token'];
+    if (token) {
+      causalToken = token;
+    }
+    return response;
+  },
   error => {
     console.error('API Error:', error.response || error);
     return Promise.reject(error);
@@ -97,6 +114,21 @@ const apiService = {
     }
   },
 
+  // Time-bucketed history for charts (bucket, start, end, location, points, metric)
+  getHistorySeries: async (params = {}) => {
+    try {
+      const response = await api.get('/historical-data/series/', { params });
+      return response.data;
+    } catch (error) {
+      console.error('Error fetching history series:', error);
+      const errorMessage = error.response?.data?.message || 
+                          error.response?.data?.error || 
+                          'An error occurred while fetching historical data.';
+      // Create a proper Error object
+      throw new Error(errorMessage);
+    }
+  },
+
   // User settings
   getSettings: async () => {
     try {
@@ -158,6 +190,20 @@ const apiService = {
       };
     }
   },
+
+  // What-if scenario sweep (axes: number, list, or {min, max, steps})
+  sweepScenarios: async (sweepData) => {
+    try {
+      const response = await api.post('/scenarios/', sweepData);
+      return response.data;
+    } catch (error) {
+      console.error('Error evaluating scenarios:', error);
+      const errorMessage = error.response?.data?.message || 
+                          error.response?.data?.error || 
+                          'An error occurred while evaluating scenarios.';
+      throw new Error(errorMessage);
+    }
+  },
 };
 
 export default apiService;